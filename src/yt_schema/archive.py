@@ -0,0 +1,359 @@
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import time
+import zlib
+import peewee as p
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from yt_schema import bulk, database, metrics, migrate, tables, timeseries, timestamps
+from yt_schema.tables import BaseModel, db
+from yt_schema.timestamps import TimestampField
+
+# zlib level documents are stored at; 6 is within a few percent of 9's size
+# at a fraction of its cost.
+COMPRESSION_LEVEL: int = 6
+
+# Entries written or read per statement.
+CHUNK_SIZE: int = 500
+
+
+class ArchivedChannel(BaseModel):
+    """
+    One distinct version of a channel document: its keys other than
+    `entries`, and the (video id, digest) of every entry it listed.
+    """
+
+    channel_id = p.TextField()
+    digest = p.TextField()
+    # Uncompressed size, in bytes
+    size = p.BigIntegerField()
+    document = p.BlobField()
+    # Last time this version was ingested
+    archived_at = TimestampField(default=timestamps.now)
+
+    class Meta:
+        indexes = (
+            (("channel_id", "digest"), True),
+            (("channel_id", "archived_at"), False),
+        )
+
+
+class ArchivedEntry(BaseModel):
+    """
+    One distinct version of a video, stored once however many channel
+    versions list it.
+    """
+
+    video_id = p.TextField()
+    digest = p.TextField()
+    channel_id = p.TextField(null=True)
+    size = p.BigIntegerField()
+    document = p.BlobField()
+    archived_at = TimestampField(default=timestamps.now)
+
+    class Meta:
+        indexes = ((("video_id", "digest"), True),)
+
+
+def init(reset: bool = False):
+    if reset:
+        db.drop_tables([ArchivedChannel, ArchivedEntry], safe=True)
+    db.create_tables([ArchivedChannel, ArchivedEntry])
+    timestamps.upgrade([ArchivedChannel, ArchivedEntry])
+
+
+def encode(document: Dict) -> Tuple[str, bytes, int]:
+    """
+    Serialize a document canonically, so equal documents hash the same.
+
+    Returns:
+        Tuple[str, bytes, int]: SHA-256 of the JSON, the compressed JSON and
+            its uncompressed size.
+    """
+    raw = json.dumps(document, sort_keys=True, separators=(",", ":")).encode()
+    return (
+        hashlib.sha256(raw).hexdigest(),
+        zlib.compress(raw, COMPRESSION_LEVEL),
+        len(raw),
+    )
+
+
+def decode(blob) -> Dict:
+    # Postgres hands bytea back as a memoryview
+    return json.loads(zlib.decompress(bytes(blob)))
+
+
+def store(data: Dict, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Archive a channel document and its entries.
+
+    Entries already archived with the same content are not written again, so
+    re-ingesting a channel only stores the videos that changed.
+
+    Args:
+        data (Dict): The channel document; `entries` may be streamed.
+        chunk_size (int): Entries written per statement.
+
+    Returns:
+        int: Number of entries in the document.
+    """
+    channel_id = data.get("channel_id")
+    now = timestamps.now()
+    members: List[List[str]] = []
+
+    with db.atomic():
+        for chunk in p.chunked(tables.videos(data.get("entries")), chunk_size):
+            rows = []
+            for d in chunk:
+                digest, blob, size = encode(d)
+                video_id = d.get("id") or digest
+                members.append([video_id, digest])
+                rows.append(
+                    {
+                        "video_id": video_id,
+                        "digest": digest,
+                        "channel_id": channel_id,
+                        "size": size,
+                        "document": blob,
+                        "archived_at": now,
+                    }
+                )
+            ArchivedEntry.insert_many(rows).on_conflict_ignore().execute()
+
+        header = {k: v for k, v in data.items() if k != "entries"}
+        digest, blob, size = encode({"channel": header, "entries": members})
+        ArchivedChannel.insert(
+            channel_id=channel_id,
+            digest=digest,
+            size=size,
+            document=blob,
+            archived_at=now,
+        ).on_conflict(
+            conflict_target=[ArchivedChannel.channel_id, ArchivedChannel.digest],
+            preserve=[ArchivedChannel.archived_at],
+        ).execute()
+
+    logging.info(f"Archived {channel_id}: {len(members)} entries")
+    return len(members)
+
+
+class Entries:
+    """
+    The archived entries of a channel version, decompressed a chunk at a time.
+
+    Like `stream.Entries` it can be iterated more than once, each pass reading
+    the archive again, so memory stays bounded by one chunk.
+    """
+
+    def __init__(self, members: List[List[str]], chunk_size: int = CHUNK_SIZE):
+        self.members = members
+        self.chunk_size = chunk_size
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for chunk in p.chunked(self.members, self.chunk_size):
+            query = ArchivedEntry.select(
+                ArchivedEntry.video_id, ArchivedEntry.digest, ArchivedEntry.document
+            ).where(
+                # Only the versions listed, not every version of the videos
+                p.Tuple(ArchivedEntry.video_id, ArchivedEntry.digest).in_(
+                    [tuple(m) for m in chunk]
+                )
+            )
+            found = {(v, d): blob for v, d, blob in query.tuples()}
+            for video_id, digest in chunk:
+                yield decode(found[(video_id, digest)])
+
+
+def document(channel_id: str) -> Optional[Dict]:
+    """
+    The latest archived version of a channel, shaped like a loaded file.
+    """
+    row = (
+        ArchivedChannel.select(ArchivedChannel.document)
+        .where(ArchivedChannel.channel_id == channel_id)
+        .order_by(ArchivedChannel.archived_at.desc())
+        .first()
+    )
+    if row is None:
+        return None
+    doc = decode(row.document)
+    data = doc["channel"]
+    data["entries"] = Entries(doc["entries"])
+    return data
+
+
+def channels() -> List[str]:
+    query = ArchivedChannel.select(ArchivedChannel.channel_id).distinct()
+    return sorted(c for (c,) in query.tuples())
+
+
+class Replayed(NamedTuple):
+    channel_id: str
+    ok: bool
+    videos: int
+    seconds: float
+    # Per-stage totals, see `metrics.Metrics.as_dict`
+    stages: Dict
+
+
+def replay_channel(
+    channel_id: str, use_copy: bool = False, stats: bool = False
+) -> Replayed:
+    """
+    Reload one channel's tables from its latest archived version.
+    """
+    start = time.perf_counter()
+    m = metrics.begin()
+    videos = 0
+    ok = True
+    try:
+        migrate.refresh()
+        data = document(channel_id)
+        videos = len(data["entries"])
+        if stats:
+            with m.timed("timeseries"):
+                timeseries.create(data, changes_only=True)
+        if use_copy:
+            with m.timed("bulk"):
+                bulk.create(data, replace=True)
+        else:
+            with m.timed("tables"):
+                tables.create(data, replace=True)
+    except Exception:
+        logging.exception(f"Failed to replay {channel_id}")
+        ok = False
+    seconds = time.perf_counter() - start
+    return Replayed(channel_id, ok, videos, seconds, m.as_dict())
+
+
+def replay(
+    channel_ids: Optional[List[str]] = None,
+    workers: int = 1,
+    use_copy: bool = False,
+    stats: bool = False,
+    reset: bool = False,
+) -> List[Replayed]:
+    """
+    Rebuild the relational tables from the archive, a channel per worker
+    process, without reading the source files.
+
+    Args:
+        channel_ids (Optional[List[str]]): Channels to replay, default all.
+        workers (int): Worker processes.
+        use_copy (bool): Load through `bulk` instead of `tables`.
+        stats (bool): Also run `timeseries.create` in changes-only mode: a
+            channel snapshot, plus the video stats and heatmaps that differ
+            from the last known ones. Off by default, since replayed documents
+            are not new observations.
+        reset (bool): Drop and recreate the relational tables first, e.g.
+            after the mapping changed. The archive and time series are kept.
+
+    Returns:
+        List[Replayed]: One result per channel.
+    """
+    start = time.perf_counter()
+    tables.init(reset)
+    migrate.init()
+    init()
+    channel_ids = channel_ids or channels()
+    logging.info(f"Replaying {len(channel_ids)} channels")
+    # Workers open their own connections; nothing is shared across the fork
+    database.close()
+
+    job = functools.partial(replay_channel, use_copy=use_copy, stats=stats)
+    with multiprocessing.Pool(workers, initializer=database.after_fork) as pool:
+        results = list(pool.imap_unordered(job, channel_ids))
+
+    elapsed = time.perf_counter() - start
+    videos = sum(r.videos for r in results)
+    failed = sum(not r.ok for r in results)
+    logging.info(
+        f"replayed {len(results)} channels ({failed} failed), {videos} videos "
+        f"in {elapsed:.1f}s ({videos / max(elapsed, 1e-9):.1f} videos/s)"
+    )
+    total = metrics.Metrics()
+    for r in results:
+        total.merge(r.stages)
+    metrics.log_slowest(total.as_dict())
+    return results
+
+
+def summary() -> Dict[str, int]:
+    """
+    Archived versions and their raw and compressed bytes.
+    """
+    report = {}
+    for name, model in (("channels", ArchivedChannel), ("entries", ArchivedEntry)):
+        count, raw, stored = model.select(
+            p.fn.COUNT(model.id),
+            p.fn.COALESCE(p.fn.SUM(model.size), 0),
+            p.fn.COALESCE(p.fn.SUM(p.fn.LENGTH(model.document)), 0),
+        ).scalar(as_tuple=True)
+        report[name] = count
+        report[f"{name}_bytes"] = raw
+        report[f"{name}_stored_bytes"] = stored
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Inspect the raw document archive or replay it into the tables."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="archived versions and bytes stored")
+
+    parser_replay = commands.add_parser(
+        "replay", help="reload the tables from the archive"
+    )
+    parser_replay.add_argument(
+        "channel_ids", nargs="*", help="channels to replay (default: all)"
+    )
+    parser_replay.add_argument(
+        "--copy",
+        action="store_true",
+        help="bulk load entries and their child tables with COPY FROM STDIN",
+    )
+    parser_replay.add_argument(
+        "--stats",
+        action="store_true",
+        help="also record channel stats, and video stats and heatmaps that "
+        "differ from the last known ones",
+    )
+    parser_replay.add_argument(
+        "--reset",
+        action="store_true",
+        help="drop and recreate the relational tables first",
+    )
+    parser_replay.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="number of worker processes (default: number of CPUs)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args(argv)
+    if args.command == "stats":
+        init()
+        for name, value in summary().items():
+            print(f"{name}\t{value}")
+    elif args.command == "replay":
+        replay(args.channel_ids, args.workers, args.copy, args.stats, args.reset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import peewee as p
+from typing import Dict, List, Optional
+
+from yt_schema import bulk, database, metrics, rollup, stream, tables, timeseries
+
+# Stages of `metrics` that write a table, by prefix: their time is what a
+# table's rows/sec are measured against.
+WRITES = ("insert", "copy", "upsert", "rollup")
+
+# Header sets shared by every format, as yt-dlp emits them.
+HTTP_HEADERS: Dict[str, str] = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-us,en;q=0.5",
+    "Sec-Fetch-Mode": "navigate",
+}
+CODECS = [
+    ("avc1.64001F", "none"),
+    ("vp9", "none"),
+    ("none", "mp4a.40.2"),
+    ("none", "opus"),
+]
+LANGUAGES = "en es fr de ja pt ru ko it ar hi zh-Hans".split()
+CAPTION_EXTS = ["json3", "srv1", "srv2", "srv3", "ttml", "vtt"]
+
+
+def fmt(rng: random.Random, video_id: str, i: int, fragments: int) -> Dict:
+    vcodec, acodec = CODECS[i % len(CODECS)]
+    height = rng.choice([144, 240, 360, 480, 720, 1080])
+    return {
+        "format_id": str(100 + i),
+        "format_note": f"{height}p",
+        "ext": "mp4" if vcodec.startswith("avc") else "webm",
+        "protocol": "https" if fragments == 0 else "http_dash_segments",
+        "acodec": acodec,
+        "vcodec": vcodec,
+        "url": f"https://rr1---sn.googlevideo.com/videoplayback?id={video_id}&itag={i}",
+        "width": height * 16 // 9,
+        "height": height,
+        "fps": rng.choice([24, 25, 30, 60]),
+        "tbr": rng.uniform(50, 5000),
+        "vbr": rng.uniform(50, 5000),
+        "abr": rng.uniform(48, 160),
+        "filesize_approx": rng.randint(10**5, 10**9),
+        "aspect_ratio": 1.78,
+        "resolution": f"{height * 16 // 9}x{height}",
+        "video_ext": "mp4",
+        "audio_ext": "none",
+        "format": f"{100 + i} - {height}p",
+        "http_headers": dict(HTTP_HEADERS),
+        "fragments": [{"url": f"sq/{j}", "duration": 5.0} for j in range(fragments)],
+    }
+
+
+def video(
+    rng: random.Random,
+    channel_id: str,
+    n: int,
+    formats: int,
+    fragments: int,
+    captions: int,
+    heatmap: int,
+) -> Dict:
+    video_id = f"{channel_id[-4:]}{n:07d}"
+    duration = rng.randint(30, 7200)
+    epoch = 1_700_000_000 + n
+    return {
+        "id": video_id,
+        "display_id": video_id,
+        "title": f"Synthetic video {n}",
+        "fulltitle": f"Synthetic video {n}",
+        "description": "lorem ipsum " * rng.randint(1, 50),
+        "channel": f"Channel {channel_id}",
+        "channel_id": channel_id,
+        "channel_url": f"https://www.youtube.com/channel/{channel_id}",
+        "channel_follower_count": rng.randint(0, 10**7),
+        "uploader": f"Channel {channel_id}",
+        "uploader_id": f"@{channel_id.lower()}",
+        "uploader_url": f"https://www.youtube.com/@{channel_id.lower()}",
+        "upload_date": "20240101",
+        "duration": duration,
+        "duration_string": f"{duration // 60}:{duration % 60:02d}",
+        "view_count": rng.randint(0, 10**8),
+        "comment_count": rng.randint(0, 10**5),
+        "like_count": rng.randint(0, 10**6),
+        "age_limit": 0,
+        "live_status": "not_live",
+        "is_live": False,
+        "was_live": False,
+        "playable_in_embed": True,
+        "availability": "public",
+        "categories": ["Entertainment"],
+        "tags": [f"tag{rng.randint(0, 500)}" for _ in range(rng.randint(0, 15))],
+        "thumbnails": [
+            {
+                "url": f"https://i.ytimg.com/vi/{video_id}/{k}.jpg",
+                "preference": -k,
+                "id": str(k),
+            }
+            for k in range(5)
+        ],
+        "formats": [fmt(rng, video_id, i, fragments) for i in range(formats)],
+        "automatic_captions": {
+            lang: [
+                {
+                    "ext": ext,
+                    "protocol": "https",
+                    "url": f"https://www.youtube.com/api/timedtext?v={video_id}&lang={lang}&fmt={ext}",
+                }
+                for ext in CAPTION_EXTS
+            ]
+            for lang in LANGUAGES[:captions]
+        },
+        "subtitles": {},
+        "heatmap": [
+            {
+                "start_time": duration * k / heatmap,
+                "end_time": duration * (k + 1) / heatmap,
+                "value": rng.random(),
+            }
+            for k in range(heatmap)
+        ],
+        "chapters": None,
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "webpage_url_basename": "watch",
+        "webpage_url_domain": "youtube.com",
+        "extractor": "youtube",
+        "extractor_key": "Youtube",
+        "epoch": epoch,
+        "release_timestamp": None,
+        "format_sort_field": ["res", "fps", "codec"],
+        "__last_playlist_index": n,
+    }
+
+
+def channel(
+    seed: int,
+    entries: int = 200,
+    tabs: int = 2,
+    formats: int = 20,
+    fragments: int = 10,
+    captions: int = 5,
+    heatmap: int = 100,
+) -> Dict:
+    """
+    Build a synthetic yt-dlp channel dump.
+
+    Args:
+        seed (int): Seed for the random generator; also picks the channel id.
+        entries (int): Videos in the channel, spread over `tabs` playlist tabs.
+        tabs (int): Nested playlist tabs (Videos, Shorts, Live, ...). 0 puts
+            every video directly under `entries`.
+        formats (int): Formats per video.
+        fragments (int): Fragments per format.
+        captions (int): Automatic caption languages per video.
+        heatmap (int): Heatmap points per video.
+
+    Returns:
+        Dict: A document shaped like a `*.pretty.json` resource file.
+    """
+    rng = random.Random(seed)
+    channel_id = f"UC{seed:022d}"
+    videos = [
+        video(rng, channel_id, n, formats, fragments, captions, heatmap)
+        for n in range(entries)
+    ]
+
+    if tabs > 0:
+        items = [
+            {
+                "_type": "playlist",
+                "id": f"{channel_id}-tab{t}",
+                "title": f"Channel {channel_id} - Tab {t}",
+                "entries": videos[t::tabs],
+            }
+            for t in range(tabs)
+        ]
+    else:
+        items = videos
+
+    return {
+        "_type": "playlist",
+        "id": channel_id,
+        "channel": f"Channel {channel_id}",
+        "channel_id": channel_id,
+        "channel_url": f"https://www.youtube.com/channel/{channel_id}",
+        "channel_follower_count": rng.randint(0, 10**7),
+        "title": f"Channel {channel_id}",
+        "uploader": f"Channel {channel_id}",
+        "uploader_id": f"@{channel_id.lower()}",
+        "uploader_url": f"https://www.youtube.com/@{channel_id.lower()}",
+        "description": "synthetic channel",
+        "tags": ["synthetic", "benchmark"],
+        "thumbnails": [{"url": f"https://yt3.ggpht.com/{channel_id}", "id": "avatar"}],
+        "playlist_count": entries,
+        "view_count": None,
+        "epoch": 1_700_000_000,
+        "modified_date": "20240101",
+        "webpage_url": f"https://www.youtube.com/channel/{channel_id}",
+        "webpage_url_basename": channel_id,
+        "webpage_url_domain": "youtube.com",
+        "extractor": "youtube:tab",
+        "extractor_key": "YoutubeTab",
+        "entries": items,
+        "_version": {"version": "2024.04.09", "repository": "yt-dlp/yt-dlp"},
+    }
+
+
+def generate(directory: str, channels: int = 2, **kwargs) -> List[str]:
+    """
+    Write `channels` synthetic dumps to `directory` and return their paths.
+
+    Extra keyword arguments are passed on to `channel`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed in range(channels):
+        path = os.path.join(directory, f"synthetic-{seed:04d}.pretty.json")
+        with open(path, "w") as f:
+            json.dump(channel(seed, **kwargs), f, indent=4)
+        paths.append(path)
+    return paths
+
+
+def counts(models: List[p.Model]) -> Dict[str, int]:
+    return {m._meta.table_name: m.select().count() for m in models}
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of this process in bytes.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(paths: List[str], mode: str = "tables") -> Dict:
+    """
+    Ingest `paths` with `timeseries.create` and `tables.create` and measure it.
+
+    Args:
+        paths (List[str]): Channel dumps to load.
+        mode (str): "tables", "upsert", or "copy" (multi-row INSERTs off Postgres).
+
+    Returns:
+        Dict: Wall time, statements, peak RSS and rows/sec per table for each
+            stage. A table's rate is over the time spent writing it, as timed
+            by `metrics`; tables written outside a timed stage have none.
+    """
+    models = tables.TABLES + timeseries.tables + rollup.tables
+    report: Dict = {"mode": mode, "files": len(paths), "stages": {}}
+
+    def stage(name: str, fn):
+        before = counts(models)
+        m = metrics.begin()
+        issued = metrics.statements()
+        start = time.perf_counter()
+        extra = fn() or 0
+        seconds = time.perf_counter() - start
+        issued = metrics.statements() - issued + extra
+        after = counts(models)
+        rows = {t: after[t] - before[t] for t in after if after[t] != before[t]}
+        timings = m.as_dict()
+        rates = {}
+        for t, n in sorted(rows.items()):
+            spent = sum(
+                timings[s]["seconds"]
+                for s in (f"{w} {t}" for w in WRITES)
+                if s in timings
+            )
+            if spent:
+                rates[t] = n / spent
+        report["stages"][name] = {
+            "seconds": seconds,
+            "statements": issued,
+            "rows": sum(rows.values()),
+            "rows_per_table": dict(sorted(rows.items())),
+            "rows_per_sec": rates,
+        }
+
+    def load_tables():
+        copied = 0
+        for path in paths:
+            data = stream.load(path)
+            if mode == "copy":
+                stats = bulk.create(data)
+                # Only COPY bypasses `execute_sql`; everything else is counted
+                copied += sum(int(s["copies"]) for s in stats.values())
+            else:
+                tables.create(data, upsert=mode == "upsert")
+        return copied
+
+    def load_timeseries():
+        for path in paths:
+            timeseries.create(stream.load(path))
+
+    total = time.perf_counter()
+    stage("timeseries", load_timeseries)
+    stage("tables", load_tables)
+    report["seconds"] = time.perf_counter() - total
+    report["bytes"] = sum(os.path.getsize(f) for f in paths)
+    report["peak_rss"] = peak_rss()
+    return report
+
+
+def show(report: Dict):
+    print(
+        f"{report['files']} files, {report['bytes'] / 1e6:.1f} MB, mode {report['mode']}: "
+        f"{report['seconds']:.2f}s, peak RSS {report['peak_rss'] / 1e6:.1f} MB"
+    )
+    for name, s in report["stages"].items():
+        print(
+            f"  {name}: {s['seconds']:.2f}s, {s['rows']} rows, "
+            f"{s['statements']} statements"
+        )
+        for table, n in s["rows_per_table"].items():
+            rate = s["rows_per_sec"].get(table)
+            speed = "" if rate is None else f" {rate:>12.0f} rows/s"
+            print(f"    {table:<20} {n:>10} rows{speed}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingest against synthetic yt-dlp channel dumps."
+    )
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--entries", type=int, default=200, help="videos per channel")
+    parser.add_argument("--tabs", type=int, default=2, help="playlist tabs per channel")
+    parser.add_argument("--formats", type=int, default=20, help="formats per video")
+    parser.add_argument(
+        "--fragments", type=int, default=10, help="fragments per format"
+    )
+    parser.add_argument(
+        "--captions", type=int, default=5, help="caption languages per video"
+    )
+    parser.add_argument(
+        "--heatmap", type=int, default=100, help="heatmap points per video"
+    )
+    parser.add_argument(
+        "--mode", choices=["tables", "upsert", "copy"], default="tables"
+    )
+    parser.add_argument(
+        "--sqlite",
+        metavar="PATH",
+        help="run against an embedded SQLite database instead of Postgres",
+    )
+    parser.add_argument("--json", metavar="FILE", help="also write the report as JSON")
+    parser.add_argument(
+        "--keep", metavar="DIR", help="write the dumps to DIR and keep them"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.INFO if args.verbose else logging.WARNING,
+    )
+
+    if args.sqlite:
+        database.configure(backend="sqlite", path=args.sqlite)
+
+    tables.init(reset=True)
+    timeseries.init(reset=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Generate in a child process so peak RSS only reflects the ingest
+        with multiprocessing.Pool(1) as pool:
+            paths = pool.apply(
+                generate,
+                (args.keep or tmp,),
+                dict(
+                    channels=args.channels,
+                    entries=args.entries,
+                    tabs=args.tabs,
+                    formats=args.formats,
+                    fragments=args.fragments,
+                    captions=args.captions,
+                    heatmap=args.heatmap,
+                ),
+            )
+        report = run(paths, args.mode)
+
+    show(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+import collections
+import datetime
+import functools
+import io
+import logging
+import time
+import peewee as p
+from typing import Deque, Dict, List, Optional, Tuple, Type
+
+from yt_schema import dictionary, heatmap, metrics, tables
+from yt_schema.database import is_postgres
+from yt_schema.mapping import Mapping
+from yt_schema.tables import (
+    AutomaticCaptions,
+    Caption,
+    ChannelTag,
+    ChannelThumbnail,
+    Chapter,
+    Entry,
+    Format,
+    FormatSortField,
+    Fragment,
+    Heatmap,
+    RequestedDownload,
+    Subtitle,
+    SubtitleType,
+    VideoCategory,
+    VideoTag,
+    VideoThumbnail,
+)
+
+# Number of buffered rows (across all tables) that triggers a flush.
+BATCH_SIZE: int = 50_000
+
+# Parents are flushed before their children so that foreign keys resolve.
+ORDER: List[Type[p.Model]] = [
+    Entry,
+    SubtitleType,
+    AutomaticCaptions,
+    Format,
+    Fragment,
+    Heatmap,
+    RequestedDownload,
+    Subtitle,
+    Caption,
+    VideoThumbnail,
+    VideoTag,
+    FormatSortField,
+    VideoCategory,
+    Chapter,
+    ChannelThumbnail,
+    ChannelTag,
+]
+
+# Models whose ids are reserved up front because child rows reference them.
+RESERVED: List[Type[p.Model]] = [Entry, SubtitleType, AutomaticCaptions]
+
+# Entry rows carry the id reserved for them.
+ENTRY = Mapping(
+    Entry,
+    keys=tables.ENTRY.keys,
+    convert=tables.ENTRY.convert,
+    context=["id"],
+    overflow="extra",
+    ignore=tables.ENTRY_CHILDREN,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def columns(model: Type[p.Model]) -> Tuple[p.Field, ...]:
+    """
+    Columns written for `model`, including the id only for reserved models.
+    """
+    fields = model._meta.sorted_fields
+    if model in RESERVED:
+        return tuple(fields)
+    return tuple(f for f in fields if f is not model._meta.primary_key)
+
+
+def encode(value: object) -> str:
+    """
+    Encode a single value for the Postgres COPY text format.
+
+    Args:
+        value (object): The Python value, already converted with `Field.db_value`.
+
+    Returns:
+        str: The escaped representation, with `\\N` standing in for NULL.
+    """
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    # BlobField wraps bytes in psycopg2.Binary; COPY wants bytea hex input
+    value = getattr(value, "adapted", value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class Copier:
+    """
+    Buffer rows per model and stream them to Postgres with `COPY FROM STDIN`.
+
+    On other backends the same buffers are written with multi-row INSERTs.
+
+    Rows are plain tuples in the order of `columns(model)`. Whenever the number
+    of buffered rows reaches `batch_size` every buffer is flushed, parents first,
+    so a channel file costs a handful of COPY statements per table.
+    """
+
+    def __init__(self, database: p.Database, batch_size: int = BATCH_SIZE):
+        self.database = database
+        self.batch_size = batch_size
+        self.buffers: Dict[Type[p.Model], List[Tuple]] = {m: [] for m in ORDER}
+        self.pending = 0
+        self.ids: Dict[Type[p.Model], Deque[int]] = {
+            m: collections.deque() for m in RESERVED
+        }
+        # Highest id handed out so far per model, for backends without sequences
+        self.reserved: Dict[Type[p.Model], int] = {}
+        # COPY and sequences are Postgres-only; elsewhere fall back to INSERTs
+        self.postgres = is_postgres()
+        # table name -> [rows, seconds, statements, COPY statements]
+        self.stats: Dict[str, List[float]] = {}
+
+    def next_id(self, model: Type[p.Model]) -> int:
+        """
+        Hand out the next id reserved from the model's sequence.
+
+        Ids are fetched `batch_size` at a time with a single `nextval` query.
+        Unused ids simply leave a gap in the sequence.
+
+        SQLite has no sequences, so ids continue from the table's current
+        maximum instead. That is safe because the loader's transaction already
+        holds SQLite's single write lock when ids are reserved.
+        """
+        ids = self.ids[model]
+        if not ids:
+            table = model._meta.table_name
+            start = time.perf_counter()
+            if self.postgres:
+                cursor = self.database.execute_sql(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                    "FROM generate_series(1, %s)",
+                    (table, self.batch_size),
+                )
+                ids.extend(row[0] for row in cursor.fetchall())
+            else:
+                cursor = self.database.execute_sql(
+                    f'SELECT COALESCE(MAX("id"), 0) FROM "{table}"'
+                )
+                first = max(cursor.fetchone()[0], self.reserved.get(model, 0)) + 1
+                ids.extend(range(first, first + self.batch_size))
+                self.reserved[model] = ids[-1]
+            self.record(table, 0, time.perf_counter() - start)
+        return ids.popleft()
+
+    def add(self, model: Type[p.Model], row: Tuple):
+        self.buffers[model].append(row)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def record(
+        self,
+        table: str,
+        rows: int,
+        seconds: float,
+        statements: int = 1,
+        copies: int = 0,
+    ):
+        stat = self.stats.setdefault(table, [0, 0.0, 0, 0])
+        stat[0] += rows
+        stat[1] += seconds
+        stat[2] += statements
+        stat[3] += copies
+
+    def copy(self, model: Type[p.Model], rows: List[Tuple]):
+        with metrics.timed(f"copy {model._meta.table_name}", rows=len(rows)):
+            self.write(model, rows)
+
+    def write(self, model: Type[p.Model], rows: List[Tuple]):
+        fields = columns(model)
+        if not self.postgres:
+            self.insert(model, fields, rows)
+            return
+
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(encode(f.db_value(v)) for f, v in zip(fields, row)))
+            buf.write("\n")
+        buf.seek(0)
+
+        table = model._meta.table_name
+        cols = ", ".join(f'"{f.column_name}"' for f in fields)
+        start = time.perf_counter()
+        cursor = self.database.cursor()
+        cursor.copy_expert(f'COPY "{table}" ({cols}) FROM STDIN', buf)
+        # Sent through the cursor, not `execute_sql`
+        self.record(table, len(rows), time.perf_counter() - start, copies=1)
+
+    def insert(
+        self, model: Type[p.Model], fields: Tuple[p.Field, ...], rows: List[Tuple]
+    ):
+        """
+        Fallback for backends without COPY: large multi-row INSERTs.
+        """
+        # Stay below SQLite's limit of 32766 bound variables per statement
+        size = max(1, 32000 // len(fields))
+        start = time.perf_counter()
+        statements = 0
+        for batch in p.chunked(rows, size):
+            model.insert_many(batch, fields=list(fields)).execute()
+            statements += 1
+        self.record(
+            model._meta.table_name, len(rows), time.perf_counter() - start, statements
+        )
+
+    def flush(self):
+        for model in ORDER:
+            rows = self.buffers[model]
+            if rows:
+                self.copy(model, rows)
+                self.buffers[model] = []
+        self.pending = 0
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Log and return rows, seconds, statements and rows/sec per table.
+        `copies` counts the COPY statements among them.
+        """
+        report = {}
+        for table, (rows, seconds, statements, copies) in sorted(self.stats.items()):
+            rate = rows / seconds if seconds else 0.0
+            logging.info(
+                f"{table}: {int(rows)} rows, {int(statements)} statements, "
+                f"{seconds:.3f}s ({rate:.0f} rows/s)"
+            )
+            report[table] = {
+                "rows": rows,
+                "seconds": seconds,
+                "statements": statements,
+                "copies": copies,
+                "rows_per_sec": rate,
+            }
+        return report
+
+
+def formats(c: Copier, video_id: int, data: Optional[List[Dict]]):
+    if data is None:
+        return
+
+    for d in dictionary.formats(data):
+        c.add(Format, tables.FORMAT.row(d, video_id))
+
+        for f in d.get("fragments") or []:
+            c.add(Fragment, tables.FRAGMENT.row(f, video_id))
+
+
+def entry(c: Copier, d: Dict):
+    video_id = c.next_id(Entry)
+
+    c.add(Entry, ENTRY.row(d, video_id))
+
+    # Format
+    formats(c, video_id, d.get("formats"))
+
+    # Heatmaps
+    encoded = heatmap.encode(d.get("heatmap"))
+    if encoded is not None:
+        c.add(Heatmap, (video_id, *encoded))
+
+    # Requested Downloads
+    for r in d.get("requested_downloads") or []:
+        c.add(RequestedDownload, tables.REQUESTED_DOWNLOAD.row(r, video_id))
+        formats(c, video_id, r.get("requested_formats"))
+
+    # Requested Formats
+    formats(c, video_id, d.get("requested_formats"))
+
+    # Subtitles
+    for language, subs in (d.get("subtitles") or {}).items():
+        type_id = c.next_id(SubtitleType)
+        c.add(SubtitleType, (type_id, video_id, language))
+        for s in subs or []:
+            c.add(Subtitle, tables.SUBTITLE.row(s, video_id, type_id))
+
+    # Video Thumbnails
+    for t in d.get("thumbnails") or []:
+        c.add(VideoThumbnail, tables.VIDEO_THUMBNAIL.row(t, video_id))
+
+    # Tags
+    for tag in d.get("tags") or []:
+        c.add(VideoTag, (video_id, tag))
+
+    # Format Sort Field
+    for field in d.get("format_sort_field") or []:
+        c.add(FormatSortField, (video_id, field))
+
+    # Automatic Captions
+    for language, caps in (d.get("automatic_captions") or {}).items():
+        caption_id = c.next_id(AutomaticCaptions)
+        c.add(AutomaticCaptions, (caption_id, video_id, language))
+        for cap in caps or []:
+            c.add(Caption, tables.CAPTION.row(cap, caption_id))
+
+    # Video Categories
+    for category in d.get("categories") or []:
+        c.add(VideoCategory, (video_id, category))
+
+    # Chapters
+    for ch in d.get("chapters") or []:
+        c.add(Chapter, tables.CHAPTER.row(ch, video_id))
+        for f in ch.get("fragments") or []:
+            c.add(Fragment, tables.FRAGMENT.row(f, video_id))
+
+
+def create(
+    data: Dict, batch_size: int = BATCH_SIZE, replace: bool = False
+) -> Dict[str, Dict[str, float]]:
+    """
+    Load a channel document through COPY instead of row-by-row inserts.
+
+    The Payload and Version rows are still created individually; every other
+    table is streamed with `COPY FROM STDIN` in batches of `batch_size` rows.
+    The whole file is loaded in a single transaction.
+
+    Args:
+        data (Dict): The parsed `*.pretty.json` channel document.
+        batch_size (int): Number of buffered rows that triggers a flush.
+        replace (bool): Purge rows from an earlier load of the channel first.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Rows, seconds, statements and rows/sec per table.
+    """
+    logging.debug("bulk create")
+    c = Copier(tables.db, batch_size)
+
+    # A handful of COPY statements per table, so the file is one transaction
+    try:
+        with tables.db.atomic():
+            if replace:
+                tables.purge(data.get("channel_id"))
+            load(c, data)
+    except Exception:
+        if not is_postgres():
+            # Symbols created within the rolled back transaction are gone,
+            # see `dictionary.outside`
+            dictionary.clear()
+        raise
+
+    return c.report()
+
+
+def load(c: Copier, data: Dict):
+    ch = tables.channel(data)
+
+    for t in data.get("thumbnails") or []:
+        c.add(ChannelThumbnail, tables.CHANNEL_THUMBNAIL.row(t, ch.get_id()))
+
+    progress = metrics.Progress("videos")
+    for d in tables.videos(data.get("entries")):
+        progress.update()
+        entry(c, d)
+
+    for tag in data.get("tags") or []:
+        c.add(ChannelTag, (ch.get_id(), tag))
+
+    c.flush()
+
+    # Initialize version
+    tables.version(ch, data.get("_version"))
@@ -0,0 +1,166 @@
+import atexit
+import logging
+import os
+import peewee as p
+from playhouse.pool import (
+    PooledDatabase,
+    PooledPostgresqlDatabase,
+    PooledSqliteDatabase,
+)
+from typing import Dict, List
+
+# Connection settings, each overridable with a YT_SCHEMA_DB_<NAME> variable,
+# e.g. YT_SCHEMA_DB_HOST=db.internal, YT_SCHEMA_DB_POOL_SIZE=8 or
+# YT_SCHEMA_DB_BACKEND=sqlite.
+DEFAULTS: Dict[str, str] = {
+    # "postgres" or "sqlite"
+    "backend": "postgres",
+    "name": "youtube",
+    "user": "admin",
+    "password": "admin",
+    "host": "localhost",
+    "port": "5555",
+    # Database file used by the sqlite backend
+    "path": "youtube.db",
+    # 0 disables pooling; otherwise the maximum number of pooled connections
+    "pool_size": "0",
+    # Seconds after which an idle pooled connection is recycled
+    "stale_timeout": "300",
+}
+
+# Tuned for bulk ingest: WAL lets readers run alongside the single writer, and
+# synchronous=normal only fsyncs at checkpoints, which is safe under WAL.
+SQLITE_PRAGMAS: Dict[str, object] = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "foreign_keys": 1,
+    "cache_size": -64 * 1024,  # KiB, i.e. 64 MiB
+    "temp_store": "memory",
+    "mmap_size": 256 * 1024 * 1024,
+    "wal_autocheckpoint": 10000,
+}
+
+# Databases replaced after a fork. They are kept referenced on purpose: letting
+# them be garbage collected would close connections the parent still uses.
+inherited: List[p.Database] = []
+
+
+class LazyDatabase(p.DatabaseProxy):
+    """
+    Database proxy that configures itself from `settings()` on first use.
+
+    Importing the model modules therefore never touches the network; the
+    connection is only opened by the first query.
+    """
+
+    def __getattr__(self, attr):
+        if self.obj is None:
+            configure()
+        return getattr(self.obj, attr)
+
+    def __enter__(self):
+        if self.obj is None:
+            configure()
+        return self.obj.__enter__()
+
+    def __exit__(self, *exc):
+        return self.obj.__exit__(*exc)
+
+
+db: LazyDatabase = LazyDatabase()
+
+
+def settings() -> Dict[str, str]:
+    """
+    Database settings, taken from the environment with `DEFAULTS` as fallback.
+    """
+    return {
+        key: os.environ.get(f"YT_SCHEMA_DB_{key.upper()}", value)
+        for key, value in DEFAULTS.items()
+    }
+
+
+def configure(**overrides) -> p.Database:
+    """
+    Create the database described by `settings()` and bind it to `db`.
+
+    Args:
+        **overrides: Settings that take precedence over the environment.
+
+    Returns:
+        p.Database: The newly bound database.
+    """
+    s = settings()
+    s.update({k: str(v) for k, v in overrides.items()})
+
+    pool_size = int(s["pool_size"])
+
+    if s["backend"] == "sqlite":
+        # Writers wait on each other's locks instead of failing immediately
+        kwargs = dict(pragmas=SQLITE_PRAGMAS, timeout=60)
+        if pool_size > 0:
+            database = PooledSqliteDatabase(
+                s["path"],
+                max_connections=pool_size,
+                stale_timeout=int(s["stale_timeout"]),
+                **kwargs,
+            )
+        else:
+            database = p.SqliteDatabase(s["path"], **kwargs)
+        logging.debug(f"sqlite database {s['path']}")
+    elif s["backend"] == "postgres":
+        kwargs = dict(
+            user=s["user"], password=s["password"], host=s["host"], port=s["port"]
+        )
+        if pool_size > 0:
+            database = PooledPostgresqlDatabase(
+                s["name"],
+                max_connections=pool_size,
+                stale_timeout=int(s["stale_timeout"]),
+                **kwargs,
+            )
+        else:
+            database = p.PostgresqlDatabase(s["name"], **kwargs)
+        logging.debug(f"database {s['name']} on {s['host']}:{s['port']}")
+    else:
+        raise ValueError(f"unknown database backend {s['backend']!r}")
+
+    db.initialize(database)
+    return database
+
+
+def is_postgres() -> bool:
+    """
+    True if models are bound to Postgres, which enables COPY and friends.
+    """
+    if db.obj is None:
+        configure()
+    return isinstance(db.obj, p.PostgresqlDatabase)
+
+
+def after_fork():
+    """
+    Forget connections inherited from a parent process.
+
+    Meant for `multiprocessing.Pool(initializer=...)`: the worker gets a fresh,
+    still unconnected database, and opens its own connection on first use.
+    """
+    if db.obj is None:
+        return
+
+    inherited.append(db.obj)
+    db.initialize(None)
+
+
+def close():
+    if db.obj is None:
+        return
+
+    logging.info("close_db")
+    if isinstance(db.obj, PooledDatabase):
+        db.obj.close_all()
+    else:
+        db.obj.close()
+
+
+atexit.register(close)
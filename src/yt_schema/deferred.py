@@ -0,0 +1,203 @@
+import concurrent.futures
+import logging
+import os
+import time
+import peewee as p
+from typing import Callable, Dict, List, Optional, Type
+
+from yt_schema import dictionary, tables
+from yt_schema.database import db, is_postgres
+
+# Tables loaded without secondary indexes and foreign keys. The dictionary
+# tables keep theirs: interning relies on their unique indexes mid-load.
+MODELS: List[Type[p.Model]] = [m for m in tables.TABLES if m not in dictionary.TABLES]
+
+
+def foreign_keys(model: Type[p.Model]) -> List[p.ForeignKeyField]:
+    return [f for f in model._meta.sorted_fields if isinstance(f, p.ForeignKeyField)]
+
+
+def constraint_name(field: p.ForeignKeyField) -> str:
+    """
+    The name Postgres would give the constraint if declared inline.
+    """
+    return f"{field.model._meta.table_name}_{field.column_name}_fkey"[:63]
+
+
+def existing_foreign_keys(model: Type[p.Model]) -> Dict[str, bool]:
+    """
+    Foreign key constraints of a Postgres table, and whether each is validated.
+    """
+    cursor = db.execute_sql(
+        "SELECT conname, convalidated FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        (f'"{model._meta.table_name}"',),
+    )
+    return dict(cursor.fetchall())
+
+
+def timed(timings: Dict[str, float], step: str, fn: Callable, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[step] = time.perf_counter() - start
+        logging.info(f"{step}: {timings[step]:.3f}s")
+
+
+def prepare(models: List[Type[p.Model]] = MODELS) -> Dict[str, float]:
+    """
+    Get tables ready for a bulk load: no secondary indexes, no foreign keys.
+
+    Missing tables are created bare. Existing ones have their indexes dropped
+    and, on Postgres, their foreign key constraints too. SQLite cannot drop
+    constraints from an existing table, so there only indexes are deferred.
+
+    Args:
+        models (List[Type[p.Model]]): Tables to prepare.
+
+    Returns:
+        Dict[str, float]: Seconds taken per step.
+    """
+    postgres = is_postgres()
+    timings: Dict[str, float] = {}
+
+    def bare():
+        for model in models:
+            if not model.table_exists():
+                fks = foreign_keys(model) if postgres else []
+                for f in fks:
+                    f.deferred = True
+                try:
+                    model._schema.create_sequences()
+                    model._schema.create_table(safe=True)
+                finally:
+                    for f in fks:
+                        f.deferred = False
+                continue
+
+            model._schema.drop_indexes(safe=True)
+            if postgres:
+                for name in existing_foreign_keys(model):
+                    db.execute_sql(
+                        f'ALTER TABLE "{model._meta.table_name}" '
+                        f'DROP CONSTRAINT "{name}"'
+                    )
+
+    with db.atomic():
+        timed(timings, "drop indexes and foreign keys", bare)
+    return timings
+
+
+def parallel(
+    jobs: Dict[str, Callable[[], None]], workers: int, timings: Dict[str, float]
+):
+    """
+    Run statements on a thread pool, each thread on its own connection.
+
+    Every job runs even if some fail; the first failure is re-raised after.
+    """
+
+    def run(step: str, fn: Callable[[], None]):
+        try:
+            timed(timings, step, fn)
+        finally:
+            db.close()
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(run, step, fn) for step, fn in jobs.items()]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"deferred build failed: {e}")
+                errors.append(e)
+    if errors:
+        raise errors[0]
+
+
+def build(
+    models: List[Type[p.Model]] = MODELS, workers: Optional[int] = None
+) -> Dict[str, float]:
+    """
+    Build the indexes and constraints `prepare` deferred, once data is loaded.
+
+    Indexes are created concurrently by `workers` threads. On Postgres foreign
+    keys are then added `NOT VALID`, which is instant, and validated
+    concurrently; on SQLite, where they were never dropped, existing rows are
+    checked with `PRAGMA foreign_key_check`. Tables are analyzed last so the
+    planner sees the new data.
+
+    Safe to run again after a failure: anything already built is skipped.
+
+    Args:
+        models (List[Type[p.Model]]): Tables to finish.
+        workers (Optional[int]): Concurrent builds, by default one per CPU on
+            Postgres and one on SQLite, which has a single writer anyway.
+
+    Returns:
+        Dict[str, float]: Seconds taken per step, and per index or constraint.
+    """
+    postgres = is_postgres()
+    if workers is None:
+        workers = (os.cpu_count() or 1) if postgres else 1
+
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+
+    # The caller's connection would otherwise hold SQLite's lock or idle
+    db.close()
+
+    jobs: Dict[str, Callable[[], None]] = {}
+    for model in models:
+        for index in model._meta.fields_to_index():
+            query = model._schema._create_index(index, safe=True)
+            jobs[f"index {index._name}"] = lambda q=query: db.execute(q)
+    parallel(jobs, workers, timings)
+
+    if postgres:
+        jobs = {}
+        with db.atomic():
+            for model in models:
+                table = model._meta.table_name
+                existing = existing_foreign_keys(model)
+                for f in foreign_keys(model):
+                    name = constraint_name(f)
+                    if existing.get(name):
+                        continue
+                    if name not in existing:
+                        db.execute_sql(
+                            f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" '
+                            f'FOREIGN KEY ("{f.column_name}") '
+                            f'REFERENCES "{f.rel_model._meta.table_name}" '
+                            f'("{f.rel_field.column_name}") NOT VALID'
+                        )
+                    jobs[f"validate {name}"] = (
+                        lambda table=table, name=name: db.execute_sql(
+                            f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{name}"'
+                        )
+                    )
+        db.close()
+        parallel(jobs, workers, timings)
+    else:
+
+        def check():
+            violations = db.execute_sql("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise p.IntegrityError(
+                    f"{len(violations)} rows violate foreign keys, "
+                    f"e.g. {violations[0]}"
+                )
+
+        timed(timings, "foreign key check", check)
+
+    def analyze():
+        for model in models:
+            db.execute_sql(f'ANALYZE "{model._meta.table_name}"')
+
+    timed(timings, "analyze", analyze)
+
+    timings["build"] = time.perf_counter() - start
+    logging.info(f"deferred build: {timings['build']:.3f}s")
+    return timings
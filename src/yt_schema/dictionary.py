@@ -0,0 +1,300 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import peewee as p
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from yt_schema import metrics
+from yt_schema.database import db, is_postgres
+
+T = TypeVar("T")
+
+# Format columns stored as a Symbol id instead of the string itself.
+FORMAT_KEYS: Tuple[str, ...] = (
+    "acodec",
+    "vcodec",
+    "protocol",
+    "ext",
+    "format_note",
+    "audio_ext",
+    "video_ext",
+)
+
+# Most recently used strings and header sets kept per process.
+CACHE_SIZE: int = 65536
+HEADER_CACHE_SIZE: int = 4096
+
+
+class BaseModel(p.Model):
+    class Meta:
+        database = db
+
+
+class Symbol(BaseModel):
+    """
+    A distinct short string (codec, protocol, extension, header key, ...).
+    """
+
+    value = p.TextField(unique=True)
+
+
+class HttpHeaderSet(BaseModel):
+    """
+    A distinct set of http headers, shared by every format that sends it.
+    """
+
+    digest = p.TextField(unique=True)
+
+
+class HttpHeader(BaseModel):
+    header_set = p.ForeignKeyField(HttpHeaderSet, backref="headers")
+    key = p.ForeignKeyField(Symbol)
+    value = p.ForeignKeyField(Symbol)
+
+    class Meta:
+        indexes = ((("header_set", "key"), True),)
+
+
+TABLES = [HttpHeader, HttpHeaderSet, Symbol]
+
+
+# Every id cache, so `clear` can reach the ones other modules create.
+caches: List["LRU"] = []
+
+
+class LRU:
+    """
+    Bounded mapping that evicts the least recently used key when full.
+
+    Values are database ids; every instance is emptied by `clear`.
+    """
+
+    def __init__(self, maxsize: int):
+        caches.append(self)
+        self.maxsize = maxsize
+        self.data: "collections.OrderedDict[object, int]" = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: object) -> Optional[int]:
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return value
+
+    def put(self, key: object, value: int):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+symbols = LRU(CACHE_SIZE)
+header_sets = LRU(HEADER_CACHE_SIZE)
+
+
+def clear():
+    """
+    Forget every cached id.
+
+    Must be called when a transaction that may have created rows is rolled
+    back, since the cached ids could then point at rows that no longer exist.
+    On Postgres shared rows are committed on their own, see `outside`.
+    """
+    for cache in caches:
+        cache.clear()
+
+
+# Per process, the thread whose connection commits shared rows on their own.
+committers: Dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+
+
+def outside(fn: Callable[..., T], *args) -> T:
+    """
+    Run `fn(*args)` outside the caller's transaction, so the rows it inserts
+    are committed right away.
+
+    Symbols, header sets and heatmap grids are shared by every worker. Created
+    within a file's transaction, their unique index entries would stay locked
+    until the file commits, blocking any other worker meeting the same value
+    and possibly deadlocking with it. On Postgres they are therefore written
+    by a dedicated thread whose connection runs in autocommit. SQLite has a
+    single writer, which a second connection would wait on, so there `fn`
+    runs inline.
+    """
+    if not is_postgres() or not db.in_transaction():
+        return fn(*args)
+
+    pid = os.getpid()
+    executor = committers.get(pid)
+    if executor is None:
+        # Threads do not survive a fork: every worker process starts its own
+        executor = committers[pid] = concurrent.futures.ThreadPoolExecutor(
+            1, "dictionary"
+        )
+
+    def counted():
+        before = metrics.statements()
+        return fn(*args), metrics.statements() - before
+
+    result, n = executor.submit(counted).result()
+    # Issued on behalf of the caller's stage
+    metrics.charge(n)
+    return result
+
+
+def intern(values: Iterable[Optional[str]]) -> Dict[str, int]:
+    """
+    Resolve strings to Symbol ids, creating the missing ones.
+
+    Cache misses cost one SELECT, and if some strings are new an
+    `INSERT ... ON CONFLICT DO NOTHING` plus a second SELECT, committed on
+    their own (see `outside`). Concurrent workers inserting the same string
+    therefore agree on a single row.
+
+    Args:
+        values (Iterable[Optional[str]]): Strings to resolve; None is ignored.
+
+    Returns:
+        Dict[str, int]: Symbol id by string.
+    """
+    found: Dict[str, int] = {}
+    missing = set()
+    for v in values:
+        if v is None:
+            continue
+        v = str(v)
+        if v in found:
+            continue
+        i = symbols.get(v)
+        if i is None:
+            missing.add(v)
+        else:
+            found[v] = i
+
+    if missing:
+        found.update(outside(create_symbols, sorted(missing)))
+    return found
+
+
+def create_symbols(values: List[str]) -> Dict[str, int]:
+    found: Dict[str, int] = {}
+
+    def select(batch: List[str]):
+        query = Symbol.select(Symbol.id, Symbol.value).where(Symbol.value.in_(batch))
+        for i, value in query.tuples().iterator():
+            found[value] = i
+            symbols.put(value, i)
+
+    # Sorted, so concurrent writers take the unique index locks in one order
+    for batch in p.chunked(values, 500):
+        select(batch)
+        new = [v for v in batch if v not in found]
+        if new:
+            logging.debug(f"{len(new)} new symbols")
+            Symbol.insert_many(
+                [(v,) for v in new], fields=[Symbol.value]
+            ).on_conflict_ignore().execute()
+            select(new)
+
+    return found
+
+
+def header_set(headers: Optional[Dict[str, str]]) -> Optional[int]:
+    """
+    Resolve a format's http headers to the id of their HttpHeaderSet.
+
+    Args:
+        headers (Optional[Dict[str, str]]): The format's `http_headers`.
+
+    Returns:
+        Optional[int]: The set's id, or None for a format without headers.
+    """
+    if not headers:
+        return None
+
+    items = tuple(sorted((str(k), str(v)) for k, v in headers.items()))
+    i = header_sets.get(items)
+    if i is None:
+        i = outside(create_header_set, items)
+        header_sets.put(items, i)
+    return i
+
+
+def create_header_set(items: Tuple[Tuple[str, str], ...]) -> int:
+    digest = hashlib.sha1(json.dumps(items).encode()).hexdigest()
+    row = HttpHeaderSet.get_or_none(HttpHeaderSet.digest == digest)
+    if row is not None:
+        return row.get_id()
+
+    # Before the set's own transaction, which then only locks the set
+    ids = intern(v for item in items for v in item)
+    # A set is only ever visible with its members
+    with db.atomic():
+        inserted = (
+            HttpHeaderSet.insert(digest=digest)
+            .on_conflict_ignore()
+            .returning(HttpHeaderSet.id)
+            .execute()
+        )
+        rows = list(inserted) if inserted is not None else []
+        if rows:
+            # First to see this set: store its members
+            i = rows[0].get_id()
+            HttpHeader.insert_many(
+                [(i, ids[k], ids[v]) for k, v in items],
+                fields=[HttpHeader.header_set, HttpHeader.key, HttpHeader.value],
+            ).execute()
+            return i
+    # Another worker stored it concurrently
+    return HttpHeaderSet.get(HttpHeaderSet.digest == digest).get_id()
+
+
+def formats(data: Optional[List[Dict]]) -> Optional[List[Dict]]:
+    """
+    Dictionary-encode a list of yt-dlp formats.
+
+    Returns shallow copies in which every `FORMAT_KEYS` string is replaced by
+    its Symbol id and `http_headers` by the id of its HttpHeaderSet, ready to
+    be mapped onto Format columns.
+    """
+    if data is None:
+        return None
+
+    ids = intern(d.get(k) for d in data for k in FORMAT_KEYS)
+
+    encoded = []
+    for d in data:
+        e = dict(d)
+        for k in FORMAT_KEYS:
+            v = d.get(k)
+            e[k] = None if v is None else ids[str(v)]
+        e["http_headers"] = header_set(d.get("http_headers"))
+        encoded.append(e)
+    return encoded
+
+
+def stats() -> Dict[str, int]:
+    """
+    Size and hit counts of the interning caches.
+    """
+    return {
+        "symbols": len(symbols),
+        "symbol_hits": symbols.hits,
+        "symbol_misses": symbols.misses,
+        "header_sets": len(header_sets),
+        "header_set_hits": header_sets.hits,
+        "header_set_misses": header_sets.misses,
+    }
@@ -0,0 +1,420 @@
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import time
+import peewee as p
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from yt_schema import heatmap, migrate, timestamps
+from yt_schema.database import db, is_postgres
+from yt_schema.dictionary import FORMAT_KEYS, Symbol
+from yt_schema.mapping import JSONField
+from yt_schema.tables import Entry, Format
+from yt_schema.timeseries import HeatmapStats, VideoStats
+
+# Rows fetched from the database and written per record batch.
+CHUNK_SIZE: int = 50_000
+
+# Time-series rows younger than this are left for the next incremental run,
+# so rows committed late by a long-running snapshot are not skipped.
+LAG: datetime.timedelta = datetime.timedelta(hours=1)
+
+# Export watermarks, kept next to the exported files.
+STATE_FILE: str = "_state.json"
+
+FORMATS: Dict[str, str] = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+class Column(NamedTuple):
+    name: str
+    # Field whose type and `python_value` the column takes
+    field: p.Field
+    # Applied to the python value before it is written
+    convert: Optional[Callable] = None
+
+
+class Export(NamedTuple):
+    name: str
+    # Builds the query for rows newer than `since` (None for everything).
+    # Rows are ordered by channel, then time, and start with the channel id.
+    query: Callable[[Optional[datetime.datetime], datetime.datetime], p.Select]
+    columns: List[Column]
+    # Index of the timestamp column that dates rows and is filtered by the
+    # watermark, or None for tables exported whole, dated by the snapshot
+    timestamp: Optional[int] = None
+
+
+def pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "exporting needs pyarrow: pip install 'yt-schema[export]'"
+        ) from None
+    return pyarrow
+
+
+def arrow_type(field: p.Field):
+    pa = pyarrow()
+    if isinstance(field, (p.ForeignKeyField, p.IntegerField, p.AutoField)):
+        return pa.int64()
+    if isinstance(field, (p.DoubleField, p.FloatField)):
+        return pa.float64()
+    if isinstance(field, p.BooleanField):
+        return pa.bool_()
+    if isinstance(field, p.DateTimeField):
+        # TimestampFields hand back aware UTC values
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(field, p.BlobField):
+        # Packed heatmaps are exported as lists of floats
+        return pa.list_(pa.float64())
+    return pa.string()
+
+
+def entries(since, until) -> p.Select:
+    fields = [f for f in Entry._meta.sorted_fields if f is not Entry.channel_id]
+    return Entry.select(Entry.channel_id, *fields).order_by(Entry.channel_id, Entry.id)
+
+
+def formats(since, until) -> p.Select:
+    # Dictionary-encoded columns are exported as their strings
+    symbols = {k: Symbol.alias(f"symbol_{k}") for k in FORMAT_KEYS}
+    selected = [Entry.channel_id]
+    for f in Format._meta.sorted_fields:
+        if f.name in symbols:
+            selected.append(symbols[f.name].value.alias(f.name))
+        else:
+            selected.append(f)
+
+    query = Format.select(*selected).join_from(Format, Entry)
+    for k, alias in symbols.items():
+        query = query.join_from(
+            Format, alias, p.JOIN.LEFT_OUTER, on=(getattr(Format, k) == alias.id)
+        )
+    return query.order_by(Entry.channel_id, Format.id)
+
+
+def series(
+    model,
+) -> Callable[[Optional[datetime.datetime], datetime.datetime], p.Select]:
+    """
+    Query for a time-series table, with the channel taken from Entry.
+    """
+
+    def query(since, until) -> p.Select:
+        fields = model._meta.sorted_fields
+        q = (
+            model.select(Entry.channel_id, *fields)
+            .join(Entry, p.JOIN.LEFT_OUTER, on=(Entry.display_id == model.video_id))
+            .where(model.timestamp < until)
+        )
+        if since is not None:
+            q = q.where(model.timestamp >= since)
+        return q.order_by(Entry.channel_id, model.timestamp)
+
+    return query
+
+
+def columns(model, convert: Optional[Dict[str, Callable]] = None) -> List[Column]:
+    convert = convert or {}
+    fields = [f for f in model._meta.sorted_fields if f.name != "channel_id"]
+    return [Column("channel_id", Entry.channel_id)] + [
+        Column(f.name, f, convert.get(f.name, encode if is_json(f) else None))
+        for f in fields
+    ]
+
+
+def is_json(field: p.Field) -> bool:
+    return isinstance(field, JSONField)
+
+
+def encode(value) -> Optional[str]:
+    # Overflow keys vary per row, so they are exported as JSON text
+    return None if value is None else json.dumps(value, sort_keys=True)
+
+
+def format_columns() -> List[Column]:
+    symbol = Symbol._meta.fields["value"]
+    return [Column("channel_id", Entry.channel_id)] + [
+        Column(f.name, symbol if f.name in FORMAT_KEYS else f)
+        for f in Format._meta.sorted_fields
+    ]
+
+
+def unpack(blob) -> Optional[List[float]]:
+    return None if blob is None else list(heatmap.unpack(bytes(blob)))
+
+
+def exports() -> List[Export]:
+    # Built on demand: promoted columns are only attached once the database
+    # is known, see `migrate.apply`
+    return [
+        Export("entry", entries, columns(Entry)),
+        Export("format", formats, format_columns()),
+        Export("videostats", series(VideoStats), columns(VideoStats), 1),
+        Export(
+            "heatmapstats",
+            series(HeatmapStats),
+            columns(HeatmapStats, {"values": unpack}),
+            1,
+        ),
+    ]
+
+
+def fetch(query: p.Select, chunk_size: int) -> Iterator[List[Tuple]]:
+    """
+    Run a query and yield its rows in chunks.
+
+    Postgres uses a named (server-side) cursor, so only one chunk is ever held
+    in memory; SQLite cursors step through results lazily already.
+    """
+    sql, params = query.sql()
+    if is_postgres():
+        cursor = db.connection().cursor(name="yt_schema_export")
+        cursor.itersize = chunk_size
+    else:
+        cursor = db.cursor()
+    cursor.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+class Writer:
+    """
+    Write record batches to one file per (table, channel, date) partition,
+    laid out Hive-style as `table/channel_id=.../date=.../part-RUN.ext`.
+    """
+
+    def __init__(self, directory: str, export: Export, kind: str, run: str):
+        self.directory = directory
+        self.export = export
+        self.kind = kind
+        self.run = run
+        pa = pyarrow()
+        self.schema = pa.schema(
+            [pa.field(c.name, arrow_type(c.field)) for c in export.columns]
+        )
+        self.key: Optional[Tuple[str, datetime.date]] = None
+        self.writer = None
+        self.path = ""
+        self.files: List[str] = []
+        self.rows = 0
+
+    def open(self, key: Tuple[str, datetime.date]):
+        self.close()
+        channel, date = key
+        directory = os.path.join(
+            self.directory,
+            self.export.name,
+            f"channel_id={channel}",
+            f"date={date.isoformat()}",
+        )
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"part-{self.run}{FORMATS[self.kind]}")
+
+        pa = pyarrow()
+        # Written under a temporary name and renamed once complete
+        if self.kind == "parquet":
+            self.writer = pa.parquet.ParquetWriter(self.path + ".tmp", self.schema)
+        else:
+            self.writer = pa.ipc.new_file(self.path + ".tmp", self.schema)
+        self.key = key
+
+    def write(self, key: Tuple[str, datetime.date], rows: List[List]):
+        if key != self.key:
+            self.open(key)
+        pa = pyarrow()
+        arrays = [
+            pa.array([r[i] for r in rows], type=f.type)
+            for i, f in enumerate(self.schema)
+        ]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows += len(rows)
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+        self.files.append(self.path)
+        self.writer = None
+        self.key = None
+
+
+def export_table(
+    directory: str,
+    export: Export,
+    kind: str,
+    run: str,
+    snapshot: datetime.datetime,
+    since: Optional[datetime.datetime],
+    until: datetime.datetime,
+    chunk_size: int,
+) -> Tuple[int, List[str]]:
+    """
+    Stream one table into partitioned files.
+
+    Returns:
+        Tuple[int, List[str]]: Rows and files written.
+    """
+    writer = Writer(directory, export, kind, run)
+    converters = [(c.field.python_value, c.convert) for c in export.columns]
+
+    def partition(row: List) -> Tuple[str, datetime.date]:
+        ts = snapshot if export.timestamp is None else row[export.timestamp]
+        return row[0] or "unknown", ts.date()
+
+    try:
+        for chunk in fetch(export.query(since, until), chunk_size):
+            rows = []
+            for raw in chunk:
+                row = [pv(v) for (pv, _), v in zip(converters, raw)]
+                for i, (_, convert) in enumerate(converters):
+                    if convert is not None:
+                        row[i] = convert(row[i])
+                rows.append(row)
+
+            # Rows arrive ordered by channel and time, so partitions are runs
+            for key, group in itertools.groupby(rows, partition):
+                writer.write(key, list(group))
+    finally:
+        writer.close()
+
+    return writer.rows, writer.files
+
+
+def load_state(directory: str) -> Dict[str, str]:
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(directory: str, state: Dict[str, str]):
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def export(
+    directory: str,
+    kind: str = "parquet",
+    full: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    lag: datetime.timedelta = LAG,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Write a consistent snapshot of the entry, format and time-series tables.
+
+    Every table is read inside one read-only transaction (REPEATABLE READ on
+    Postgres), so they all reflect the same moment. Entry and Format are
+    exported whole and dated by the snapshot; time-series rows are dated by
+    their own timestamp and, unless `full`, only rows newer than the previous
+    export's watermark are written.
+
+    Args:
+        directory (str): Output directory.
+        kind (str): "parquet" or "arrow" (Arrow IPC file).
+        full (bool): Ignore the watermarks and export all history.
+        chunk_size (int): Rows per fetch and per record batch.
+        lag (datetime.timedelta): Time-series rows younger than this are left
+            for the next run.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Rows, files and seconds per table.
+    """
+    pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    state = {} if full else load_state(directory)
+
+    snapshot = timestamps.now()
+    until = snapshot - lag
+    run = snapshot.strftime("%Y%m%dT%H%M%S")
+    report: Dict[str, Dict[str, float]] = {}
+
+    migrate.apply()
+    with db.atomic():
+        if is_postgres():
+            db.execute_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+        for e in exports():
+            start = time.perf_counter()
+            since = None
+            if e.timestamp is not None and e.name in state:
+                since = datetime.datetime.fromisoformat(state[e.name])
+
+            rows, files = export_table(
+                directory, e, kind, run, snapshot, since, until, chunk_size
+            )
+            if e.timestamp is not None:
+                # Everything before `until` is now exported, even if sparse
+                state[e.name] = until.isoformat()
+
+            seconds = time.perf_counter() - start
+            logging.info(f"{e.name}: {rows} rows, {len(files)} files, {seconds:.3f}s")
+            report[e.name] = {"rows": rows, "files": len(files), "seconds": seconds}
+
+    save_state(directory, state)
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Export entries, formats and time series to columnar files."
+    )
+    parser.add_argument("directory", help="output directory")
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default="parquet",
+        help="file format (default: parquet)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="export all time-series history instead of only new rows",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help=f"rows per fetch and record batch (default: {CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--lag",
+        type=float,
+        default=LAG.total_seconds() / 60,
+        metavar="MINUTES",
+        help="leave time-series rows younger than this for the next run",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args(argv)
+    export(
+        args.directory,
+        args.format,
+        args.full,
+        args.chunk_size,
+        datetime.timedelta(minutes=args.lag),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import hashlib
+import math
+import struct
+import peewee as p
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from yt_schema.database import db
+from yt_schema.dictionary import LRU, outside
+
+# Bucket values are stored as little-endian float64, NaN standing in for null.
+FORMAT: str = "<{}d"
+
+# Decimals grid fractions are rounded to, so that videos of any duration
+# split into the same buckets share one grid.
+FRACTION_DIGITS: int = 9
+
+
+class BaseModel(p.Model):
+    class Meta:
+        database = db
+
+
+class HeatmapGrid(BaseModel):
+    """
+    Bucket boundaries of a heatmap as fractions of its duration, stored once
+    for every heatmap sharing them.
+
+    yt-dlp splits a video into equal buckets, so there is one grid per bucket
+    count rather than one per video. Heatmap rows keep their `duration` to
+    scale the fractions back to seconds.
+    """
+
+    digest = p.TextField(unique=True)
+    buckets = p.IntegerField()
+    starts = p.BlobField()
+    ends = p.BlobField()
+
+
+TABLES = [HeatmapGrid]
+
+# Grid ids by packed (starts, ends).
+grids = LRU(4096)
+
+
+def init(reset: bool = False):
+    """
+    Create the grid table. `tables.init` and `timeseries.init` call this
+    without `reset`: grids are immutable and may be shared by both.
+    """
+    if reset:
+        db.drop_tables(TABLES, safe=True)
+        grids.clear()
+    db.create_tables(TABLES)
+
+
+def pack(values: Sequence[Optional[float]]) -> bytes:
+    """
+    Pack floats into the storage format.
+    """
+    return struct.pack(
+        FORMAT.format(len(values)),
+        *(math.nan if v is None else v for v in values),
+    )
+
+
+def unpack(blob: bytes) -> Tuple[float, ...]:
+    """
+    Inverse of `pack`, for readers without NumPy.
+    """
+    return struct.unpack(FORMAT.format(len(blob) // 8), blob)
+
+
+def grid(starts: bytes, ends: bytes) -> int:
+    """
+    Id of the HeatmapGrid with these packed boundaries, created if needed.
+
+    New grids are committed on their own, outside the caller's transaction,
+    see `dictionary.outside`.
+    """
+    key = starts + ends
+    i = grids.get(key)
+    if i is None:
+        i = outside(create_grid, starts, ends)
+        grids.put(key, i)
+    return i
+
+
+def create_grid(starts: bytes, ends: bytes) -> int:
+    digest = hashlib.sha1(starts + ends).hexdigest()
+    HeatmapGrid.insert(
+        digest=digest, buckets=len(starts) // 8, starts=starts, ends=ends
+    ).on_conflict_ignore().execute()
+    return HeatmapGrid.get(HeatmapGrid.digest == digest).get_id()
+
+
+def fractions(values: Sequence[Optional[float]], duration: float) -> bytes:
+    return pack(
+        [None if v is None else round(v / duration, FRACTION_DIGITS) for v in values]
+    )
+
+
+def encode(data: Optional[List[Dict]]) -> Optional[Tuple[int, float, bytes]]:
+    """
+    Turn a yt-dlp heatmap into a grid id, its duration and its packed bucket
+    values.
+
+    The duration is where the last bucket ends, i.e. the video's; without it
+    the grid holds the boundaries in seconds and the duration is 1.
+
+    Args:
+        data (Optional[List[Dict]]): The video's `heatmap` list.
+
+    Returns:
+        Optional[Tuple[int, float, bytes]]: `(grid, duration, values)`, or
+        None without a heatmap.
+    """
+    if not data:
+        return None
+
+    ends = [h.get("end_time") for h in data]
+    duration = max((e for e in ends if e is not None), default=None) or 1.0
+    return (
+        grid(
+            fractions([h.get("start_time") for h in data], duration),
+            fractions(ends, duration),
+        ),
+        duration,
+        pack([h.get("value") for h in data]),
+    )
+
+
+def numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "decoding heatmaps needs numpy: pip install 'yt-schema[numpy]'"
+        ) from None
+    return numpy
+
+
+def decode(blob: bytes):
+    """
+    Decode packed bucket values into a float64 NumPy array.
+
+    The array is a zero-copy view of `blob`.
+    """
+    return numpy().frombuffer(blob, dtype="<f8")
+
+
+def decode_grid(grid_id: int, duration: float):
+    """
+    Bucket boundaries in seconds of a heatmap with this grid and `duration`,
+    as two float64 NumPy arrays `(starts, ends)`.
+    """
+    g = HeatmapGrid.get_by_id(grid_id)
+    return decode(g.starts) * duration, decode(g.ends) * duration
+
+
+def stack(blobs: Iterable[bytes]):
+    """
+    Decode many heatmaps sharing a grid into one `(videos, buckets)` array,
+    ready for vectorized comparisons across videos.
+    """
+    return numpy().vstack([decode(b) for b in blobs])
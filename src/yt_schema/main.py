@@ -1,26 +1,43 @@
+import argparse
+import functools
 import logging
 import os
-import json
 import multiprocessing
+import time
 
-from typing import Dict
-from yt_schema import tables, timeseries
+from typing import Dict, List, Optional
+from yt_schema import (
+    archive,
+    bulk,
+    database,
+    deferred,
+    manifest,
+    metrics,
+    migrate,
+    pipeline,
+    stream,
+    tables,
+    timeseries,
+)
+from yt_schema.metrics import Result
 
 
 def load_json(name: str) -> Dict[str, object]:
     """
-    Load a JSON file from the "resources" directory.
+    Open a JSON file from the "resources" directory for streaming.
 
-    This function takes a filename as input and reads the corresponding JSON file
-    located in the "resources" directory. It returns the contents of the JSON file
-    as a Python dictionary. If the specified JSON file does not exist in the
-    "resources" directory, it raises a FileNotFoundError.
+    This function takes a filename as input and decodes the channel-level keys
+    of the corresponding JSON file located in the "resources" directory. The
+    "entries" key is not loaded; instead it holds an iterable that streams one
+    video at a time from the file, so memory stays bounded by the largest single
+    video. If the specified JSON file does not exist in the "resources"
+    directory, it raises a FileNotFoundError.
 
     Args:
         name (str): The name of the JSON file to load.
 
     Returns:
-        Dict[str, object]: The contents of the JSON file as a Python Dictionary.
+        Dict[str, object]: The channel header, with "entries" streamed lazily.
 
     Raises:
         FileNotFoundError: If the specified JSON file does not exist in the "resources" directory.
@@ -30,12 +47,9 @@ def load_json(name: str) -> Dict[str, object]:
     # with the provided filename.
     json_file: str = os.path.join("resources", name)
 
-    # Open the JSON file and read its contents. The 'with' statement ensures that
-    # the file is properly closed after reading.
-    with open(json_file, "r") as f:
-        # Load the JSON data from the file and store it in a variable. The json.load()
-        # function reads the file and returns a Python dictionary.
-        json_data: Dict[str, object] = json.load(f)
+    # Decode the header and attach a streaming view over the entries. The file
+    # is re-opened every time the entries are iterated.
+    json_data: Dict[str, object] = stream.load(json_file)
 
     # Return the loaded JSON data.
     return json_data
@@ -47,21 +61,248 @@ logging.basicConfig(
 )
 
 
-def payload(file: str):
-    js = load_json(file)
-    logging.info(f"Creating table for {file}")
-    timeseries.create(js)
-    tables.create(js)
+def init_worker():
+    """
+    Pool initializer: give each worker process its own database connections.
+    """
+    database.after_fork()
+
+
+def payload(
+    file: str,
+    use_copy: bool = False,
+    commit_every: Optional[int] = None,
+    upsert: bool = False,
+    changes_only: bool = False,
+    archive_raw: bool = False,
+) -> Result:
+    start = time.perf_counter()
+    path = os.path.join("resources", file)
+    size = os.path.getsize(path)
+    videos = 0
+    ok = True
+    m = metrics.begin()
+
+    try:
+        stat = manifest.changed(path)
+        if stat is None:
+            logging.info(f"Skipping unchanged {file}")
+            return Result(file, os.getpid(), ok, videos, size, 0.0, True)
+
+        # Keys promoted since this worker's previous file
+        migrate.refresh()
+        js = load_json(file)
+        logging.info(f"Creating table for {file}")
+        if archive_raw:
+            with m.timed("archive"):
+                archive.store(js)
+        if manifest.snapshotted(stat):
+            # A previous attempt failed after its snapshot committed
+            logging.info(f"Snapshot of {file} already recorded")
+        else:
+            with m.timed("timeseries"):
+                videos = timeseries.create(
+                    js,
+                    changes_only,
+                    then=functools.partial(manifest.record_snapshot, stat),
+                )
+        if use_copy:
+            with m.timed("bulk"):
+                bulk.create(js, replace=stat.seen)
+        else:
+            # Upserts refresh rows in place, so nothing needs purging first
+            replace = stat.seen and not upsert
+            if replace and commit_every:
+                # The old version must survive a failure, so the purge and
+                # the reload are committed together
+                logging.info(f"Loading {file} in one transaction, it was seen before")
+                commit_every = None
+            with m.timed("tables"):
+                tables.create(js, commit_every, replace=replace, upsert=upsert)
+        manifest.record(stat)
+    except Exception:
+        # One bad file must not take the rest of the run down with it
+        logging.exception(f"Failed to load {file}")
+        ok = False
+
+    seconds = time.perf_counter() - start
+    return Result(file, os.getpid(), ok, videos, size, seconds, False, m.as_dict())
+
+
+def summary(results: List[Result], elapsed: float):
+    """
+    Log files, videos and bytes per second for every worker and for the run.
+    """
+    workers: Dict[int, List[Result]] = {}
+    for r in results:
+        workers.setdefault(r.worker, []).append(r)
+
+    def line(name: str, rs: List[Result], seconds: float):
+        videos = sum(r.videos for r in rs)
+        mb = sum(r.size for r in rs if not r.skipped) / 1e6
+        failed = sum(not r.ok for r in rs)
+        skipped = sum(r.skipped for r in rs)
+        secs = max(seconds, 1e-9)
+        logging.info(
+            f"{name}: {len(rs)} files ({failed} failed, {skipped} unchanged), "
+            f"{videos} videos, "
+            f"{mb:.1f} MB in {seconds:.1f}s "
+            f"({videos / secs:.1f} videos/s, {mb / secs:.2f} MB/s)"
+        )
+
+    for worker, rs in sorted(workers.items()):
+        line(f"worker {worker}", rs, sum(r.seconds for r in rs))
+    line("total", results, elapsed)
+
 
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Load yt-dlp channel dumps from the resources folder."
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="bulk load entries and their child tables with COPY FROM STDIN",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="load in one process, overlapping file decoding, row building and "
+        "database writes; -j sets the files in flight",
+    )
+    parser.add_argument(
+        "--commit-every",
+        type=int,
+        metavar="N",
+        help="commit every N entries instead of once per file; files loaded "
+        "before are still reloaded in one transaction",
+    )
+    parser.add_argument(
+        "--upsert",
+        action="store_true",
+        help="update channels and videos in place instead of reloading them",
+    )
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        help="load without secondary indexes and foreign keys, build them after",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="only record video stats and heatmaps that changed since last seen",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="also keep every document in the compressed raw archive, "
+        "see `python -m yt_schema.archive`",
+    )
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="drop every table, including the manifest and time series, first; "
+        "the raw archive is kept",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="write per-stage metrics of every file and of the run to PATH, "
+        "as Prometheus text if it ends in .prom and JSON otherwise",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    args = parser.parse_args(argv)
+    if args.copy and args.upsert:
+        parser.error("--copy cannot be combined with --upsert")
+    if args.upsert and args.commit_every:
+        # A failed file is purged, which would delete the rows it refreshed
+        parser.error("--upsert cannot be combined with --commit-every")
+    if args.pipeline and (args.upsert or args.commit_every):
+        # The pipeline writes the rows `--copy` does, a file per transaction
+        parser.error("--pipeline cannot be combined with --upsert or --commit-every")
+    if args.defer_indexes and args.upsert:
+        # ON CONFLICT needs the unique indexes while loading
+        parser.error("--defer-indexes cannot be combined with --upsert")
+    return args
 
-def main():
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     logging.info("start")
-    pool = multiprocessing.Pool(1)
-    tables.init()
+    start = time.perf_counter()
+    tables.init(args.reset)
+    migrate.init(args.reset)
+    timeseries.init(args.reset)
+    manifest.init(args.reset)
+    archive.init()
     # For each json file in the resources folder, create a table
     # Make a sorted list of the files in the resources folder
     files = sorted(filter(lambda s: s.endswith("pretty.json"), os.listdir("resources")))
-    pool.map(payload, files)
+    # Files whose size and mtime match the manifest are not even dispatched
+    known = manifest.snapshot()
+    files = [
+        f for f in files if not manifest.unchanged(os.path.join("resources", f), known)
+    ]
+    logging.info(f"{len(files)} new or modified files")
+    if args.defer_indexes and files:
+        deferred.prepare()
+    # Workers open their own connections; nothing is shared across the fork
+    database.close()
+    # Largest files first so one big channel does not end up last in line
+    files.sort(
+        key=lambda f: os.path.getsize(os.path.join("resources", f)), reverse=True
+    )
+
+    job = functools.partial(
+        payload,
+        use_copy=args.copy,
+        commit_every=args.commit_every,
+        upsert=args.upsert,
+        changes_only=args.changes_only,
+        archive_raw=args.archive,
+    )
+    if args.pipeline:
+        results = pipeline.load(
+            files,
+            args.workers,
+            changes_only=args.changes_only,
+            archive_raw=args.archive,
+        )
+    else:
+        with multiprocessing.Pool(args.workers, initializer=init_worker) as pool:
+            results = list(pool.imap_unordered(job, files))
+    logging.info(f"load: {time.perf_counter() - start:.3f}s")
+
+    if args.defer_indexes and files:
+        deferred.build()
+
+    elapsed = time.perf_counter() - start
+    summary(results, elapsed)
+
+    loaded = [r for r in results if r.stages is not None]
+    report = metrics.report(
+        {
+            r.file: {
+                "ok": r.ok,
+                "seconds": r.seconds,
+                "videos": r.videos,
+                "bytes": r.size,
+                "stages": r.stages,
+            }
+            for r in loaded
+        },
+        elapsed,
+    )
+    metrics.log_slowest(report["run"]["stages"])
+    if args.metrics:
+        metrics.write(report, args.metrics)
+        logging.info(f"metrics written to {args.metrics}")
     logging.info("end")
 
 
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import os
+import peewee as p
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from yt_schema import timestamps
+from yt_schema.tables import BaseModel, db
+from yt_schema.timestamps import TimestampField
+
+
+class Manifest(BaseModel):
+    path = p.TextField(unique=True)
+    size = p.BigIntegerField()
+    mtime = p.DoubleField()
+    digest = p.TextField()
+    ingested_at = TimestampField(default=timestamps.now)
+
+
+class Snapshot(BaseModel):
+    """
+    The version of a file whose time-series snapshot was recorded last.
+
+    Snapshots commit on their own, before the file's tables are loaded, so a
+    file that failed afterwards is retried without recording it twice.
+    """
+
+    path = p.TextField(unique=True)
+    digest = p.TextField()
+
+
+class Stat(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    digest: str
+    # True if an earlier version of the file was already ingested
+    seen: bool
+
+
+def init(reset: bool = False):
+    if reset:
+        db.drop_tables([Manifest, Snapshot], safe=True)
+    db.create_tables([Manifest, Snapshot])
+    timestamps.upgrade([Manifest])
+
+
+def digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file, read in chunks so large dumps are never held in memory.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def snapshot() -> Dict[str, Tuple[int, float]]:
+    """
+    Size and mtime of every recorded file, keyed by path.
+    """
+    return {
+        m.path: (m.size, m.mtime)
+        for m in Manifest.select(Manifest.path, Manifest.size, Manifest.mtime)
+    }
+
+
+def unchanged(path: str, known: Dict[str, Tuple[int, float]]) -> bool:
+    """
+    Cheap check against a `snapshot`: same size and mtime means same file.
+    """
+    st = os.stat(path)
+    return known.get(path) == (st.st_size, st.st_mtime)
+
+
+def changed(path: str) -> Optional[Stat]:
+    """
+    Compare a file against its manifest row.
+
+    Files whose size and mtime match are skipped without reading them. Otherwise
+    the file is hashed; if only its mtime moved (e.g. it was touched or copied)
+    the row is refreshed and the file is still skipped.
+
+    Args:
+        path (str): Path to the resource file.
+
+    Returns:
+        Optional[Stat]: None if the file is unchanged, else what to record once
+            it has been ingested.
+    """
+    st = os.stat(path)
+    row = Manifest.get_or_none(Manifest.path == path)
+    if row is not None and (row.size, row.mtime) == (st.st_size, st.st_mtime):
+        return None
+
+    h = digest(path)
+    if row is not None and row.digest == h:
+        logging.debug(f"{path} touched but unchanged")
+        Manifest.update(size=st.st_size, mtime=st.st_mtime).where(
+            Manifest.path == path
+        ).execute()
+        return None
+
+    return Stat(path, st.st_size, st.st_mtime, h, row is not None)
+
+
+def record(stat: Stat):
+    """
+    Insert or refresh the manifest row for an ingested file.
+    """
+    Manifest.insert(
+        path=stat.path,
+        size=stat.size,
+        mtime=stat.mtime,
+        digest=stat.digest,
+        ingested_at=timestamps.now(),
+    ).on_conflict(
+        conflict_target=[Manifest.path],
+        preserve=[Manifest.size, Manifest.mtime, Manifest.digest, Manifest.ingested_at],
+    ).execute()
+
+
+def snapshotted(stat: Stat) -> bool:
+    """
+    Whether this version of the file already has its snapshot recorded.
+    """
+    row = Snapshot.get_or_none(Snapshot.path == stat.path)
+    return row is not None and row.digest == stat.digest
+
+
+def record_snapshot(stat: Stat):
+    """
+    Remember that this version of the file has its snapshot recorded. Meant
+    to run inside the snapshot's transaction, see `timeseries.create`.
+    """
+    Snapshot.insert(path=stat.path, digest=stat.digest).on_conflict(
+        conflict_target=[Snapshot.path], preserve=[Snapshot.digest]
+    ).execute()
@@ -0,0 +1,121 @@
+import json
+import peewee as p
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from yt_schema.database import is_postgres
+
+# Every Mapping, so they can be recompiled when columns are added at runtime.
+mappings: List["Mapping"] = []
+
+
+class JSONField(p.Field):
+    """
+    A JSON document: JSONB on Postgres, JSON text on other backends.
+    """
+
+    field_type = "JSON"
+
+    def ddl_datatype(self, ctx):
+        return p.SQL("JSONB" if is_postgres() else "TEXT")
+
+    def db_value(self, value):
+        return None if value is None else json.dumps(value)
+
+    def python_value(self, value):
+        # psycopg2 already decodes JSONB
+        return json.loads(value) if isinstance(value, str) else value
+
+
+class Mapping:
+    """
+    Declarative mapping of yt-dlp objects onto a model's columns, compiled
+    once into row extractors.
+
+    Every column is read from the yt-dlp key of the same name unless `keys`
+    says otherwise, and passed through its converter if `convert` has one.
+    Columns named in `context` are not read from the object: their values
+    come from the caller, e.g. the id of the parent row. With `overflow`,
+    that JSONField column collects every key no column reads and `ignore`
+    does not list, so new yt-dlp keys are kept rather than dropped.
+
+    The extractors are generated Python functions doing one `dict.get` per
+    column, with no per-row loop over the mapping:
+
+        FORMAT = Mapping(Format, context=["video_id"])
+        FORMAT.row(d, video_id)   # tuple in `columns` order
+        FORMAT.dict(d, video_id)  # {column name: value}
+    """
+
+    def __init__(
+        self,
+        model: Type[p.Model],
+        keys: Optional[Dict[str, str]] = None,
+        convert: Optional[Dict[str, Callable]] = None,
+        context: Sequence[str] = (),
+        overflow: Optional[str] = None,
+        ignore: Sequence[str] = (),
+    ):
+        self.model = model
+        self.keys = keys or {}
+        self.convert = convert or {}
+        self.context = list(context)
+        self.overflow = overflow
+        self.ignore = list(ignore)
+
+        fields = model._meta.fields
+        extra = [overflow] if overflow else []
+        for name in [*self.keys, *self.convert, *self.context, *extra]:
+            if name not in fields:
+                raise ValueError(f"{model.__name__} has no column {name!r}")
+
+        mappings.append(self)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Recompile the extractors, e.g. after columns were added to the model.
+        """
+        # The primary key is only written when the caller supplies it
+        pk = self.model._meta.primary_key
+        self.columns: List[p.Field] = [
+            f
+            for f in self.model._meta.sorted_fields
+            if f is not pk or f.name in self.context
+        ]
+        self.row: Callable[..., Tuple] = self.compile("({},)")
+        self.dict: Callable[..., Dict] = self.compile("{{{}}}", named=True)
+
+    def key(self, name: str) -> str:
+        """
+        The yt-dlp key a column is read from.
+        """
+        return self.keys.get(name, name)
+
+    def compile(self, template: str, named: bool = False) -> Callable:
+        sources = [
+            f for f in self.columns if f.name not in self.context + [self.overflow]
+        ]
+        namespace: Dict[str, object] = {
+            "known": frozenset([*(self.key(f.name) for f in sources), *self.ignore])
+        }
+        values = []
+        for f in self.columns:
+            if f.name in self.context:
+                value = f"ctx_{f.name}"
+            elif f.name == self.overflow:
+                value = "{k: v for k, v in d.items() if k not in known} or None"
+            else:
+                value = f"get({self.key(f.name)!r})"
+                if f.name in self.convert:
+                    namespace[f"convert_{f.name}"] = self.convert[f.name]
+                    value = f"convert_{f.name}({value})"
+            values.append(f"{f.name!r}: {value}" if named else value)
+
+        args = "".join(f", ctx_{name}" for name in self.context)
+        source = (
+            f"def extract(d{args}):\n"
+            f"    get = d.get\n"
+            f"    return {template.format(', '.join(values))}\n"
+        )
+        exec(compile(source, f"<mapping {self.model.__name__}>", "exec"), namespace)
+        return namespace["extract"]
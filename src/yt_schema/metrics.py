@@ -0,0 +1,304 @@
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TypeVar
+
+from yt_schema.database import db
+
+T = TypeVar("T")
+
+# Seconds between two progress lines.
+PROGRESS_INTERVAL: float = 10.0
+
+# Prefix of every Prometheus metric name.
+PREFIX: str = "yt_schema"
+
+# Statements sent through the bound database, counted per thread so that
+# stages running concurrently on other threads are not charged for them.
+issued = threading.local()
+
+# The database whose `execute_sql` is counted.
+hooked: List[object] = [None]
+
+
+def statements() -> int:
+    """
+    Statements executed so far by the calling thread.
+
+    Counting starts once the database is configured; a database rebound
+    later, e.g. after a fork, is picked up on the next call.
+    """
+    database = db.obj
+    if database is not None and database is not hooked[0]:
+        execute_sql = database.execute_sql
+
+        def counted(*args, **kwargs):
+            issued.count = getattr(issued, "count", 0) + 1
+            return execute_sql(*args, **kwargs)
+
+        database.execute_sql = counted
+        hooked[0] = database
+    return getattr(issued, "count", 0)
+
+
+def charge(n: int):
+    """
+    Count `n` statements another thread issued on behalf of the calling one.
+    """
+    issued.count = statements() + n
+
+
+class Stage:
+    """
+    Totals of one stage.
+
+    `seconds` includes nested stages, `self_seconds` and `statements` do not.
+    """
+
+    FIELDS = ("calls", "seconds", "self_seconds", "rows", "statements", "bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.rows = 0
+        self.statements = 0
+        self.bytes = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+
+class Metrics:
+    """
+    Per-stage durations, rows, statements and bytes of one ingest.
+
+    Stages nest: time and statements of a stage entered while another is
+    running count towards the inner one's self totals only. Nesting is tracked
+    per thread, so stages of one file may run on several threads at once.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+        self.local = threading.local()
+
+    @property
+    def stack(self) -> List[List[float]]:
+        """
+        Time and statements of the children of each stage running on this
+        thread.
+        """
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def get(self, name: str) -> Stage:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return stage
+
+    @contextlib.contextmanager
+    def timed(self, name: str, rows: int = 0, bytes: int = 0) -> Iterator[Stage]:
+        """
+        Time the block as one call of stage `name`. The yielded Stage can be
+        used to add rows or bytes only known at the end.
+        """
+        stage = self.get(name)
+        stack = self.stack
+        children = [0.0, 0]
+        stack.append(children)
+        before = statements()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            elapsed = time.perf_counter() - start
+            n = statements() - before
+            stack.pop()
+            stage.calls += 1
+            stage.seconds += elapsed
+            stage.self_seconds += elapsed - children[0]
+            stage.statements += n - children[1]
+            stage.rows += rows
+            stage.bytes += bytes
+            if stack:
+                stack[-1][0] += elapsed
+                stack[-1][1] += n
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Yield from `iterable`, timing every step as stage `name` and counting
+        each item as a row.
+        """
+        it = iter(iterable)
+        while True:
+            with self.timed(name) as stage:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                stage.rows += 1
+            yield item
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {name: s.as_dict() for name, s in sorted(self.stages.items())}
+
+    def merge(self, stages: Dict[str, Dict[str, float]]):
+        """
+        Add the totals of another `as_dict` report.
+        """
+        for name, totals in stages.items():
+            stage = self.get(name)
+            for f in Stage.FIELDS:
+                setattr(stage, f, getattr(stage, f) + totals[f])
+
+
+class Result(NamedTuple):
+    """
+    Outcome of loading one file, by a worker process or a pipeline slot.
+    """
+
+    file: str
+    # Worker process id, or pipeline slot number
+    worker: int
+    ok: bool
+    videos: int
+    size: int
+    seconds: float
+    skipped: bool = False
+    # Per-stage totals, see `Metrics.as_dict`
+    stages: Optional[Dict] = None
+
+
+# Metrics of the file being loaded. A context variable, so files loaded side
+# by side in one process (see `pipeline`) each get their own.
+context: "contextvars.ContextVar[Metrics]" = contextvars.ContextVar("metrics")
+
+
+def current() -> Metrics:
+    m = context.get(None)
+    if m is None:
+        m = begin()
+    return m
+
+
+def begin() -> Metrics:
+    """
+    Start collecting a fresh set of metrics, e.g. for the next file.
+    """
+    m = Metrics()
+    context.set(m)
+    return m
+
+
+def timed(name: str, rows: int = 0, bytes: int = 0):
+    return current().timed(name, rows, bytes)
+
+
+def iterate(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    return current().iterate(name, iterable)
+
+
+class Progress:
+    """
+    Log how many items are done at most once every `interval` seconds, rather
+    than a line per item.
+    """
+
+    def __init__(self, label: str, interval: float = PROGRESS_INTERVAL):
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self.start = self.last = time.monotonic()
+
+    def update(self, n: int = 1):
+        self.count += n
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            rate = self.count / (now - self.start)
+            logging.info(f"{self.label}: {self.count} ({rate:.0f}/s)")
+
+
+def report(files: Dict[str, Dict], seconds: float) -> Dict:
+    """
+    Combine per-file metrics into a run report.
+
+    Args:
+        files (Dict[str, Dict]): Per file, a dict with `seconds`, `videos`,
+            `bytes` and `stages` (`Metrics.as_dict`).
+        seconds (float): Wall time of the run.
+
+    Returns:
+        Dict: `run` totals and stages summed over files, and `files`.
+    """
+    total = Metrics()
+    for f in files.values():
+        total.merge(f["stages"])
+    return {
+        "run": {
+            "seconds": seconds,
+            "files": len(files),
+            "videos": sum(f["videos"] for f in files.values()),
+            "bytes": sum(f["bytes"] for f in files.values()),
+            "stages": total.as_dict(),
+        },
+        "files": files,
+    }
+
+
+def label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus(report: Dict) -> str:
+    """
+    Render a `report` in the Prometheus text exposition format.
+
+    Stage totals are labelled by file and stage; sum over `file` for the run.
+    """
+    lines = []
+    for name in ("seconds", "files", "videos", "bytes"):
+        metric = f"{PREFIX}_run_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {report['run'][name]}")
+
+    for field in Stage.FIELDS:
+        metric = f"{PREFIX}_stage_{field}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for file, f in sorted(report["files"].items()):
+            for stage, totals in f["stages"].items():
+                lines.append(
+                    f'{metric}{{file="{label(file)}",stage="{label(stage)}"}} '
+                    f"{totals[field]}"
+                )
+    return "\n".join(lines) + "\n"
+
+
+def write(report: Dict, path: str):
+    """
+    Write a `report` to `path`: Prometheus text if it ends in `.prom`, JSON
+    otherwise.
+    """
+    with open(path, "w") as f:
+        if path.endswith(".prom"):
+            f.write(prometheus(report))
+        else:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def log_slowest(stages: Dict[str, Dict[str, float]], n: int = 5):
+    """
+    Log the `n` stages with the most self time.
+    """
+    slowest = sorted(stages.items(), key=lambda s: s[1]["self_seconds"], reverse=True)
+    for name, s in slowest[:n]:
+        logging.info(
+            f"{name}: {s['self_seconds']:.3f}s self, {int(s['calls'])} calls, "
+            f"{int(s['rows'])} rows, {int(s['statements'])} statements"
+        )
@@ -0,0 +1,330 @@
+import argparse
+import logging
+import re
+import peewee as p
+from playhouse.migrate import SchemaMigrator, migrate
+from typing import Dict, List, Optional, Set, Type
+
+from yt_schema import bulk, mapping, tables
+from yt_schema.timestamps import TimestampField
+from yt_schema.database import db, is_postgres
+
+# Rows rewritten per transaction while backfilling a promoted column.
+BATCH_SIZE: int = 10_000
+
+# Column types a key can be promoted to, with the Postgres cast of its text.
+TYPES: Dict[str, Type[p.Field]] = {
+    "text": p.TextField,
+    "integer": p.IntegerField,
+    "bigint": p.BigIntegerField,
+    "double": p.DoubleField,
+    "boolean": p.BooleanField,
+    "timestamp": TimestampField,
+}
+CASTS: Dict[str, str] = {
+    "text": "text",
+    "integer": "integer",
+    "bigint": "bigint",
+    "double": "double precision",
+    "boolean": "boolean",
+    "timestamp": "timestamptz",
+}
+
+# Ids of the Promoted rows attached to the models in this process.
+applied: Set[int] = set()
+
+# Tables whose unmapped keys are kept in an overflow column.
+OVERFLOW: Dict[str, Type[p.Model]] = {
+    m.model._meta.table_name: m.model for m in mapping.mappings if m.overflow
+}
+
+
+class Promoted(p.Model):
+    """
+    A JSON key moved out of a table's overflow column into a column of its own.
+    """
+
+    table = p.TextField()
+    key = p.TextField()
+    column = p.TextField()
+    type = p.TextField()
+
+    class Meta:
+        database = db
+        indexes = ((("table", "column"), True),)
+
+
+def init(reset: bool = False):
+    """
+    Bring existing tables up to date with the models and attach promoted
+    columns. Called after `tables.init`.
+    """
+    if reset:
+        db.drop_tables([Promoted], safe=True)
+    db.create_tables([Promoted])
+    apply()
+    add_missing_columns(tables.TABLES)
+
+
+def add_missing_columns(models: List[Type[p.Model]]):
+    """
+    ALTER TABLE ... ADD COLUMN for nullable fields a table was created without,
+    e.g. the overflow columns on a database from before they existed.
+    """
+    migrator = SchemaMigrator.from_database(db.obj)
+    for model in models:
+        table = model._meta.table_name
+        if not model.table_exists():
+            continue
+        existing = {c.name for c in db.get_columns(table)}
+        for f in model._meta.sorted_fields:
+            if f.column_name not in existing and f.null:
+                logging.info(f"{table}: adding column {f.column_name}")
+                migrate(migrator.add_column(table, f.column_name, f))
+
+
+def overflow(model: Type[p.Model]) -> p.Field:
+    for m in mapping.mappings:
+        if m.model is model and m.overflow:
+            return model._meta.fields[m.overflow]
+    raise ValueError(f"{model._meta.table_name} has no overflow column")
+
+
+def attach(model: Type[p.Model], key: str, column: str, type: str):
+    """
+    Add a promoted column to the model and have its mappings read `key` into it.
+    """
+    if column not in model._meta.fields:
+        model._meta.add_field(column, TYPES[type](null=True))
+    for m in mapping.mappings:
+        if m.model is model:
+            m.keys[column] = key
+
+
+def apply():
+    """
+    Attach every recorded promotion to the models and recompile the row
+    extractors, so promoted keys are written to their columns.
+    """
+    if Promoted.table_exists():
+        refresh()
+
+
+def refresh():
+    """
+    Attach promotions recorded since the last call, e.g. by `promote` in
+    another process. One query when there are none, so loaders call it before
+    every file; extractors are only recompiled when something changed.
+    """
+    new = list(Promoted.select().where(Promoted.id.not_in(applied)))
+    if not new:
+        return
+    for r in new:
+        logging.info(f"{r.table}: writing {r.key!r} to {r.column}")
+        attach(OVERFLOW[r.table], r.key, r.column, r.type)
+        applied.add(r.id)
+    recompile()
+
+
+def recompile():
+    for m in mapping.mappings:
+        m.refresh()
+    bulk.columns.cache_clear()
+
+
+def path(key: str) -> str:
+    """
+    SQLite JSON path of a top-level key.
+    """
+    if '"' in key:
+        raise ValueError(f"unsupported key: {key!r}")
+    return f'$."{key}"'
+
+
+def literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def key_counts(model: Type[p.Model]) -> Dict[str, int]:
+    """
+    Rows holding each key of the model's overflow column, most common first.
+    """
+    table = model._meta.table_name
+    column = overflow(model).column_name
+    if is_postgres():
+        sql = (
+            f'SELECT k, COUNT(*) FROM "{table}", jsonb_object_keys("{column}") k '
+            "GROUP BY k ORDER BY COUNT(*) DESC, k"
+        )
+    else:
+        sql = (
+            f'SELECT j.key, COUNT(*) FROM "{table}", json_each("{table}"."{column}") j '
+            "GROUP BY j.key ORDER BY COUNT(*) DESC, j.key"
+        )
+    return dict(db.execute_sql(sql).fetchall())
+
+
+def promote(
+    model: Type[p.Model],
+    key: str,
+    column: Optional[str] = None,
+    type: str = "text",
+    batch_size: int = BATCH_SIZE,
+):
+    """
+    Move a JSON key out of the overflow column into a real column.
+
+    The column is added in place, then existing rows are backfilled in id
+    ranges of `batch_size`, one transaction each, so ingest keeps running and
+    an interrupted backfill simply resumes on the next call.
+
+    Loaders pick the promotion up at the start of their next file (see
+    `refresh`), and write the key straight to the column from then on. Files
+    already loading meanwhile, and a running `--pipeline` load, still write
+    it to the overflow column: call `promote` again once they are done to
+    move those rows too.
+
+    Args:
+        model (Type[p.Model]): Entry or Payload.
+        key (str): The yt-dlp key.
+        column (Optional[str]): Column name, by default the key's.
+        type (str): One of `TYPES`.
+        batch_size (int): Rows rewritten per transaction.
+    """
+    column = column or key
+    if type not in TYPES:
+        raise ValueError(f"unknown type: {type}")
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", column):
+        raise ValueError(f"invalid column name: {column!r}")
+    table = model._meta.table_name
+    extra = overflow(model).column_name
+    promoted = Promoted.get_or_none(table=table, column=column)
+    if column in model._meta.fields and promoted is None:
+        raise ValueError(f"{table} already has column {column!r}")
+
+    attach(model, key, column, type)
+    add_missing_columns([model])
+    Promoted.insert(table=table, key=key, column=column, type=type).on_conflict(
+        conflict_target=[Promoted.table, Promoted.column],
+        preserve=[Promoted.key, Promoted.type],
+    ).execute()
+
+    if is_postgres():
+        sql = (
+            f'UPDATE "{table}" SET "{column}" = ("{extra}" ->> %s)::{CASTS[type]}, '
+            f'"{extra}" = NULLIF("{extra}" - %s, \'{{}}\'::jsonb) '
+            f'WHERE "id" BETWEEN %s AND %s AND "{extra}" ? %s'
+        )
+        params = [key, key]
+        where = [key]
+    else:
+        sql = (
+            f'UPDATE "{table}" SET "{column}" = json_extract("{extra}", ?), '
+            f'"{extra}" = NULLIF(json_remove("{extra}", ?), \'{{}}\') '
+            f'WHERE "id" BETWEEN ? AND ? AND json_type("{extra}", ?) IS NOT NULL'
+        )
+        params = [path(key), path(key)]
+        where = [path(key)]
+
+    low, high = db.execute_sql(f'SELECT MIN("id"), MAX("id") FROM "{table}"').fetchone()
+    moved = 0
+    for start in range(low or 0, (high or -1) + 1, batch_size):
+        with db.atomic():
+            cursor = db.execute_sql(
+                sql, params + [start, start + batch_size - 1] + where
+            )
+            moved += cursor.rowcount
+    logging.info(f"{table}: promoted {key!r} to {column} ({moved} rows)")
+    recompile()
+
+
+def index(model: Type[p.Model], key: str):
+    """
+    Index one key of the overflow column, for equality and range lookups.
+
+    Built concurrently on Postgres, so ingest is not blocked meanwhile.
+    """
+    table = model._meta.table_name
+    extra = overflow(model).column_name
+    name = f"{table}_{extra}_{re.sub(r'[^a-z0-9]+', '_', key.lower())}"[:63]
+    if is_postgres():
+        expression = f'("{extra}" ->> {literal(key)})'
+        concurrently = "CONCURRENTLY "
+    else:
+        expression = f'json_extract("{extra}", {literal(path(key))})'
+        concurrently = ""
+    db.execute_sql(
+        f'CREATE INDEX {concurrently}IF NOT EXISTS "{name}" '
+        f'ON "{table}" ({expression})'
+    )
+    logging.info(f"{table}: indexed {key!r} as {name}")
+
+
+def gin(model: Type[p.Model]):
+    """
+    GIN index over the whole overflow column, for containment queries
+    (`extra @> '{"key": value}'`) on any key. Postgres only.
+    """
+    table = model._meta.table_name
+    extra = overflow(model).column_name
+    if not is_postgres():
+        logging.warning(f"{table}: GIN indexes need Postgres, skipped")
+        return
+    db.execute_sql(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{table}_{extra}_gin" '
+        f'ON "{table}" USING GIN ("{extra}" jsonb_path_ops)'
+    )
+    logging.info(f"{table}: GIN index on {extra}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Inspect, index and promote keys of the JSON overflow columns."
+    )
+    parser.add_argument("table", choices=sorted(OVERFLOW), help="table to work on")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("keys", help="count the rows holding each overflow key")
+
+    parser_promote = commands.add_parser(
+        "promote", help="move a key into a column of its own and backfill it"
+    )
+    parser_promote.add_argument("key")
+    parser_promote.add_argument("--column", help="column name (default: the key)")
+    parser_promote.add_argument(
+        "--type", choices=sorted(TYPES), default="text", help="(default: text)"
+    )
+    parser_promote.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"rows rewritten per transaction (default: {BATCH_SIZE})",
+    )
+
+    parser_index = commands.add_parser("index", help="expression index on a key")
+    parser_index.add_argument("key")
+
+    commands.add_parser("gin", help="GIN index on the whole overflow column")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args(argv)
+    init()
+    model = OVERFLOW[args.table]
+    if args.command == "keys":
+        for key, count in key_counts(model).items():
+            print(f"{count}\t{key}")
+    elif args.command == "promote":
+        promote(model, args.key, args.column, args.type, args.batch_size)
+    elif args.command == "index":
+        index(model, args.key)
+    elif args.command == "gin":
+        gin(model)
+
+
+if __name__ == "__main__":
+    main()
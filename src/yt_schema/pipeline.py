@@ -0,0 +1,327 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import peewee as p
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from yt_schema import (
+    archive,
+    bulk,
+    dictionary,
+    manifest,
+    metrics,
+    stream,
+    tables,
+    timeseries,
+)
+from yt_schema.database import db, is_postgres
+from yt_schema.metrics import Result
+from yt_schema.tables import ChannelTag, ChannelThumbnail
+
+# Videos decoded per chunk handed from the reader to the row builder.
+CHUNK_SIZE: int = 100
+
+# Chunks, and row batches, waiting between two stages. Together with
+# `bulk.BATCH_SIZE` this bounds the memory of a file in flight.
+QUEUE_SIZE: int = 4
+
+# Marks the end of a queue.
+DONE = None
+
+
+class Staged(bulk.Copier):
+    """
+    Copier whose buffers are handed over to a writer thread as batches
+    rather than flushed by whoever adds the rows.
+    """
+
+    def add(self, model: Type[p.Model], row: Tuple):
+        self.buffers[model].append(row)
+        self.pending += 1
+
+    def take(self) -> Dict[Type[p.Model], List[Tuple]]:
+        batch = {m: rows for m, rows in self.buffers.items() if rows}
+        self.buffers = {m: [] for m in bulk.ORDER}
+        self.pending = 0
+        return batch
+
+    def write_batch(self, batch: Dict[Type[p.Model], List[Tuple]]):
+        # Parents first, so that foreign keys resolve
+        for model in bulk.ORDER:
+            rows = batch.get(model)
+            if rows:
+                self.copy(model, rows)
+
+
+class Slot:
+    """
+    The threads one file at a time is loaded on.
+
+    Writes go through a single thread, so its connection holds the file's
+    transaction across calls. On Postgres rows are built on a second thread
+    whose own connection reserves ids and interns symbols, both safe outside
+    the transaction. SQLite allows one writer at a time and reserves ids from
+    the table itself, so there both run on the writer thread.
+    """
+
+    def __init__(self, number: int):
+        self.number = number
+        self.writer = concurrent.futures.ThreadPoolExecutor(1, f"writer-{number}")
+        self.builder = (
+            concurrent.futures.ThreadPoolExecutor(1, f"builder-{number}")
+            if is_postgres()
+            else self.writer
+        )
+        self.txn: Optional[p._atomic] = None
+
+    def shutdown(self):
+        for executor in {self.writer, self.builder}:
+            executor.submit(db.close).result()
+            executor.shutdown()
+
+    # The methods below run on the writer thread
+
+    def begin(self, data: Dict, replace: bool) -> int:
+        self.txn = db.atomic()
+        self.txn.__enter__()
+        if replace:
+            tables.purge(data.get("channel_id"))
+        return tables.channel(data).get_id()
+
+    def commit(self, channel_id: int, version: Optional[Dict], stat: manifest.Stat):
+        tables.version(tables.Payload(id=channel_id), version)
+        txn, self.txn = self.txn, None
+        txn.__exit__(None, None, None)
+        manifest.record(stat)
+
+    def rollback(self, error: BaseException):
+        txn, self.txn = self.txn, None
+        if txn is not None:
+            txn.__exit__(type(error), error, error.__traceback__)
+        if not is_postgres():
+            # Symbols created within the rolled back transaction are gone,
+            # see `dictionary.outside`
+            dictionary.clear()
+
+
+async def run(executor: concurrent.futures.Executor, fn: Callable, *args):
+    """
+    Run `fn` on `executor`, in the caller's context so that its stages are
+    counted towards the caller's file.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor, functools.partial(context.run, fn, *args)
+    )
+
+
+def produce(
+    path: str,
+    chunks: asyncio.Queue,
+    loop: asyncio.AbstractEventLoop,
+    stop: threading.Event,
+):
+    """
+    Reader stage: stream the file's videos into `chunks`, blocking while the
+    queue is full.
+    """
+    for chunk in p.chunked(tables.videos(stream.Entries(path)), CHUNK_SIZE):
+        if stop.is_set():
+            return
+        asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+    if not stop.is_set():
+        asyncio.run_coroutine_threadsafe(chunks.put(DONE), loop).result()
+
+
+def build(c: Staged, data: List[Dict]) -> Optional[Dict]:
+    """
+    Builder stage: turn a chunk of videos into rows, returning a batch once
+    enough rows are buffered.
+    """
+    with metrics.timed("build rows", rows=len(data)):
+        for d in data:
+            bulk.entry(c, d)
+    return c.take() if c.pending >= c.batch_size else None
+
+
+def timed(name: str, fn: Callable, *args):
+    # Timed on the thread doing the work, where nested stages are counted
+    with metrics.timed(name):
+        return fn(*args)
+
+
+class Pipeline:
+    """
+    Load files with reading, row building and writing overlapped.
+
+    Each file flows through three stages joined by bounded queues: a reader
+    thread decoding videos, a builder turning them into rows and a writer
+    thread copying the rows in. A full queue blocks the stage feeding it, so
+    memory stays flat however large the file. `slots` files are in flight at
+    once, so one file is decoded while another waits on the database.
+
+    Rows are the same as `bulk.create` writes, and each file is still loaded
+    in a single transaction.
+    """
+
+    def __init__(
+        self,
+        slots: int = 2,
+        batch_size: int = bulk.BATCH_SIZE,
+        changes_only: bool = False,
+        archive_raw: bool = False,
+    ):
+        if not is_postgres() and slots > 1:
+            logging.info("sqlite has a single writer: loading one file at a time")
+            slots = 1
+        self.slots = slots
+        self.batch_size = batch_size
+        self.changes_only = changes_only
+        self.archive_raw = archive_raw
+        self.readers = concurrent.futures.ThreadPoolExecutor(slots, "reader")
+
+    async def load(self, file: str, slot: Slot) -> Result:
+        start = time.perf_counter()
+        path = os.path.join("resources", file)
+        size = os.path.getsize(path)
+        videos = 0
+        ok = True
+        m = metrics.begin()
+
+        try:
+            stat = await run(slot.writer, manifest.changed, path)
+            if stat is None:
+                logging.info(f"Skipping unchanged {file}")
+                return Result(file, slot.number, ok, videos, size, 0.0, True)
+
+            data = await run(self.readers, stream.header, path)
+            logging.info(f"Creating table for {file}")
+            entries = dict(data, entries=stream.Entries(path))
+            if self.archive_raw:
+                await run(slot.writer, timed, "archive", archive.store, entries)
+            if await run(slot.writer, manifest.snapshotted, stat):
+                # A previous attempt failed after its snapshot committed
+                logging.info(f"Snapshot of {file} already recorded")
+            else:
+                await run(
+                    slot.writer,
+                    timed,
+                    "timeseries",
+                    timeseries.create,
+                    entries,
+                    self.changes_only,
+                    None,
+                    functools.partial(manifest.record_snapshot, stat),
+                )
+            videos = await self.load_tables(path, data, stat, slot)
+        except Exception:
+            logging.exception(f"Failed to load {file}")
+            ok = False
+
+        seconds = time.perf_counter() - start
+        return Result(file, slot.number, ok, videos, size, seconds, False, m.as_dict())
+
+    async def load_tables(
+        self, path: str, data: Dict, stat: manifest.Stat, slot: Slot
+    ) -> int:
+        """
+        Load the relational rows of one file, returning its number of videos.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        batches: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        c = Staged(db, self.batch_size)
+        videos = 0
+
+        async def builder():
+            nonlocal videos
+            for t in data.get("thumbnails") or []:
+                c.add(ChannelThumbnail, tables.CHANNEL_THUMBNAIL.row(t, channel_id))
+            while True:
+                chunk = await chunks.get()
+                if chunk is DONE:
+                    break
+                videos += len(chunk)
+                batch = await run(slot.builder, build, c, chunk)
+                if batch is not None:
+                    await batches.put(batch)
+            for tag in data.get("tags") or []:
+                c.add(ChannelTag, (channel_id, tag))
+            await batches.put(c.take())
+            await batches.put(DONE)
+
+        async def writer():
+            while True:
+                batch = await batches.get()
+                if batch is DONE:
+                    break
+                await run(slot.writer, c.write_batch, batch)
+
+        stop = threading.Event()
+        reader: Optional[asyncio.Future] = None
+        tasks: List[asyncio.Future] = []
+        try:
+            channel_id = await run(slot.writer, slot.begin, data, stat.seen)
+            # Not a task: the thread cannot be cancelled, only asked to stop
+            reader = loop.run_in_executor(
+                self.readers,
+                functools.partial(
+                    contextvars.copy_context().run, produce, path, chunks, loop, stop
+                ),
+            )
+            tasks = [asyncio.ensure_future(builder()), asyncio.ensure_future(writer())]
+            await asyncio.gather(reader, *tasks)
+            await run(slot.writer, slot.commit, channel_id, data.get("_version"), stat)
+        except BaseException as error:
+            stop.set()
+            for t in tasks:
+                t.cancel()
+            # Make room for a reader blocked on the full queue, so it can stop
+            while reader is not None and not reader.done():
+                while not chunks.empty():
+                    chunks.get_nowait()
+                await asyncio.sleep(0.01)
+            await run(slot.writer, slot.rollback, error)
+            raise
+        return videos
+
+    async def load_all(self, files: List[str]) -> List[Result]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for f in files:
+            queue.put_nowait(f)
+        results: List[Result] = []
+
+        async def worker(number: int):
+            slot = Slot(number)
+            try:
+                while not queue.empty():
+                    results.append(await self.load(queue.get_nowait(), slot))
+            finally:
+                slot.shutdown()
+
+        try:
+            await asyncio.gather(*(worker(i) for i in range(self.slots)))
+        finally:
+            self.readers.shutdown()
+        return results
+
+
+def load(files: List[str], slots: int = 2, **kwargs) -> List[Result]:
+    """
+    Load `files` from the resources directory with a `Pipeline`.
+
+    Args:
+        files (List[str]): File names, loaded in the order given.
+        slots (int): Files in flight at once.
+        **kwargs: Passed to `Pipeline`.
+
+    Returns:
+        List[Result]: One result per file.
+    """
+    return asyncio.run(Pipeline(slots, **kwargs).load_all(files))
@@ -0,0 +1,337 @@
+import datetime
+import functools
+import math
+import re
+import time
+import weakref
+from typing import Callable, List, NamedTuple, Optional, Set, Tuple
+
+from yt_schema import heatmap, rollup, timestamps
+from yt_schema.database import db, is_postgres
+from yt_schema.dictionary import LRU
+from yt_schema.timeseries import VideoStats
+
+# Rows returned per page unless asked otherwise.
+PAGE_SIZE: int = 100
+
+# Entries kept per cached function, and for how many seconds.
+CACHE_SIZE: int = 4096
+CACHE_TTL: float = 60.0
+
+# Keyset cursors for the first page: before every real row.
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timestamps.UTC)
+MAX_BIGINT: int = 2**63 - 1
+
+PARAM = re.compile(r"\$(\d+)")
+
+# Names of the statements prepared on each Postgres connection.
+prepared: "weakref.WeakKeyDictionary[object, Set[str]]" = weakref.WeakKeyDictionary()
+
+
+class Statement:
+    """
+    A parameterized query with `$1`-style placeholders.
+
+    On Postgres it is prepared server-side the first time a connection runs
+    it and executed by name afterwards, so repeated lookups skip parsing and
+    planning. SQLite's driver already caches compiled statements per
+    connection, so there it runs as is.
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.sqlite = PARAM.sub(r"?\1", sql)
+
+    def execute(self, *params) -> List[Tuple]:
+        if not is_postgres():
+            # Stored the way TimestampFields write them, so they compare
+            params = tuple(
+                (
+                    str(timestamps.utc(v).replace(tzinfo=None))
+                    if isinstance(v, datetime.datetime)
+                    else v
+                )
+                for v in params
+            )
+            return db.execute_sql(self.sqlite, params).fetchall()
+
+        names = prepared.setdefault(db.connection(), set())
+        if self.name not in names:
+            db.execute_sql(f"PREPARE {self.name} AS {self.sql}")
+            names.add(self.name)
+        args = ", ".join(["%s"] * len(params))
+        return db.execute_sql(
+            f"EXECUTE {self.name} ({args})" if params else f"EXECUTE {self.name}",
+            params,
+        ).fetchall()
+
+
+class TTLCache(LRU):
+    """
+    LRU whose entries also expire `ttl` seconds after being stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key: object):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.data[key]
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return value
+
+    def put(self, key: object, value):
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+
+def cached(fn: Callable) -> Callable:
+    """
+    Serve repeated calls with the same arguments from a `TTLCache` for up to
+    `CACHE_TTL` seconds. The cache is exposed as `fn.cache`.
+    """
+    cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        value = cache.get(key)
+        if value is None:
+            value = fn(*args, **kwargs)
+            cache.put(key, value)
+        return value
+
+    wrapper.cache = cache
+    return wrapper
+
+
+def timestamp(value) -> datetime.datetime:
+    # SQLite hands TimestampFields back as text
+    return VideoStats.timestamp.python_value(value)
+
+
+class Page(NamedTuple):
+    items: Tuple
+    # Pass as `after` to get the next page; None on the last one
+    after: Optional[Tuple]
+
+
+def page(items: List, limit: int, cursor: Callable) -> Page:
+    return Page(tuple(items), cursor(items[-1]) if len(items) == limit else None)
+
+
+class ViewPoint(NamedTuple):
+    timestamp: datetime.datetime
+    view_count: int
+    comment_count: Optional[int]
+
+
+VIEW_HISTORY = Statement(
+    "yt_view_history",
+    'SELECT "timestamp", "view_count", "comment_count" FROM "videostats" '
+    'WHERE "video_id" = $1 AND "timestamp" > $2 '
+    'ORDER BY "timestamp" LIMIT $3',
+)
+
+
+@cached
+def view_history(
+    video_id: str, after: Optional[Tuple] = None, limit: int = PAGE_SIZE
+) -> Page:
+    """
+    A video's recorded view and comment counts, oldest first.
+
+    Snapshots taken with `changes_only` only record changes, so each point
+    holds until the next one.
+
+    Args:
+        video_id (str): The video's display id.
+        after (Optional[Tuple]): `Page.after` of the previous page.
+        limit (int): Points per page.
+
+    Returns:
+        Page: ViewPoint items.
+    """
+    (since,) = after or (EPOCH,)
+    rows = VIEW_HISTORY.execute(video_id, since, limit)
+    points = [ViewPoint(timestamp(t), v, c) for t, v, c in rows]
+    return page(points, limit, lambda p: (p.timestamp,))
+
+
+class Growth(NamedTuple):
+    bucket: datetime.datetime
+    subscriber_count: Optional[int]
+    subscriber_count_delta: Optional[int]
+    subscriber_count_growth: Optional[float]
+    video_count: Optional[int]
+    video_count_delta: Optional[int]
+    video_count_growth: Optional[float]
+    view_count: Optional[int]
+    view_count_delta: Optional[int]
+    view_count_growth: Optional[float]
+
+
+GROWTH_COLUMNS = ", ".join(f'"{c}"' for c in Growth._fields)
+
+CHANNEL_GROWTH = {
+    model.grain: Statement(
+        f"yt_channel_growth_{model.grain}",
+        f'SELECT {GROWTH_COLUMNS} FROM "{model._meta.table_name}" '
+        'WHERE "channel_id" = $1 AND "bucket" > $2 ORDER BY "bucket" LIMIT $3',
+    )
+    for model in rollup.CHANNEL_ROLLUPS
+}
+
+
+@cached
+def channel_growth(
+    channel_id: str,
+    grain: str = "day",
+    after: Optional[Tuple] = None,
+    limit: int = PAGE_SIZE,
+) -> Page:
+    """
+    A channel's subscribers, videos and views per bucket, with the change from
+    the previous bucket and its growth rate, oldest first.
+
+    Args:
+        channel_id (str): The channel's id.
+        grain (str): "hour" or "day".
+        after (Optional[Tuple]): `Page.after` of the previous page.
+        limit (int): Buckets per page.
+
+    Returns:
+        Page: Growth items.
+    """
+    (since,) = after or (EPOCH,)
+    rows = CHANNEL_GROWTH[grain].execute(channel_id, since, limit)
+    buckets = [Growth(timestamp(r[0]), *r[1:]) for r in rows]
+    return page(buckets, limit, lambda g: (g.bucket,))
+
+
+class Ranked(NamedTuple):
+    video_id: str
+    # Views, or views gained during the day for "velocity"
+    value: int
+
+
+TOP_BY_VIEWS = Statement(
+    "yt_top_by_views",
+    'SELECT "video_id", "view_count" FROM "lastknown" '
+    'WHERE ("view_count", "video_id") < ($1, $2) '
+    'ORDER BY "view_count" DESC, "video_id" DESC LIMIT $3',
+)
+
+TOP_BY_VELOCITY = Statement(
+    "yt_top_by_velocity",
+    'SELECT "video_id", "view_count_delta" FROM "videodaily" '
+    'WHERE "bucket" = $1 AND ("view_count_delta", "video_id") < ($2, $3) '
+    'ORDER BY "view_count_delta" DESC, "video_id" DESC LIMIT $4',
+)
+
+LATEST_DAY = Statement("yt_latest_day", 'SELECT MAX("bucket") FROM "videodaily"')
+
+
+@cached
+def top_videos(
+    by: str = "views",
+    day: Optional[datetime.datetime] = None,
+    after: Optional[Tuple] = None,
+    limit: int = PAGE_SIZE,
+) -> Page:
+    """
+    Videos ranked by their latest view count, or by views gained in a day.
+
+    Args:
+        by (str): "views" or "velocity".
+        day (Optional[datetime.datetime]): Day ranked by "velocity", by
+            default the latest one with rollups.
+        after (Optional[Tuple]): `Page.after` of the previous page.
+        limit (int): Videos per page.
+
+    Returns:
+        Page: Ranked items, highest first.
+    """
+    value, video_id = after or (MAX_BIGINT, "")
+    if by == "views":
+        rows = TOP_BY_VIEWS.execute(value, video_id, limit)
+    elif by == "velocity":
+        if day is None:
+            (latest,) = LATEST_DAY.execute()[0]
+            if latest is None:
+                return Page((), None)
+            day = timestamp(latest)
+        day = rollup.GRAINS["day"](day)
+        rows = TOP_BY_VELOCITY.execute(day, value, video_id, limit)
+    else:
+        raise ValueError(f"unknown ranking: {by}")
+    ranked = [Ranked(*r) for r in rows]
+    return page(ranked, limit, lambda r: (r.value, r.video_id))
+
+
+class Peak(NamedTuple):
+    start_time: float
+    end_time: float
+    value: float
+
+
+LATEST_HEATMAP = Statement(
+    "yt_latest_heatmap",
+    'SELECT "grid", "duration", "values" FROM "heatmapstats" '
+    'WHERE "video_id" = $1 ORDER BY "timestamp" DESC LIMIT 1',
+)
+
+GRID = Statement(
+    "yt_heatmap_grid", 'SELECT "starts", "ends" FROM "heatmapgrid" WHERE "id" = $1'
+)
+
+# Unpacked bucket boundaries, as fractions of the duration, by grid id; grids
+# never change.
+grids = LRU(CACHE_SIZE)
+
+
+def grid(grid_id: int) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    bounds = grids.get(grid_id)
+    if bounds is None:
+        starts, ends = GRID.execute(grid_id)[0]
+        bounds = heatmap.unpack(bytes(starts)), heatmap.unpack(bytes(ends))
+        grids.put(grid_id, bounds)
+    return bounds
+
+
+@cached
+def heatmap_peaks(video_id: str, n: int = 3) -> Tuple[Peak, ...]:
+    """
+    The most replayed moments of a video in its latest heatmap: buckets at
+    least as high as both neighbours, highest first.
+
+    Args:
+        video_id (str): The video's display id.
+        n (int): Peaks returned at most.
+
+    Returns:
+        Tuple[Peak, ...]: Empty if the video has no heatmap.
+    """
+    rows = LATEST_HEATMAP.execute(video_id)
+    if not rows:
+        return ()
+    grid_id, duration, blob = rows[0]
+    starts, ends = grid(grid_id)
+    values = heatmap.unpack(bytes(blob))
+
+    # Missing buckets are NaN and never peak
+    padded = [-math.inf] + [-math.inf if math.isnan(v) else v for v in values]
+    padded.append(-math.inf)
+
+    peaks = []
+    for i, v in enumerate(padded[1:-1]):
+        if v > -math.inf and v >= padded[i] and v >= padded[i + 2]:
+            peaks.append(Peak(starts[i] * duration, ends[i] * duration, v))
+    return tuple(sorted(peaks, key=lambda p: p.value, reverse=True)[:n])
@@ -0,0 +1,223 @@
+import datetime
+import itertools
+import logging
+import peewee as p
+from typing import Callable, Dict, List, Tuple, Type
+
+from yt_schema import metrics, timestamps
+from yt_schema.database import db
+from yt_schema.timestamps import TimestampField
+
+# Rollups are keyed by bucket start in UTC, truncated to the grain as seen in
+# `timestamps.ZONE`, so days can follow the audience's calendar.
+GRAINS: Dict[str, Callable[[datetime.datetime], datetime.datetime]] = {
+    "hour": lambda ts: timestamps.truncate(ts, minute=0, second=0, microsecond=0),
+    "day": lambda ts: timestamps.truncate(
+        ts, hour=0, minute=0, second=0, microsecond=0
+    ),
+}
+
+
+class BaseModel(p.Model):
+    class Meta:
+        database = db
+
+
+# For every metric a rollup keeps the last value seen in the bucket, the
+# change since the last value of the key's previous bucket, and that change
+# relative to the previous value.
+
+
+class VideoRollup(BaseModel):
+    key = "video_id"
+    metrics = ["view_count", "comment_count"]
+
+    bucket = TimestampField()
+    video_id = p.TextField()
+    # Snapshot the last values were taken from
+    last_at = TimestampField()
+    view_count = p.BigIntegerField(null=True)
+    view_count_delta = p.BigIntegerField(null=True)
+    view_count_growth = p.DoubleField(null=True)
+    comment_count = p.BigIntegerField(null=True)
+    comment_count_delta = p.BigIntegerField(null=True)
+    comment_count_growth = p.DoubleField(null=True)
+
+    class Meta:
+        indexes = (
+            (("video_id", "bucket"), True),
+            # Ranking by velocity, see `query.top_videos`
+            (("bucket", "view_count_delta"), False),
+        )
+
+
+class VideoHourly(VideoRollup):
+    grain = "hour"
+
+
+class VideoDaily(VideoRollup):
+    grain = "day"
+
+
+class ChannelRollup(BaseModel):
+    key = "channel_id"
+    metrics = ["subscriber_count", "video_count", "view_count"]
+
+    bucket = TimestampField()
+    channel_id = p.TextField()
+    last_at = TimestampField()
+    subscriber_count = p.BigIntegerField(null=True)
+    subscriber_count_delta = p.BigIntegerField(null=True)
+    subscriber_count_growth = p.DoubleField(null=True)
+    video_count = p.IntegerField(null=True)
+    video_count_delta = p.IntegerField(null=True)
+    video_count_growth = p.DoubleField(null=True)
+    view_count = p.BigIntegerField(null=True)
+    view_count_delta = p.BigIntegerField(null=True)
+    view_count_growth = p.DoubleField(null=True)
+
+    class Meta:
+        indexes = ((("channel_id", "bucket"), True),)
+
+
+class ChannelHourly(ChannelRollup):
+    grain = "hour"
+
+
+class ChannelDaily(ChannelRollup):
+    grain = "day"
+
+
+VIDEO_ROLLUPS = [VideoHourly, VideoDaily]
+CHANNEL_ROLLUPS = [ChannelHourly, ChannelDaily]
+tables = VIDEO_ROLLUPS + CHANNEL_ROLLUPS
+
+
+def init(reset: bool = False):
+    """
+    Create the rollup tables. Called by `timeseries.init`.
+    """
+    if reset:
+        db.drop_tables(tables, safe=True)
+    db.create_tables(tables)
+    timestamps.upgrade(tables)
+
+
+def previous(
+    model: Type[BaseModel], keys: List[str], bucket: datetime.datetime
+) -> Dict[str, Tuple]:
+    """
+    Metric values of each key's latest bucket before `bucket`.
+    """
+    key = getattr(model, model.key)
+    found: Dict[str, Tuple] = {}
+    for chunk in p.chunked(keys, 500):
+        latest = (
+            model.select(key.alias("key"), p.fn.MAX(model.bucket).alias("bucket"))
+            .where(key.in_(chunk), model.bucket < bucket)
+            .group_by(key)
+        )
+        query = model.select(key, *[getattr(model, m) for m in model.metrics]).join(
+            latest,
+            on=((key == latest.c.key) & (model.bucket == latest.c.bucket)),
+        )
+        for row in query.tuples():
+            found[row[0]] = row[1:]
+    return found
+
+
+def update(model: Type[BaseModel], ts: datetime.datetime, rows: List[Dict]):
+    """
+    Fold one snapshot into a rollup table.
+
+    Each key's bucket row is inserted, or overwritten when this snapshot is at
+    least as recent as the one it holds, so snapshots arriving slightly out of
+    order within a bucket never roll its last value back. Costs one lookup of
+    the previous buckets and one upsert per 500 keys.
+
+    Args:
+        model (Type[BaseModel]): The rollup table.
+        ts (datetime.datetime): Time of the snapshot.
+        rows (List[Dict]): The snapshot's values, keyed by `model.key` and
+            `model.metrics`. Later rows for the same key win.
+    """
+    bucket = GRAINS[model.grain](ts)
+    latest = {r[model.key]: r for r in rows if r.get(model.key) is not None}
+    if not latest:
+        return
+
+    prev = previous(model, list(latest), bucket)
+
+    out = []
+    for k, r in latest.items():
+        row = {"bucket": bucket, model.key: k, "last_at": ts}
+        before = prev.get(k)
+        for i, m in enumerate(model.metrics):
+            value = r.get(m)
+            old = before[i] if before is not None else None
+            delta = value - old if value is not None and old is not None else None
+            row[m] = value
+            row[f"{m}_delta"] = delta
+            row[f"{m}_growth"] = delta / old if delta is not None and old else None
+        out.append(row)
+
+    fields = [f for f in model._meta.sorted_fields if f is not model._meta.primary_key]
+    preserve = [f for f in fields if f.name not in ("bucket", model.key)]
+    for chunk in p.chunked(out, 500):
+        model.insert_many(chunk).on_conflict(
+            conflict_target=[getattr(model, model.key), model.bucket],
+            preserve=preserve,
+            where=(model.last_at <= p.EXCLUDED.last_at),
+        ).execute()
+
+
+def videos(ts: datetime.datetime, rows: List[Dict]):
+    """
+    Fold a chunk of video snapshots (`video_id`, `view_count`,
+    `comment_count`) into the hourly and daily video rollups.
+    """
+    for model in VIDEO_ROLLUPS:
+        with metrics.timed(f"rollup {model._meta.table_name}", rows=len(rows)):
+            update(model, ts, rows)
+
+
+def channel(ts: datetime.datetime, row: Dict):
+    """
+    Fold a channel snapshot into the hourly and daily channel rollups.
+    """
+    for model in CHANNEL_ROLLUPS:
+        with metrics.timed(f"rollup {model._meta.table_name}", rows=1):
+            update(model, ts, [row])
+
+
+def backfill(source: Type[p.Model], fold: Callable, chunk_size: int = 10_000):
+    """
+    Replay raw rows of `source` through `fold`, oldest first.
+
+    Only needed once, to build rollups for history recorded before they
+    existed; afterwards `timeseries.create` keeps them current.
+    """
+    fields = [f.name for f in source._meta.sorted_fields if f.name != "id"]
+    query = source.select().order_by(source.timestamp).dicts().iterator()
+    count = 0
+    while True:
+        chunk = list(itertools.islice(query, chunk_size))
+        if not chunk:
+            break
+        for ts, group in itertools.groupby(chunk, key=lambda r: r["timestamp"]):
+            fold(ts, [{k: r[k] for k in fields} for r in group])
+        count += len(chunk)
+        logging.info(f"{source._meta.table_name}: {count} rows rolled up")
+
+
+def rebuild():
+    """
+    Recompute every rollup from the raw VideoStats and ChannelStats history.
+    """
+    from yt_schema.timeseries import ChannelStats, VideoStats
+
+    with db.atomic():
+        for model in tables:
+            model.delete().execute()
+        backfill(VideoStats, videos)
+        backfill(ChannelStats, lambda ts, rows: [channel(ts, r) for r in rows])
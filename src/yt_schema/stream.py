@@ -0,0 +1,260 @@
+import json
+import re
+from typing import Dict, Iterator, TextIO
+
+from yt_schema import metrics
+
+# Characters that change nesting depth or start a string while skipping.
+SPECIAL = re.compile(r'["\[\]{}]')
+STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER = "0123456789+-.eE"
+
+decoder = json.JSONDecoder()
+
+
+class Reader:
+    """
+    Incremental JSON tokenizer over a text file.
+
+    Only the part of the document currently being decoded is held in memory.
+    Objects and arrays can be walked member by member with `members` and
+    `items`, while any other value is decoded whole with `value` or passed
+    over without building it with `skip`.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        # Characters read from the file so far
+        self.read = 0
+
+    def fill(self) -> bool:
+        """
+        Read more of the file, dropping everything before the current position.
+
+        The read size doubles with the pending buffer so that decoding a large
+        value stays linear.
+        """
+        if self.eof:
+            return False
+
+        pending = len(self.buf) - self.pos
+        chunk = self.f.read(max(self.chunk_size, pending))
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.read += len(chunk)
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character, or "" at end of file.
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, ch: str):
+        found = self.peek()
+        if found != ch:
+            raise ValueError(f"expected {ch!r} but found {found!r} at {self.pos}")
+        self.pos += 1
+
+    def value(self) -> object:
+        """
+        Decode the next value completely.
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(self.buf, self.pos)
+                # A number cut off by the end of the buffer still decodes
+                # (e.g. "0." as 0), so only trust a value once the character
+                # after it could not have continued it.
+                if self.eof or (end < len(self.buf) and self.buf[end] not in NUMBER):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def string(self) -> str:
+        if self.peek() != '"':
+            raise ValueError(f"expected a string at {self.pos}")
+        return self.value()
+
+    def skip(self):
+        """
+        Move past the next value without decoding it.
+        """
+        if self.peek() not in "[{":
+            self.value()
+            return
+
+        depth = 0
+        while True:
+            match = SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise ValueError("unexpected end of JSON document")
+                continue
+
+            self.pos = match.start()
+            ch = match.group()
+            if ch == '"':
+                string = STRING.match(self.buf, self.pos)
+                if string is None:
+                    if not self.fill():
+                        raise ValueError("unterminated string in JSON document")
+                    continue
+                self.pos = string.end()
+                continue
+
+            self.pos += 1
+            depth += 1 if ch in "[{" else -1
+            if depth == 0:
+                return
+
+    def members(self) -> Iterator[str]:
+        """
+        Walk an object, yielding each key with the reader positioned on its value.
+
+        The caller must consume the value (`value`, `skip`, `items`, ...) before
+        asking for the next key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.string()
+            self.expect(":")
+            yield key
+
+            ch = self.peek()
+            self.pos += 1
+            if ch == "}":
+                return
+            if ch != ",":
+                raise ValueError(f"expected ',' or '}}' but found {ch!r}")
+
+    def items(self) -> Iterator[None]:
+        """
+        Walk an array, yielding once per element with the reader positioned on it.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield
+
+            ch = self.peek()
+            self.pos += 1
+            if ch == "]":
+                return
+            if ch != ",":
+                raise ValueError(f"expected ',' or ']' but found {ch!r}")
+
+
+def entries(reader: Reader) -> Iterator[Dict]:
+    """
+    Yield the videos of an `entries` array one at a time.
+
+    Items that carry their own `entries` (playlist tabs such as Videos, Shorts
+    or Live) are descended into, so only videos are ever yielded.
+    """
+    for _ in reader.items():
+        if reader.peek() != "{":
+            reader.skip()
+            continue
+
+        entry: Dict = {}
+        tab = False
+        for key in reader.members():
+            if key == "entries" and reader.peek() == "[":
+                tab = True
+                yield from entries(reader)
+            else:
+                entry[key] = reader.value()
+
+        if not tab:
+            yield entry
+
+
+class Entries:
+    """
+    Re-iterable view over the videos of a channel dump.
+
+    Every iteration re-opens the file and streams it, so peak memory is bounded
+    by the largest single video rather than the whole document.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[Dict]:
+        return metrics.iterate("json entries", self.stream())
+
+    def stream(self) -> Iterator[Dict]:
+        with open(self.path, "r") as f:
+            reader = Reader(f)
+            try:
+                for key in reader.members():
+                    if key == "entries" and reader.peek() == "[":
+                        yield from entries(reader)
+                    else:
+                        reader.skip()
+            finally:
+                metrics.current().get("json entries").bytes += reader.read
+
+    def __repr__(self) -> str:
+        return f"Entries({self.path!r})"
+
+
+def header(path: str) -> Dict[str, object]:
+    """
+    Read the channel-level keys of a dump, skipping over `entries`.
+    """
+    data: Dict[str, object] = {}
+    with metrics.timed("json header") as stage, open(path, "r") as f:
+        reader = Reader(f)
+        for key in reader.members():
+            if key == "entries":
+                reader.skip()
+            else:
+                data[key] = reader.value()
+        stage.bytes += reader.read
+    return data
+
+
+def load(path: str) -> Dict[str, object]:
+    """
+    Open a yt-dlp channel dump for streaming.
+
+    The channel-level header is decoded up front. Its `entries` key is replaced
+    with an `Entries` iterable that streams videos from the file on demand.
+
+    Args:
+        path (str): Path to the `*.pretty.json` file.
+
+    Returns:
+        Dict[str, object]: The channel header, with `entries` streamed lazily.
+    """
+    data = header(path)
+    data["entries"] = Entries(path)
+    return data
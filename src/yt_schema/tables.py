@@ -1,30 +1,24 @@
-import atexit
-import datetime
+import itertools
 import logging
-import pytz
 import peewee as p
-from typing import Dict, List, Optional
-
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
 )
 
-db: p.PostgresqlDatabase = p.PostgresqlDatabase(
-    "youtube",  # Required by Peewee.
-    user="admin",  # Will be passed directly to psycopg2.
-    password="admin",  # Ditto.
-    host="localhost",
-    port="5555",
-)  # Ditto.
-db.connect()
-
-
-def close_db():
-    logging.info("close_db")
-    db.close()
-
-
-atexit.register(close_db)
+from yt_schema import dictionary, heatmap, metrics, timestamps
+from yt_schema.mapping import JSONField, Mapping
+from yt_schema.database import db, is_postgres
+from yt_schema.dictionary import HttpHeader, HttpHeaderSet, Symbol
+from yt_schema.timestamps import TimestampField
 
 
 class BaseModel(p.Model):
@@ -32,34 +26,6 @@ class BaseModel(p.Model):
         database = db
 
 
-class HttpHeader(BaseModel):
-    key = p.TextField(null=True)
-    value = p.TextField(null=True)
-
-
-class RequestedDownload(BaseModel):
-    write_download_archive = p.BooleanField(null=True)
-    filename = p.TextField(null=True)
-    abr = p.DoubleField(null=True)
-    acodec = p.TextField(null=True)
-    aspect_ratio = p.DoubleField(null=True)
-    audio_ext = p.TextField(null=True)
-    columns = p.IntegerField(null=True)
-    ext = p.TextField(null=True)
-    filesize_approx = p.IntegerField(null=True)
-    format = p.TextField(null=True)
-    format_id = p.TextField(unique=True)
-    format_note = p.TextField(null=True)
-    fps = p.DoubleField(null=True)
-    height = p.IntegerField(null=True)
-    protocol = p.TextField(null=True)
-    resolution = p.TextField(null=True)
-    tbr = p.DoubleField(null=True)
-    vbr = p.DoubleField(null=True)
-    vcodec = p.TextField(null=True)
-    width = p.IntegerField(null=True)
-
-
 class Payload(BaseModel):
     type_of = p.TextField(null=True)
     availability = p.BooleanField(null=True)
@@ -68,11 +34,11 @@ class Payload(BaseModel):
     channel_id = p.TextField(unique=True)
     channel_url = p.TextField(null=True)
     description = p.TextField(null=True)
-    epoch = p.DateTimeField(null=True)
+    epoch = TimestampField(null=True)
     extractor = p.TextField(null=True)
     extractor_key = p.TextField(null=True)
     payload_id = p.TextField(unique=True)
-    modified_date = p.DateTimeField(null=True)
+    modified_date = TimestampField(null=True)
     original_url = p.TextField(null=True)
     playlist_count = p.IntegerField(null=True)
     release_year = p.IntegerField(null=True)
@@ -84,6 +50,8 @@ class Payload(BaseModel):
     webpage_url = p.TextField(null=True)
     webpage_url_basename = p.TextField(null=True)
     webpage_url_host = p.TextField(null=True)
+    # Keys of the channel no column holds
+    extra = JSONField(null=True)
 
 
 class Entry(BaseModel):
@@ -107,7 +75,7 @@ class Entry(BaseModel):
     duration = p.IntegerField(null=True)
     duration_string = p.TextField(null=True)
     dynamic_range = p.TextField(null=True)
-    epoch = p.DateTimeField(null=True)
+    epoch = TimestampField(null=True)
     ext = p.TextField(null=True)
     extractor = p.TextField(null=True)
     extractor_key = p.TextField(null=True)
@@ -118,7 +86,7 @@ class Entry(BaseModel):
     fps = p.IntegerField(null=True)
     fulltitle = p.TextField(null=True)
     height = p.IntegerField(null=True)
-    entry_id = p.TextField(null=True)
+    entry_id = p.TextField(null=True, unique=True)
     is_live = p.BooleanField(null=True)
     language = p.TextField(null=True)
     like_count = p.IntegerField(null=True)
@@ -135,14 +103,14 @@ class Entry(BaseModel):
     playlist_uploader = p.TextField(null=True)
     playlist_uploader_id = p.TextField(null=True)
     protocol = p.TextField(null=True)
-    release_timestamp = p.DateTimeField(null=True)
+    release_timestamp = TimestampField(null=True)
     release_year = p.IntegerField(null=True)
     resolution = p.TextField(null=True)
     stretched_ratio = p.DoubleField(null=True)
     tbr = p.DoubleField(null=True)
     thumbnail = p.TextField(null=True)
     title = p.TextField(null=True)
-    uploader_date = p.DateTimeField(null=True)
+    uploader_date = TimestampField(null=True)
     uploader_id = p.TextField(null=True)
     uploader_url = p.TextField(null=True)
     vbr = p.DoubleField(null=True)
@@ -152,30 +120,61 @@ class Entry(BaseModel):
     webpage_url_basename = p.TextField(null=True)
     webpage_url_domain = p.TextField(null=True)
     width = p.IntegerField(null=True)
+    # Keys of the video no column or child table holds
+    extra = JSONField(null=True)
 
 
-class Format(BaseModel):
+class RequestedDownload(BaseModel):
+    video_id = p.ForeignKeyField(Entry)
+    write_download_archive = p.BooleanField(null=True)
+    filename = p.TextField(null=True)
     abr = p.DoubleField(null=True)
     acodec = p.TextField(null=True)
     aspect_ratio = p.DoubleField(null=True)
     audio_ext = p.TextField(null=True)
     columns = p.IntegerField(null=True)
     ext = p.TextField(null=True)
-    filesize_approx = p.BigIntegerField(null=True)
+    filesize_approx = p.IntegerField(null=True)
     format = p.TextField(null=True)
-    format_id = p.TextField(null=True)
+    format_id = p.TextField()
     format_note = p.TextField(null=True)
     fps = p.DoubleField(null=True)
     height = p.IntegerField(null=True)
     protocol = p.TextField(null=True)
     resolution = p.TextField(null=True)
     tbr = p.DoubleField(null=True)
+    vbr = p.DoubleField(null=True)
+    vcodec = p.TextField(null=True)
+    width = p.IntegerField(null=True)
+
+    class Meta:
+        indexes = ((("video_id", "format_id"), True),)
+
+
+class Format(BaseModel):
+    # Repeated strings are dictionary-encoded, see `dictionary.FORMAT_KEYS`
+    abr = p.DoubleField(null=True)
+    acodec = p.ForeignKeyField(Symbol, null=True, backref="+")
+    aspect_ratio = p.DoubleField(null=True)
+    audio_ext = p.ForeignKeyField(Symbol, null=True, backref="+")
+    columns = p.IntegerField(null=True)
+    ext = p.ForeignKeyField(Symbol, null=True, backref="+")
+    filesize_approx = p.BigIntegerField(null=True)
+    format = p.TextField(null=True)
+    format_id = p.TextField(null=True)
+    format_note = p.ForeignKeyField(Symbol, null=True, backref="+")
+    fps = p.DoubleField(null=True)
+    height = p.IntegerField(null=True)
+    protocol = p.ForeignKeyField(Symbol, null=True, backref="+")
+    resolution = p.TextField(null=True)
+    tbr = p.DoubleField(null=True)
     url = p.TextField(null=True)
     vbr = p.IntegerField(null=True)
-    vcodec = p.TextField(null=True)
-    video_ext = p.TextField(null=True)
+    vcodec = p.ForeignKeyField(Symbol, null=True, backref="+")
+    video_ext = p.ForeignKeyField(Symbol, null=True, backref="+")
     width = p.IntegerField(null=True)
     video_id = p.ForeignKeyField(Entry)
+    http_headers = p.ForeignKeyField(HttpHeaderSet, null=True, backref="+")
 
 
 class VideoThumbnail(BaseModel):
@@ -187,7 +186,10 @@ class VideoThumbnail(BaseModel):
 
 class FormatSortField(BaseModel):
     video_id = p.ForeignKeyField(Entry)
-    field = p.TextField(unique=True)
+    field = p.TextField()
+
+    class Meta:
+        indexes = ((("video_id", "field"), True),)
 
 
 class SubtitleType(BaseModel):
@@ -249,10 +251,12 @@ class Fragment(BaseModel):
 
 
 class Heatmap(BaseModel):
-    video_id = p.ForeignKeyField(Entry)
-    end_time = p.DoubleField(null=True)
-    start_time = p.DoubleField(null=True)
-    value = p.DoubleField(null=True)
+    # One row per video: `values` are packed floats over a shared HeatmapGrid
+    # scaled by `duration`, see `heatmap.decode`
+    video_id = p.ForeignKeyField(Entry, unique=True)
+    grid = p.ForeignKeyField(heatmap.HeatmapGrid, column_name="grid", index=False)
+    duration = p.DoubleField()
+    values = p.BlobField()
 
 
 class VideoTag(BaseModel):
@@ -273,483 +277,505 @@ class Version(BaseModel):
     version = p.TextField(null=True)
 
 
-def init():
-    setup: p.PostgresqlDatabase = p.PostgresqlDatabase(
-        "youtube",  # Required by Peewee.
-        user="admin",  # Will be passed directly to psycopg2.
-        password="admin",  # Ditto.
-        host="localhost",
-        port="5555",
-    )  # Ditto.
-    setup.connect()
-    tables = [
-        Version,
-        FormatSortField,
-        Caption,
-        AutomaticCaptions,
-        ChannelCategory,
-        VideoCategory,
-        Chapter,
-        Fragment,
-        HttpHeader,
-        Format,
-        ChannelTag,
-        VideoTag,
-        Heatmap,
-        RequestedDownload,
-        Subtitle,
-        SubtitleType,
-        VideoThumbnail,
-        Entry,
-        ChannelThumbnail,
-        Payload,
-    ]
+# Every relational table, in an order safe to drop.
+TABLES = [
+    Version,
+    FormatSortField,
+    Caption,
+    AutomaticCaptions,
+    ChannelCategory,
+    VideoCategory,
+    Chapter,
+    Fragment,
+    Format,
+    HttpHeader,
+    HttpHeaderSet,
+    Symbol,
+    ChannelTag,
+    VideoTag,
+    Heatmap,
+    RequestedDownload,
+    Subtitle,
+    SubtitleType,
+    VideoThumbnail,
+    Entry,
+    ChannelThumbnail,
+    Payload,
+]
+
+
+# Row extractors: where each column's value comes from in yt-dlp's output.
+# Columns not listed under `keys` are read from the key of the same name.
+# Any other key lands in `extra`, except those written to child tables.
+
+# Channel keys written to child tables.
+PAYLOAD_CHILDREN: List[str] = ["entries", "thumbnails", "tags", "_version"]
+
+# Video keys written to child tables.
+ENTRY_CHILDREN: List[str] = [
+    "formats",
+    "heatmap",
+    "requested_downloads",
+    "requested_formats",
+    "subtitles",
+    "thumbnails",
+    "tags",
+    "format_sort_field",
+    "automatic_captions",
+    "categories",
+    "chapters",
+]
+
+PAYLOAD = Mapping(
+    Payload,
+    keys={
+        "type_of": "_type",
+        "payload_id": "id",
+        "webpage_url_host": "webpage_url_domain",
+    },
+    convert={"epoch": timestamps.epoch, "modified_date": timestamps.date},
+    overflow="extra",
+    ignore=PAYLOAD_CHILDREN,
+)
+ENTRY = Mapping(
+    Entry,
+    keys={
+        "last_playlist_index": "__last_playlist_index",
+        "entry_id": "id",
+        "uploader_date": "upload_date",
+    },
+    convert={
+        "epoch": timestamps.epoch,
+        "release_timestamp": timestamps.epoch,
+        "uploader_date": timestamps.date,
+    },
+    overflow="extra",
+    ignore=ENTRY_CHILDREN,
+)
+FORMAT = Mapping(Format, context=["video_id"])
+FRAGMENT = Mapping(Fragment, context=["video_id"])
+REQUESTED_DOWNLOAD = Mapping(RequestedDownload, context=["video_id"])
+SUBTITLE = Mapping(Subtitle, context=["video_id", "subtitle_type"])
+CAPTION = Mapping(Caption, context=["auto_cap"])
+CHAPTER = Mapping(Chapter, context=["video_id"])
+VIDEO_THUMBNAIL = Mapping(
+    VideoThumbnail, keys={"thumbnail_id": "id"}, context=["video_id"]
+)
+CHANNEL_THUMBNAIL = Mapping(
+    ChannelThumbnail, keys={"thumbnail_id": "id"}, context=["channel_id"]
+)
+VERSION = Mapping(Version, context=["channel_id"])
 
-    setup.drop_tables(tables, safe=True)
-    setup.create_tables(tables)
-    setup.close()
 
+def init(reset: bool = False):
+    """
+    Create any missing tables. With `reset`, drop and recreate all of them.
+    """
 
-def version(channel: Payload, data: Dict):
-    logging.debug("version")
-    Version.create(
-        channel_id=channel,
-        current_git_head=data.get("current_git_head"),
-        release_git_head=data.get("release_git_head"),
-        repository=data.get("repository"),
-        version=data.get("version"),
-    )
+    if reset:
+        db.drop_tables(TABLES, safe=True)
+    # Grids are content-addressed and shared with the time series, so kept
+    heatmap.init()
+    db.create_tables(TABLES)
+    timestamps.upgrade(TABLES)
 
 
-def fragments(video: Entry, data: List[Dict]):
+def version(channel: Payload, data: Dict):
     # If none
     if data is None:
         return
 
-    logging.debug(f"{len(data)} fragments")
+    logging.debug("version")
+    Version.create(**VERSION.dict(data, channel))
+
 
-    Fragment.insert_many(
-        [(video.get_id(), d.get("duration"), d.get("url")) for d in data]
-    ).execute()
+# Videos whose Entry rows are inserted together; their child rows are then
+# written a few statements per table.
+ENTRY_BATCH: int = 1000
 
 
-def http_headers(video: Entry, data: Dict):
+def insert_rows(
+    model: Type[BaseModel],
+    rows: List[Union[Tuple, Dict]],
+    returning: Optional[List[p.Field]] = None,
+) -> List[Tuple]:
+    """
+    Multi-row INSERT of `rows`, split to stay below bound variable limits.
+
+    Args:
+        model (Type[BaseModel]): The table to write.
+        rows (List[Union[Tuple, Dict]]): Tuples in column order without the id,
+            or dicts keyed by field name.
+        returning (Optional[List[p.Field]]): Columns to return per inserted row.
+
+    Returns:
+        List[Tuple]: The returned columns, if any.
+    """
+    if not rows:
+        return []
+
+    columns = len(model._meta.sorted_fields)
+    out: List[Tuple] = []
+    with metrics.timed(f"insert {model._meta.table_name}", rows=len(rows)):
+        for chunk in p.chunked(rows, max(1, 32000 // columns)):
+            query = model.insert_many(chunk)
+            if returning:
+                out.extend(query.returning(*returning).tuples().execute())
+            else:
+                query.execute()
+    return out
+
+
+class Batch:
+    """
+    Child rows of a batch of videos, buffered per table until `insert`.
+
+    Subtitle and Caption rows hang off SubtitleType and AutomaticCaptions rows
+    whose ids only exist once those are inserted, so they wait as groups of
+    (video id, language, yt-dlp items).
+    """
+
+    def __init__(self):
+        self.rows: Dict[Type[BaseModel], List[Tuple]] = {}
+        self.subtitle_types: List[Tuple[int, str, List[Dict]]] = []
+        self.automatic_captions: List[Tuple[int, str, List[Dict]]] = []
+
+    def add(self, model: Type[BaseModel], rows: Iterable[Tuple]):
+        self.rows.setdefault(model, []).extend(rows)
+
+    def insert(self):
+        types = insert_rows(
+            SubtitleType,
+            [(video_id, language) for video_id, language, _ in self.subtitle_types],
+            [SubtitleType.id, SubtitleType.video_id, SubtitleType.language],
+        )
+        type_ids = {(v, language): i for i, v, language in types}
+        for video_id, language, data in self.subtitle_types:
+            subtitles(self, video_id, type_ids[video_id, language], data)
+
+        caps = insert_rows(
+            AutomaticCaptions,
+            [(v, language) for v, language, _ in self.automatic_captions],
+            [
+                AutomaticCaptions.id,
+                AutomaticCaptions.video_id,
+                AutomaticCaptions.language,
+            ],
+        )
+        cap_ids = {(v, language): i for i, v, language in caps}
+        for video_id, language, data in self.automatic_captions:
+            caption(self, video_id, cap_ids[video_id, language], data)
+
+        for model, rows in self.rows.items():
+            logging.debug(f"{len(rows)} {model._meta.table_name}")
+            insert_rows(model, rows)
+
+
+def fragments(batch: Batch, video_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
-    logging.debug(f"{len(data)} http_headers")
+    logging.debug(f"{len(data)} fragments")
 
-    HttpHeader.insert_many(
-        [(video.get_id(), d, data.get(d)) for d in data.keys()]
-    ).execute()
+    batch.add(Fragment, [FRAGMENT.row(d, video_id) for d in data])
 
 
-def formats(video: Entry, data: List[Dict]):
+def formats(batch: Batch, video_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} formats")
+    data = dictionary.formats(data)
 
-    Format.insert_many(
-        [
-            (
-                d.get("abr"),
-                d.get("acodec"),
-                d.get("aspect_ratio"),
-                d.get("audio_ext"),
-                d.get("columns"),
-                d.get("ext"),
-                d.get("filesize_approx"),
-                d.get("format"),
-                d.get("format_id"),
-                d.get("format_note"),
-                d.get("fps"),
-                d.get("height"),
-                d.get("protocol"),
-                d.get("resolution"),
-                d.get("tbr"),
-                d.get("url"),
-                d.get("vbr"),
-                d.get("vcodec"),
-                d.get("video_ext"),
-                d.get("width"),
-                video.get_id(),
-            )
-            for d in data
-        ]
-    ).execute()
-
-    all_frags = []
-    all_http = []
-    for d in data:
-        for f in d.get("fragments", []):
-            tup = (video.get_id(), d.get("duration"), d.get("url"))
-            all_frags.append(tup)
+    batch.add(Format, [FORMAT.row(d, video_id) for d in data])
 
-        for h in d.get("http_headers", []).keys():
-            tup = (video.get_id(), h, d.get("http_headers").get(h))
-            all_http.append(tup)
+    # Each format's own fragments
+    all_frags = [
+        FRAGMENT.row(f, video_id) for d in data for f in d.get("fragments") or []
+    ]
 
     logging.debug(f"{len(all_frags)} fragments")
-    Fragment.insert_many(all_frags).execute()
+    batch.add(Fragment, all_frags)
 
-    logging.debug(f"{len(all_http)} http_headers")
-    HttpHeader.insert_many(all_http).execute()
 
-
-def heatmaps(video: Entry, data: List[Dict]):
+def heatmaps(batch: Batch, video_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} heatmaps")
 
-    Heatmap.insert_many(
-        [
-            (video.get_id(), d.get("end_time"), d.get("start_time"), d.get("value"))
-            for d in data
-        ]
-    ).execute()
+    encoded = heatmap.encode(data)
+    if encoded is not None:
+        batch.add(Heatmap, [(video_id, *encoded)])
 
 
-def requested_download(video: Entry, data: List[Dict]):
+def requested_download(batch: Batch, video_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
-    logging.info(f"{len(data)} requested_download")
+    logging.debug(f"{len(data)} requested_download")
 
-    for d in data:
-        RequestedDownload.create(
-            write_download_archive=d.get("write_download_archive"),
-            filename=d.get("filename"),
-            abr=d.get("abr"),
-            acodec=d.get("acodec"),
-            aspect_ratio=d.get("aspect_ratio"),
-            audio_ext=d.get("audio_ext"),
-            columns=d.get("columns"),
-            ext=d.get("ext"),
-            filesize_approx=d.get("filesize_approx"),
-            format=d.get("format"),
-            format_id=d.get("format_id"),
-            format_note=d.get("format_note"),
-            fps=d.get("fps"),
-            height=d.get("height"),
-            protocol=d.get("protocol"),
-            resolution=d.get("resolution"),
-            tbr=d.get("tbr"),
-            vbr=d.get("vbr"),
-            vcodec=d.get("vcodec"),
-            width=d.get("width"),
-        )
+    batch.add(RequestedDownload, [REQUESTED_DOWNLOAD.row(d, video_id) for d in data])
 
-        # Requested Formats
-        formats(video, d.get("requested_formats"))
-
-    RequestedDownload.insert_many(
-        [
-            (
-                d.get("write_download_archive"),
-                d.get("filename"),
-                d.get("abr"),
-                d.get("acodec"),
-                d.get("aspect_ratio"),
-                d.get("audio_ext"),
-                d.get("columns"),
-                d.get("ext"),
-                d.get("filesize_approx"),
-                d.get("format"),
-                d.get("format_id"),
-                d.get("format_note"),
-                d.get("fps"),
-                d.get("height"),
-                d.get("protocol"),
-                d.get("resolution"),
-                d.get("tbr"),
-                d.get("vbr"),
-                d.get("vcodec"),
-                d.get("width"),
-            )
-            for d in data
-        ]
-    ).execute()
-
-    all_forms = []
     for f in data:
-        for d in f.get("requested_formats", []):
-            tup = (
-                d.get("abr"),
-                d.get("acodec"),
-                d.get("aspect_ratio"),
-                d.get("audio_ext"),
-                d.get("columns"),
-                d.get("ext"),
-                d.get("filesize_approx"),
-                d.get("format"),
-                d.get("format_id"),
-                d.get("format_note"),
-                d.get("fps"),
-                d.get("height"),
-                d.get("protocol"),
-                d.get("resolution"),
-                d.get("tbr"),
-                d.get("url"),
-                d.get("vbr"),
-                d.get("vcodec"),
-                d.get("video_ext"),
-                d.get("width"),
-                video.get_id(),
-            )
-            all_forms.append(tup)
-
-    logging.debug(f"{len(all_forms)} requested_formats")
-    Format.insert_many(all_forms).execute()
-
-
-def subtitles(video: Entry, s: SubtitleType, data: List[Dict]):
+        # Requested Formats
+        formats(batch, video_id, f.get("requested_formats", []))
+
+
+def subtitles(batch: Batch, video_id: int, type_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} subtitles")
 
-    Subtitle.insert_many(
-        [
-            (
-                video.get_id(),
-                s.get_id(),
-                d.get("ext"),
-                d.get("name"),
-                d.get("url"),
-            )
-            for d in data
-        ]
-    ).execute()
-
-
-def subtitle_type(video: Entry, data: Dict):
+    batch.add(Subtitle, [SUBTITLE.row(d, video_id, type_id) for d in data])
+
+
+def subtitle_type(batch: Batch, video_id: int, data: Dict):
     # If none
     if data is None:
-        return []
+        return
 
     logging.debug(f"{len(data)} subtitles")
     for sub in data.keys():
-        s = SubtitleType.create(
-            video_id=video,
-            language=sub,
-        )
-
-        # Subtitles
-        subtitles(video, s, data.get(sub))
+        # Subtitles are added once the SubtitleType ids are known
+        batch.subtitle_types.append((video_id, sub, data.get(sub)))
 
 
-def format_sort_field(video: Entry, data: List[str]):
+def format_sort_field(batch: Batch, video_id: int, data: List[str]):
     # If none
     if data is None:
         return
 
-    logging.info(f"{len(data)} format_sort_field")
-    FormatSortField.insert_many([(video.get_id(), d) for d in data]).execute()
+    logging.debug(f"{len(data)} format_sort_field")
+    batch.add(FormatSortField, [(video_id, d) for d in data])
 
 
-def caption(video: Entry, auto_captions: AutomaticCaptions, data: Dict):
+def caption(batch: Batch, video_id: int, auto_cap_id: int, data: Dict):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} captions")
-    Caption.insert_many(
-        [
-            (
-                video.get_id(),
-                auto_captions,
-                d.get("ext"),
-                d.get("protocol"),
-                d.get("url"),
-            )
-            for d in data
-        ]
-    ).execute()
-
-
-def automatic_captions(video: Entry, data: Dict):
+    batch.add(Caption, [CAPTION.row(d, auto_cap_id) for d in data])
+
+
+def automatic_captions(batch: Batch, video_id: int, data: Dict):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} automatic_captions")
     for d in data.keys():
-        ac = AutomaticCaptions.create(video_id=video, language=d)
+        # Captions are added once the AutomaticCaptions ids are known
+        batch.automatic_captions.append((video_id, d, data.get(d)))
 
-        # Captions
-        caption(video, ac, data.get(d))
 
-
-def video_categories(video: Entry, data: List[str]):
+def video_categories(batch: Batch, video_id: int, data: List[str]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} video categories")
-    VideoCategory.insert_many([(video.get_id(), d) for d in data]).execute()
+    batch.add(VideoCategory, [(video_id, d) for d in data])
 
 
-def chapters(video: Entry, data: List[Dict]):
+def chapters(batch: Batch, video_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} chapters")
-    Chapter.insert_many(
-        [
-            (
-                video.get_id(),
-                d.get("start_time"),
-                d.get("end_time"),
-                d.get("title"),
-            )
-            for d in data
-        ]
-    ).execute()
-
-    all_frags = []
-    for d in data:
-        for f in d.get("fragments", []):
-            tup = (video.get_id(), d.get("duration"), d.get("url"))
-            all_frags.append(tup)
+    batch.add(Chapter, [CHAPTER.row(d, video_id) for d in data])
+
+    all_frags = [
+        FRAGMENT.row(f, video_id) for d in data for f in d.get("fragments") or []
+    ]
 
     logging.debug(f"{len(all_frags)} fragments")
-    Fragment.insert_many(all_frags).execute()
-
-
-def entries(data: List[Dict]):
-    logging.debug(f"{len(data)} entries")
-    length = len(data)
-
-    for i, d in enumerate(data):
-        if "entries" in d:
-            entries(d.get("entries"))
-            continue
-
-        # Video
-        logging.info(f"[{i}/{length}] - Video: {d.get('title')}")
-        local_time = local(d.get("epoch"))
-        local_ts = local(d.get("release_timestamp"))
-
-        e = Entry.create(
-            last_playlist_index=d.get("__last_playlist_index"),
-            has_drm=d.get("has_drm"),
-            abr=d.get("abr"),
-            acodec=d.get("acodec"),
-            age_limit=d.get("age_limit"),
-            aspect_ratio=d.get("aspect_ratio"),
-            asr=d.get("asr"),
-            audio_channels=d.get("audio_channels"),
-            availability=d.get("availability"),
-            average_rating=d.get("average_rating"),
-            channel=d.get("channel"),
-            channel_follower_count=d.get("channel_follower_count"),
-            channel_id=d.get("channel_id"),
-            channel_url=d.get("channel_url"),
-            chapters=d.get("chapters"),
-            comment_count=d.get("comment_count"),
-            description=d.get("description"),
-            display_id=d.get("display_id"),
-            duration=d.get("duration"),
-            duration_string=d.get("duration_string"),
-            dynamic_range=d.get("dynamic_range"),
-            epoch=local_time,
-            ext=d.get("ext"),
-            extractor=d.get("extractor"),
-            extractor_key=d.get("extractor_key"),
-            filesize=d.get("filesize"),
-            fps=d.get("fps"),
-            fulltitle=d.get("fulltitle"),
-            entry_id=d.get("id"),
-            is_live=d.get("is_live"),
-            language=d.get("language"),
-            like_count=d.get("like_count"),
-            live_status=d.get("live_status"),
-            n_entries=d.get("n_entries"),
-            original_url=d.get("original_url"),
-            playable_in_embed=d.get("playable_in_embed"),
-            playlist=d.get("playlist"),
-            playlist_auto_number=d.get("playlist_auto_number"),
-            playlist_count=d.get("playlist_count"),
-            playlist_id=d.get("playlist_id"),
-            playlist_index=d.get("playlist_index"),
-            playlist_title=d.get("playlist_title"),
-            playlist_uploader=d.get("playlist_uploader"),
-            playlist_uploader_id=d.get("playlist_uploader_id"),
-            protocol=d.get("protocol"),
-            release_timestamp=local_ts,
-            release_year=d.get("release_year"),
-            requested_subtitles=d.get("requested_subtitles"),
-            resolution=d.get("resolution"),
-            stretched_ratio=d.get("stretched_ratio"),
-            tbr=d.get("tbr"),
-            thumbnail=d.get("thumbnail"),
-            title=d.get("title"),
-            uploader_date=d.get("uploader_date"),
-            uploader_id=d.get("uploader_id"),
-            uploader_url=d.get("uploader_url"),
-            vbr=d.get("vbr"),
-            vcoded=d.get("vcodec"),
-            view_count=d.get("view_count"),
-            was_live=d.get("was_live"),
-            webpage_url=d.get("webpage_url"),
-            webpage_url_basename=d.get("webpage_url_basename"),
-            webpage_url_domain=d.get("webpage_url_domain"),
-            width=d.get("width"),
-        )
+    batch.add(Fragment, all_frags)
 
-        # Format
-        formats(e, d.get("formats"))
 
-        # Heatmaps
-        heatmaps(e, d.get("heatmap"))
+def entry(d: Dict) -> Dict:
+    """
+    Map a yt-dlp video to Entry column values.
+    """
+    return ENTRY.dict(d)
 
-        # Requested Downloads
-        requested_download(e, d.get("requested_download"))
 
-        # Requested Formats
-        formats(e, d.get("requested_formats"))
+def upsert_row(model: Type[BaseModel], row: Dict, key: p.Field) -> BaseModel:
+    """
+    INSERT ... ON CONFLICT (key) DO UPDATE every other given column.
+
+    Args:
+        model (Type[BaseModel]): The model to write.
+        row (Dict): Column values by field name.
+        key (p.Field): A uniquely indexed field identifying the row.
+
+    Returns:
+        BaseModel: An instance carrying the id of the inserted or updated row.
+    """
+    update = [model._meta.fields[name] for name in row if name != key.name]
+    query = (
+        model.insert(**row)
+        .on_conflict(conflict_target=[key], preserve=update)
+        .returning(model._meta.primary_key)
+    )
+    return next(iter(query.execute()))
+
+
+def videos(data: Optional[Iterable[Dict]]) -> Iterator[Dict]:
+    """
+    Yield every video of an `entries` list, descending into playlist tabs.
+
+    A video listed by several tabs is yielded once, the first time it is
+    seen, so each `entry_id` gets a single row and set of child rows.
+    """
+    seen: Set[str] = set()
+
+    def walk(data: Optional[Iterable[Dict]]) -> Iterator[Dict]:
+        if data is None:
+            return
+        for d in data:
+            if "entries" in d:
+                yield from walk(d.get("entries"))
+                continue
+            video_id = d.get("id")
+            if video_id is not None:
+                if video_id in seen:
+                    continue
+                seen.add(video_id)
+            yield d
+
+    return walk(data)
+
+
+def insert_entries(data: List[Dict], upsert: bool = False) -> List[int]:
+    """
+    Phase one: insert the Entry rows of a batch and resolve their ids.
+
+    Rows are written with multi-row INSERT ... RETURNING, and returned ids are
+    matched back to videos through the unique `entry_id`.
+
+    Args:
+        data (List[Dict]): The batch's yt-dlp videos.
+        upsert (bool): Update existing rows with the same `entry_id` instead.
+
+    Returns:
+        List[int]: The database id of every video, in the order given.
+    """
+    rows = [entry(d) for d in data]
+    ids: Dict[str, int] = {}
+
+    # `videos` already dropped repeated videos
+    keyed = [r for r in rows if r["entry_id"] is not None]
+
+    returning = [Entry.id, Entry.entry_id]
+    for chunk in p.chunked(keyed, max(1, 32000 // len(Entry._meta.sorted_fields))):
+        query = Entry.insert_many(chunk)
+        if upsert:
+            update = [Entry._meta.fields[k] for k in chunk[0] if k != "entry_id"]
+            query = query.on_conflict(conflict_target=[Entry.entry_id], preserve=update)
+        ids.update((k, i) for i, k in query.returning(*returning).tuples().execute())
+
+    # Without an entry_id to match on, fall back to one row at a time
+    return [
+        ids[r["entry_id"]] if r["entry_id"] is not None else Entry.create(**r).get_id()
+        for r in rows
+    ]
+
+
+def entries(
+    data: Iterable[Dict],
+    checkpoint: Optional[Callable[[List[int]], None]] = None,
+    upsert: bool = False,
+    batch_size: int = ENTRY_BATCH,
+):
+    """
+    Load videos in two phases, `batch_size` videos at a time.
+
+    Phase one inserts the batch's Entry rows and resolves their ids
+    (`insert_entries`). Phase two builds the child rows of the whole batch and
+    writes them with a few multi-row INSERTs per table (`Batch`).
+
+    Args:
+        data (Iterable[Dict]): The `entries` of a channel, possibly streamed.
+        checkpoint (Optional[Callable[[List[int]], None]]): Called with the ids
+            of each batch once all of its rows are written.
+        upsert (bool): Update Entry rows in place and replace their children.
+        batch_size (int): Videos per batch.
+    """
+    # Entries may be streamed, so the total is not known up front
+    progress = metrics.Progress("videos")
+    stream = videos(data)
+    while True:
+        chunk = list(itertools.islice(stream, batch_size))
+        if not chunk:
+            break
+
+        with metrics.timed("insert entry", rows=len(chunk)):
+            ids = insert_entries(chunk, upsert)
+        if upsert:
+            # Replace these videos' child rows
+            with metrics.timed("purge videos", rows=len(ids)):
+                purge_videos(ids, entries=False)
+
+        batch = Batch()
+        with metrics.timed("build rows", rows=len(chunk)):
+            for video_id, d in zip(ids, chunk):
+                progress.update()
+
+                # Format
+                formats(batch, video_id, d.get("formats"))
+
+                # Heatmaps
+                heatmaps(batch, video_id, d.get("heatmap"))
+
+                # Requested Downloads
+                requested_download(batch, video_id, d.get("requested_downloads"))
 
-        # Subtitles
-        subtitle_type(e, d.get("subtitles"))
+                # Requested Formats
+                formats(batch, video_id, d.get("requested_formats"))
 
-        # Video Thumbnails
-        video_thumbnails(e, d.get("thumbnails"))
+                # Subtitles
+                subtitle_type(batch, video_id, d.get("subtitles"))
 
-        # Tags
-        video_tags(e, d.get("tags"))
+                # Video Thumbnails
+                video_thumbnails(batch, video_id, d.get("thumbnails"))
 
-        # Format Sort Field
-        format_sort_field(e, d.get("format_sort_field"))
+                # Tags
+                video_tags(batch, video_id, d.get("tags"))
 
-        # Automatic Captions
-        automatic_captions(e, d.get("automatic_captions"))
+                # Format Sort Field
+                format_sort_field(batch, video_id, d.get("format_sort_field"))
 
-        # Video Categories
-        video_categories(e, d.get("categories"))
+                # Automatic Captions
+                automatic_captions(batch, video_id, d.get("automatic_captions"))
 
-        # Chapters
-        chapters(e, d.get("chapters"))
+                # Video Categories
+                video_categories(batch, video_id, d.get("categories"))
 
-    logging.debug(entries)
-    return entries
+                # Chapters
+                chapters(batch, video_id, d.get("chapters"))
 
+        batch.insert()
 
-def video_tags(p: Entry, data: List[str]):
+        if checkpoint is not None:
+            checkpoint(ids)
+
+
+def video_tags(batch: Batch, video_id: int, data: List[str]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} video tags")
-    for d in data:
-        VideoTag.create(video_id=p, tag=d)
+    batch.add(VideoTag, [(video_id, d) for d in data])
 
 
 def channel_tags(p: Payload, data: List[str]):
@@ -762,20 +788,14 @@ def channel_tags(p: Payload, data: List[str]):
         ChannelTag.create(channel_id=p, tag=d)
 
 
-def video_thumbnails(v: Entry, data: List[Dict]):
+def video_thumbnails(batch: Batch, video_id: int, data: List[Dict]):
     # If none
     if data is None:
         return
 
     logging.debug(f"{len(data)} video thumbnails")
 
-    for d in data:
-        VideoThumbnail.create(
-            video_id=v,
-            thumbnail_id=d.get("thumbnail_id"),
-            preference=d.get("preference"),
-            url=d.get("url"),
-        )
+    batch.add(VideoThumbnail, [VIDEO_THUMBNAIL.row(d, video_id) for d in data])
 
 
 def channel_thumbnails(channel: Payload, data: List[Dict]):
@@ -784,77 +804,183 @@ def channel_thumbnails(channel: Payload, data: List[Dict]):
         return
 
     logging.debug(f"{len(data)} channel thumbnails")
-    for d in data:
-        ChannelThumbnail.create(
-            channel_id=channel,
-            thumbnail_id=d.get("thumbnail_id"),
-            preference=d.get("preference"),
-            resolution=d.get("resolution"),
-            url=d.get("url"),
-            width=d.get("width"),
-            height=d.get("height"),
-        )
+    insert_rows(
+        ChannelThumbnail, [CHANNEL_THUMBNAIL.row(d, channel.get_id()) for d in data]
+    )
 
 
-def local(epoch: Optional[int]) -> Optional[datetime.datetime]:
-    if epoch is None:
-        return None
+def channel(data: Dict, upsert: bool = False) -> Payload:
+    logging.info(f'Channel: {data.get("channel")}')
 
-    # Get the current timezone
-    local_tz = pytz.timezone("America/Los_Angeles")
+    row = PAYLOAD.dict(data)
 
-    # Convert the timestamp to the local timezone
-    epoch = datetime.datetime.fromtimestamp(epoch)
-    return epoch.replace(tzinfo=pytz.utc).astimezone(local_tz)
+    if not upsert:
+        return Payload.create(**row)
 
+    ch = upsert_row(Payload, row, Payload.channel_id)
+    # Replace this channel's child rows
+    for model in CHANNEL_TABLES:
+        model.delete().where(model.channel_id == ch.get_id()).execute()
+    return ch
 
-def payload(data: Dict) -> Payload:
-    logging.info(f'Channel: {data.get("channel")}')
 
-    local_time = local(data.get("epoch"))
-
-    p = Payload.create(
-        type_of=data.get("_type"),
-        availability=data.get("availability"),
-        channel=data.get("channel"),
-        channel_follower_count=data.get("channel_follower_count"),
-        channel_id=data.get("channel_id"),
-        channel_url=data.get("channel_url"),
-        description=data.get("description"),
-        epoch=local_time,
-        extractor=data.get("extractor"),
-        extractor_key=data.get("extractor_key"),
-        payload_id=data.get("id"),
-        modified_date=data.get("modified_date"),
-        original_url=data.get("original_url"),
-        playlist_count=data.get("playlist_count"),
-        release_year=data.get("release_year"),
-        title=data.get("title"),
-        uploader=data.get("uploader"),
-        uploader_id=data.get("uploader_id"),
-        uploader_url=data.get("uploader_url"),
-        view_count=data.get("view_count"),
-        webpage_url=data.get("webpage_url"),
-        webpage_url_basename=data.get("webpage_url_basename"),
-        webpage_url_host=data.get("webpage_url_host"),
-    )
+def payload(
+    data: Dict,
+    checkpoint: Optional[Callable[[List[int]], None]] = None,
+    upsert: bool = False,
+    batch_size: int = ENTRY_BATCH,
+) -> Payload:
+    with metrics.timed("insert payload", rows=1):
+        p = channel(data, upsert)
 
     # Initialize Channel Thumbnails
     channel_thumbnails(p, data.get("thumbnails"))
 
     # Initialize entries
-    entries(data.get("entries"))
+    entries(data.get("entries"), checkpoint, upsert, batch_size)
 
     # Initialize version
-    version(p, data.get("_version"))
+    with metrics.timed("insert version", rows=data.get("_version") is not None):
+        version(p, data.get("_version"))
 
     # Initialize tags
-    channel_tags(p, data.get("tags"))
+    tags = data.get("tags") or []
+    with metrics.timed("insert channeltag", rows=len(tags)):
+        channel_tags(p, tags)
 
     logging.debug(p)
     return p
 
 
-def create(data: Dict):
+# Tables hanging off Entry and Payload, children before their parents.
+VIDEO_TABLES = [
+    RequestedDownload,
+    Subtitle,
+    SubtitleType,
+    Format,
+    Fragment,
+    Heatmap,
+    VideoThumbnail,
+    VideoTag,
+    FormatSortField,
+    VideoCategory,
+    Chapter,
+]
+CHANNEL_TABLES = [ChannelThumbnail, ChannelTag, ChannelCategory, Version]
+
+
+def purge_videos(videos: Union[p.Select, List[int]], entries: bool = True):
+    """
+    Delete entries and every row hanging off them.
+
+    Args:
+        videos (Union[p.Select, List[int]]): Entry ids, or a query selecting them.
+        entries (bool): Also delete the Entry rows, not just their children.
+    """
+    if isinstance(videos, list):
+        for batch in p.chunked(videos, 500):
+            purge_videos(Entry.select(Entry.id).where(Entry.id.in_(batch)), entries)
+        return
+
+    auto_caps = AutomaticCaptions.select(AutomaticCaptions.id).where(
+        AutomaticCaptions.video_id.in_(videos)
+    )
+
+    with db.atomic():
+        Caption.delete().where(Caption.auto_cap.in_(auto_caps)).execute()
+        AutomaticCaptions.delete().where(
+            AutomaticCaptions.video_id.in_(videos)
+        ).execute()
+        for model in VIDEO_TABLES:
+            model.delete().where(model.video_id.in_(videos)).execute()
+        if entries:
+            Entry.delete().where(Entry.id.in_(videos)).execute()
+
+
+def purge(channel_id: Optional[str], videos: Optional[List[int]] = None):
+    """
+    Delete every row loaded for a channel.
+
+    Used to clean up after a failed file whose earlier batches were already
+    committed.
+
+    Args:
+        channel_id (Optional[str]): The channel's YouTube id.
+        videos (Optional[List[int]]): Ids of the channel's entries. Defaults to
+            every entry whose `channel_id` matches.
+    """
+    if channel_id is None:
+        return
+
+    logging.info(f"Purging channel {channel_id}")
+    if videos is None:
+        videos = Entry.select(Entry.id).where(Entry.channel_id == channel_id)
+    channels = Payload.select(Payload.id).where(Payload.channel_id == channel_id)
+
+    with db.atomic():
+        purge_videos(videos)
+        for model in CHANNEL_TABLES:
+            model.delete().where(model.channel_id.in_(channels)).execute()
+        Payload.delete().where(Payload.channel_id == channel_id).execute()
+
+
+def create(
+    data: Dict,
+    commit_every: Optional[int] = None,
+    replace: bool = False,
+    upsert: bool = False,
+):
+    """
+    Load a channel document inside explicit transactions.
+
+    By default the whole file is one transaction. With `commit_every` the work
+    is committed every N entries instead, trading a little atomicity for
+    shorter transactions. Either way a failed file is rolled back and anything
+    it already committed is purged, so no half-loaded channel is left behind.
+
+    `commit_every` only applies to channels not in the database yet: purging
+    on failure would otherwise delete rows an earlier load committed, and
+    `replace` would lose the old version once its purge is committed.
+
+    Args:
+        data (Dict): The channel document.
+        commit_every (Optional[int]): Commit after this many entries.
+        replace (bool): Purge rows from an earlier load of the channel first.
+        upsert (bool): Update the Payload and Entry rows in place, keyed on
+            `channel_id` and `entry_id`, and replace each video's child rows.
+            Videos no longer in the document are kept.
+
+    Raises:
+        ValueError: If `commit_every` is combined with `replace` or `upsert`.
+    """
+    if commit_every and (replace or upsert):
+        raise ValueError("commit_every cannot be combined with replace or upsert")
     logging.debug("create")
-    payload(data)
+    pending: List[int] = []
+    committed: List[int] = []
+
+    try:
+        with db.atomic() as txn:
+
+            def checkpoint(videos: List[int]):
+                pending.extend(videos)
+                if commit_every and len(pending) >= commit_every:
+                    logging.debug(f"commit {len(pending)} entries")
+                    txn.commit()
+                    committed.extend(pending)
+                    pending.clear()
+
+            if replace:
+                purge(data.get("channel_id"))
+
+            # Batches never straddle a commit
+            batch_size = min(commit_every or ENTRY_BATCH, ENTRY_BATCH)
+            payload(data, checkpoint, upsert, batch_size)
+    except Exception:
+        if not is_postgres():
+            # Symbols created within the rolled back transaction are gone,
+            # see `dictionary.outside`
+            dictionary.clear()
+        if committed:
+            purge(data.get("channel_id"), committed)
+        raise
@@ -1,29 +1,14 @@
-import atexit
+import hashlib
 import logging
 import datetime
+import itertools
+import re
 import peewee as p
-from typing import Dict, List, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
 
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s", level=logging.DEBUG
-)
-
-db: p.PostgresqlDatabase = p.PostgresqlDatabase(
-    "youtube",  # Required by Peewee.
-    user="admin",  # Will be passed directly to psycopg2.
-    password="admin",  # Ditto.
-    host="localhost",
-    port="5555",
-)  # Ditto.
-db.connect()
-
-
-def close_db():
-    logging.info("close_db")
-    db.close()
-
-
-atexit.register(close_db)
+from yt_schema import dictionary, heatmap as hm, metrics, rollup, timestamps
+from yt_schema.database import db, is_postgres
+from yt_schema.timestamps import TimestampField
 
 
 class BaseModel(p.Model):
@@ -32,135 +17,629 @@ class BaseModel(p.Model):
 
 
 # Time series Tables for YouTube video and channel data
+# Every row of a snapshot carries the same `timestamp`, in UTC (see `create`).
+# On Postgres these are partitioned by month on `timestamp` (see `init`), so
+# they have no surrogate id: a primary key would have to include the timestamp.
 
 
 class VideoStats(BaseModel):
-    timestamp = p.DateTimeField(default=p.datetime.datetime.now)
+    timestamp = TimestampField(default=timestamps.now)
 
     video_id = p.TextField()
     view_count = p.BigIntegerField()
     comment_count = p.BigIntegerField(null=True)
 
+    class Meta:
+        primary_key = False
+        indexes = ((("video_id", "timestamp"), False),)
+
 
 class ChannelStats(BaseModel):
-    timestamp = p.DateTimeField(default=p.datetime.datetime.now)
+    timestamp = TimestampField(default=timestamps.now)
     channel_id = p.TextField()
 
     subscriber_count = p.BigIntegerField()
     video_count = p.IntegerField()
     view_count = p.BigIntegerField()
 
+    class Meta:
+        primary_key = False
+        indexes = ((("channel_id", "timestamp"), False),)
 
-# Class for heatmap data
+
+# Class for heatmap data: one row per video per snapshot, `values` packed
+# over a shared `heatmap.HeatmapGrid` scaled by `duration` (see `heatmap.decode`)
 class HeatmapStats(BaseModel):
-    timestamp = p.DateTimeField(default=p.datetime.datetime.now)
+    timestamp = TimestampField(default=timestamps.now)
     video_id = p.TextField()
-    start_time = p.DoubleField()
-    end_time = p.DoubleField()
-    value = p.DoubleField()
+    grid = p.ForeignKeyField(hm.HeatmapGrid, column_name="grid", index=False)
+    duration = p.DoubleField()
+    values = p.BlobField()
+
+    class Meta:
+        primary_key = False
+        indexes = ((("video_id", "timestamp"), False),)
+
+
+# Latest values recorded per video, so snapshots can skip unchanged ones
+class LastKnown(BaseModel):
+    video_id = p.TextField(primary_key=True)
+    view_count = p.BigIntegerField(null=True)
+    comment_count = p.BigIntegerField(null=True)
+    # `heatmap_digest` of the last heatmap written
+    heatmap = p.TextField(null=True)
+
+    class Meta:
+        # Ranking by views, see `query.top_videos`
+        indexes = ((("view_count", "video_id"), False),)
 
 
 tables = [VideoStats, ChannelStats, HeatmapStats]
 
+# Views giving every time series row the time it stays current until, the
+# next row of the same key. With `changes_only` a video's row is only written
+# when it changes, so readers look values up as of `t` with
+# `timestamp <= t AND (valid_until IS NULL OR t < valid_until)`.
+VIEWS: Dict[str, Tuple[Type[BaseModel], str]] = {
+    "videostats_filled": (VideoStats, "video_id"),
+    "channelstats_filled": (ChannelStats, "channel_id"),
+    "heatmapstats_filled": (HeatmapStats, "video_id"),
+}
+
+# LastKnown values by video id: (view_count, comment_count, heatmap)
+last_known = dictionary.LRU(dictionary.CACHE_SIZE)
+
+# Values of a video LastKnown has no row for
+UNKNOWN: Tuple = (None, None, None)
+
+# Monthly partitions created ahead of the current month.
+PARTITIONS_AHEAD: int = 3
+
+# Partition names look like videostats_y2024m05.
+PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+# Where heatmap history in the old one-row-per-bucket layout is kept.
+LEGACY_HEATMAPS: str = "heatmapstats_buckets"
+
+# Months whose partitions this process already created.
+ensured: Set[datetime.date] = set()
+
+
+def month(ts: datetime.date, offset: int = 0) -> datetime.date:
+    """
+    First day of the month `offset` months after the one containing `ts`.
+    """
+    n = ts.year * 12 + ts.month - 1 + offset
+    return datetime.date(n // 12, n % 12 + 1, 1)
+
+
+def partition_name(model: Type[BaseModel], start: datetime.date) -> str:
+    return f"{model._meta.table_name}_y{start.year:04d}m{start.month:02d}"
+
+
+def is_partitioned(model: Type[BaseModel]) -> Optional[bool]:
+    """
+    Whether the model's Postgres table is partitioned, or None if it is missing.
+    """
+    cursor = db.execute_sql(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+        (f'"{model._meta.table_name}"',),
+    )
+    row = cursor.fetchone()
+    return None if row is None else row[0] == "p"
+
+
+def create_partitioned(model: Type[BaseModel]):
+    """
+    Create the model's table partitioned by `timestamp` range, with a btree
+    index on its key and `timestamp` plus a BRIN index on `timestamp`, which
+    stays tiny because rows arrive in time order.
+    """
+    table = model._meta.table_name
+    model._meta.table_settings = ['PARTITION BY RANGE ("timestamp")']
+    try:
+        model.create_table()
+    finally:
+        model._meta.table_settings = []
+    db.execute_sql(
+        f'CREATE INDEX IF NOT EXISTS "{table}_timestamp_brin" '
+        f'ON "{table}" USING brin ("timestamp")'
+    )
+
+
+def partition(model: Type[BaseModel]):
+    """
+    Rebuild the model's Postgres table partitioned, with a `timestamptz`
+    `timestamp`, moving its rows over.
+
+    Converts plain tables as well as partitioned ones from before timestamps
+    were stored in UTC, since a partition key cannot change type in place.
+    Old naive timestamps are read in the session's TimeZone.
+    """
+    table = model._meta.table_name
+    legacy = f"{table}_unpartitioned"
+    logging.info(f"partitioning {table}")
+
+    with db.atomic():
+        # The old partitions go along with the old table
+        rename(model, legacy)
+        create_partitioned(model)
+
+        first, last = db.execute_sql(
+            f'SELECT MIN("timestamp"), MAX("timestamp") FROM "{legacy}"'
+        ).fetchone()
+        if first is not None:
+            first, last = timestamps.utc(first), timestamps.utc(last)
+            for i in range(
+                (last.year - first.year) * 12 + last.month - first.month + 1
+            ):
+                create_partition(model, month(first, i))
+
+        cols = ", ".join(f'"{f.column_name}"' for f in model._meta.sorted_fields)
+        db.execute_sql(f'INSERT INTO "{table}" ({cols}) SELECT {cols} FROM "{legacy}"')
+        db.execute_sql(f'DROP TABLE "{legacy}"')
+
+
+def rename(model: Type[BaseModel], to: str):
+    """
+    Rename the model's table to `to`, along with its partitions and indexes,
+    so that a new table can be created under the old names.
+    """
+    table = model._meta.table_name
+
+    def renamed(name: str) -> str:
+        return to + name[len(table) :] if name.startswith(table) else name
+
+    if not is_postgres():
+        db.execute_sql(f'ALTER TABLE "{table}" RENAME TO "{to}"')
+        # SQLite cannot rename an index: recreate it under the new name
+        for index in db.get_indexes(to):
+            if index.sql and renamed(index.name) != index.name:
+                db.execute_sql(f'DROP INDEX "{index.name}"')
+                db.execute_sql(
+                    index.sql.replace(f'"{index.name}"', f'"{renamed(index.name)}"', 1)
+                )
+        return
+
+    names = [table] + [name for name, _ in partitions(model)]
+    cursor = db.execute_sql(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = ANY(%s)",
+        (names,),
+    )
+    for (index,) in cursor.fetchall():
+        if renamed(index) != index:
+            db.execute_sql(f'ALTER INDEX "{index}" RENAME TO "{renamed(index)}"')
+    for name in names:
+        db.execute_sql(f'ALTER TABLE "{name}" RENAME TO "{renamed(name)}"')
+
+
+def create_partition(model: Type[BaseModel], start: datetime.date):
+    # Months in UTC, whatever the session's TimeZone
+    end = month(start, 1)
+    db.execute_sql(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(model, start)}" '
+        f'PARTITION OF "{model._meta.table_name}" '
+        f"FOR VALUES FROM ('{start.isoformat()} 00:00+00') "
+        f"TO ('{end.isoformat()} 00:00+00')"
+    )
+
+
+def ensure_partitions(
+    ts: Optional[datetime.datetime] = None, ahead: int = PARTITIONS_AHEAD
+):
+    """
+    Make sure monthly partitions exist from the month of `ts` (default now)
+    through `ahead` months after it. A no-op on backends without partitioning.
+
+    Months already handled by this process are skipped without a query.
+    """
+    if not is_postgres():
+        return
+
+    ts = ts or timestamps.now()
+    for i in range(ahead + 1):
+        start = month(ts, i)
+        if start in ensured:
+            continue
+        for model in tables:
+            create_partition(model, start)
+        ensured.add(start)
+
+
+def partitions(model: Type[BaseModel]) -> List[Tuple[str, datetime.date]]:
+    """
+    Attached partitions of a table and the month each one starts at, oldest first.
+    """
+    cursor = db.execute_sql(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass",
+        (f'"{model._meta.table_name}"',),
+    )
+    found = []
+    for (name,) in cursor.fetchall():
+        m = PARTITION_NAME.search(name)
+        if m:
+            found.append((name, datetime.date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(found, key=lambda x: x[1])
+
+
+def detach_partitions(before: datetime.date, drop: bool = False) -> List[str]:
+    """
+    Detach every partition whose month ends on or before `before`.
+
+    Detaching only touches the catalog, so it is cheap regardless of size. The
+    detached tables keep their data and can be archived, re-attached or, with
+    `drop`, dropped right away.
+
+    Args:
+        before (datetime.date): Keep partitions holding rows at or after this day.
+        drop (bool): Drop the detached tables instead of keeping them.
+
+    Returns:
+        List[str]: Names of the detached partitions.
+    """
+    if not is_postgres():
+        logging.info("detach_partitions: backend has no partitions")
+        return []
+
+    detached = []
+    with db.atomic():
+        for model in tables:
+            for name, start in partitions(model):
+                if month(start, 1) > before:
+                    continue
+                logging.info(f"detaching {name}")
+                db.execute_sql(
+                    f'ALTER TABLE "{model._meta.table_name}" DETACH PARTITION "{name}"'
+                )
+                if drop:
+                    db.execute_sql(f'DROP TABLE "{name}"')
+                detached.append(name)
+    return detached
+
+
+def init(reset: bool = False):
+    """
+    Create any missing tables. History is kept unless `reset` is given.
+
+    On Postgres the tables are partitioned by month on `timestamp`, existing
+    unpartitioned or naive `timestamp` tables are converted, and partitions are created for the
+    coming `PARTITIONS_AHEAD` months.
+    """
+    # Views pin the tables they read from; they are recreated at the end
+    drop_views()
+
+    if reset:
+        db.drop_tables(tables + [LastKnown], safe=True)
+        ensured.clear()
+        last_known.clear()
+
+    hm.init()
+    rollup.init(reset)
+    db.create_tables([LastKnown])
+
+    # Keep bucket-per-row heatmap history aside instead of mixing layouts
+    table = HeatmapStats._meta.table_name
+    if db.table_exists(table) and "start_time" in [
+        c.name for c in db.get_columns(table)
+    ]:
+        logging.info(f"keeping old heatmap rows as {LEGACY_HEATMAPS}")
+        with db.atomic():
+            rename(HeatmapStats, LEGACY_HEATMAPS)
+
+    if not is_postgres():
+        db.create_tables(tables)
+    else:
+        for model in tables:
+            state = is_partitioned(model)
+            if state is None:
+                create_partitioned(model)
+            elif not state or "timestamp" in timestamps.naive_columns(model):
+                partition(model)
+
+        ensure_partitions()
+
+    create_views()
+
+
+def drop_views():
+    for name in VIEWS:
+        db.execute_sql(f'DROP VIEW IF EXISTS "{name}"')
+
+
+def create_views():
+    for name, (model, key) in VIEWS.items():
+        table = model._meta.table_name
+        cols = ", ".join(f'"{f.column_name}"' for f in model._meta.sorted_fields)
+        db.execute_sql(
+            f'CREATE VIEW "{name}" AS SELECT {cols}, '
+            f'LEAD("timestamp") OVER (PARTITION BY "{key}" ORDER BY "timestamp") '
+            f'AS "valid_until" FROM "{table}"'
+        )
+
 
-db.drop_tables(tables, safe=True)
-db.create_tables(tables)
+# Number of entries written per VideoStats/HeatmapStats batch.
+CHUNK_SIZE: int = 1000
 
 
-def heatmap(data: List[Dict]):
+def known(ids: List[str]) -> Dict[str, Tuple]:
+    """
+    LastKnown values of videos, from the cache or else one query per 500 ids.
+    Videos never recorded get `UNKNOWN`.
+    """
+    found: Dict[str, Tuple] = {}
+    missing = []
+    for i in ids:
+        v = last_known.get(i)
+        if v is None:
+            missing.append(i)
+        else:
+            found[i] = v
+
+    for chunk in p.chunked(list(dict.fromkeys(missing)), 500):
+        rows = dict.fromkeys(chunk, UNKNOWN)
+        query = LastKnown.select(
+            LastKnown.video_id,
+            LastKnown.view_count,
+            LastKnown.comment_count,
+            LastKnown.heatmap,
+        ).where(LastKnown.video_id.in_(chunk))
+        for row in query.tuples():
+            rows[row[0]] = row[1:]
+        for i, v in rows.items():
+            last_known.put(i, v)
+        found.update(rows)
+    return found
+
+
+def remember(rows: List[Dict], fields: List[str]):
+    """
+    Record the latest `fields` of videos in LastKnown and its cache.
+
+    Args:
+        rows (List[Dict]): Rows keyed by `video_id` and `fields`; later rows for
+            the same video win.
+        fields (List[str]): LastKnown columns to update, others are kept.
+    """
+    latest = {r["video_id"]: r for r in rows if r["video_id"] is not None}
+    if not latest:
+        return
+
+    columns = [getattr(LastKnown, f) for f in fields]
+    with metrics.timed("upsert lastknown", rows=len(latest)):
+        for chunk in p.chunked(list(latest.values()), 500):
+            LastKnown.insert_many(
+                [(r["video_id"], *(r[f] for f in fields)) for r in chunk],
+                fields=[LastKnown.video_id, *columns],
+            ).on_conflict(
+                conflict_target=[LastKnown.video_id], preserve=columns
+            ).execute()
+
+    positions = [("view_count", "comment_count", "heatmap").index(f) for f in fields]
+    for i, r in latest.items():
+        v = last_known.get(i)
+        if v is not None:
+            v = list(v)
+            for pos, f in zip(positions, fields):
+                v[pos] = r[f]
+            last_known.put(i, tuple(v))
+
+
+def heatmap_digest(grid: int, duration: float, values: bytes) -> str:
+    return hashlib.sha1(b"%d:%r:" % (grid, duration) + values).hexdigest()
+
+
+def heatmap(
+    data: List[Dict],
+    changes_only: bool = False,
+    ts: Optional[datetime.datetime] = None,
+):
     # Log number of heatmaps
     logging.debug(f"{len(data)} heatmaps stats")
 
-    # Get video id
-    video_id = data[0].get("display_id")
-    hs: List[Tuple[datetime.datetime, str, float, float, float]] = []
+    hs: List[Dict] = []
+    ts = ts or timestamps.now()
 
     for d in data:
-        if "heatmap" in d and d.get("heatmap") is not None:
-            for h in d.get("heatmap"):
-                hs.append(
+        encoded = hm.encode(d.get("heatmap"))
+        if encoded is not None:
+            hs.append(
+                {
+                    "timestamp": ts,
+                    "video_id": d.get("display_id"),
+                    "grid": encoded[0],
+                    "duration": encoded[1],
+                    "values": encoded[2],
+                    "heatmap": heatmap_digest(*encoded),
+                }
+            )
+
+    if changes_only and hs:
+        with metrics.timed("lookup lastknown", rows=len(hs)):
+            last = known([h["video_id"] for h in hs])
+        hs = [h for h in hs if last[h["video_id"]][2] != h["heatmap"]]
+
+    if hs:
+        with metrics.timed("insert heatmapstats", rows=len(hs)):
+            HeatmapStats.insert_many(
+                [
                     (
-                        datetime.datetime.now(),
-                        video_id,
-                        h.get("start_time"),
-                        h.get("end_time"),
-                        h.get("value"),
+                        h["timestamp"],
+                        h["video_id"],
+                        h["grid"],
+                        h["duration"],
+                        h["values"],
                     )
-                )
+                    for h in hs
+                ]
+            ).execute()
+        remember(hs, ["heatmap"])
 
-    HeatmapStats.insert_many(hs).execute()
 
+def video(
+    data: List[Dict],
+    changes_only: bool = False,
+    ts: Optional[datetime.datetime] = None,
+):
+    """
+    Record a chunk of video statistics.
 
-def video(data: List[Dict]):
+    Args:
+        data (List[Dict]): Entries of the snapshot.
+        changes_only (bool): Skip videos whose view and comment counts match
+            the last ones recorded.
+        ts (Optional[datetime.datetime]): Time of the snapshot, default now.
+    """
     # Log number of videos
     logging.debug(f"{len(data)} video stats")
 
-    VideoStats.insert_many(
-        [
-            (
-                datetime.datetime.now(),
-                d.get("display_id"),
-                d.get("view_count"),
-                d.get("comment_count"),
-            )
-            for d in data
+    ts = ts or timestamps.now()
+    rows = [
+        {
+            "timestamp": ts,
+            "video_id": d.get("display_id"),
+            "view_count": d.get("view_count"),
+            "comment_count": d.get("comment_count"),
+        }
+        for d in data
+    ]
+
+    if changes_only:
+        with metrics.timed("lookup lastknown", rows=len(rows)):
+            last = known([r["video_id"] for r in rows])
+        rows = [
+            r
+            for r in rows
+            if last[r["video_id"]][:2] != (r["view_count"], r["comment_count"])
         ]
-    ).execute()
+        logging.debug(f"{len(rows)} changed video stats")
+        if not rows:
+            return
+
+    with metrics.timed("insert videostats", rows=len(rows)):
+        VideoStats.insert_many(rows).execute()
+    remember(rows, ["view_count", "comment_count"])
+    rollup.videos(ts, rows)
 
 
 # find all entries objects
-# If current object has an "entries" key, call this function again with the value of "entries"
+# If current object has an "entries" key, yield the values of "entries" instead
 # Entry objects SHOULD NOT have an "entries" key
-def find_all_entries(data: Dict, total=[]) -> List[Dict]:
-    all_entries = []
-
+def find_all_entries(data: Dict) -> Iterator[Dict]:
     if "entries" in data:
         for entry in data["entries"]:
             if "entries" in entry:
-                all_entries.extend(entry["entries"])
+                yield from entry["entries"]
             else:
-                all_entries.append(entry)
+                yield entry
 
-    return all_entries
 
-
-def channel(data: Dict[str, Union[str, int, List[Dict[str, Union[str, int]]]]]) -> None:
+def channel(
+    data: Dict[str, Union[str, int, List[Dict[str, Union[str, int]]]]],
+    changes_only: bool = False,
+    ts: Optional[datetime.datetime] = None,
+) -> int:
     """
     Record channel statistics.
 
+    Entries are consumed in chunks of `CHUNK_SIZE`, so `data["entries"]` may be a
+    streaming iterable rather than a list.
+
     Args:
         data (Dict[str, Union[str, int, List[Dict[str, Union[str, int]]]]]):
             Dictionary containing channel statistics.
+        changes_only (bool): Only write video and heatmap rows that changed
+            since the last snapshot; see `VIEWS` for reading them back.
+        ts (Optional[datetime.datetime]): Time of the snapshot, stamped on
+            every row written, default now.
 
     Returns:
-        None
+        int: Number of videos recorded.
     """
     logging.debug(f"channel stats: {data['channel']}")
+    ts = ts or timestamps.now()
 
-    all_entries: List[Dict[str, Union[str, int]]] = find_all_entries(data)
-    logging.debug(f"Num of entries: {len(all_entries)}")
+    all_entries: Iterator[Dict[str, Union[str, int]]] = metrics.iterate(
+        "find_all_entries", find_all_entries(data)
+    )
 
-    # Sum up all view counts for each channel from all entries
-    entries: List[int] = [entry["view_count"] for entry in all_entries]
+    subscriber_count: Optional[int] = None
+    video_count: int = 0
+    view_sum: int = 0
 
-    view_sum: int = sum(entries)
+    while True:
+        chunk = list(itertools.islice(all_entries, CHUNK_SIZE))
+        if not chunk:
+            break
 
-    logging.debug(f"Sum of views for channel: {view_sum}")
+        if video_count == 0:
+            subscriber_count = chunk[0].get("channel_follower_count")
 
-    ChannelStats.create(
-        timestamp=datetime.datetime.now(),
-        channel_id=data["channel_id"],
-        subscriber_count=all_entries[0].get("channel_follower_count"),
-        video_count=len(all_entries),
-        view_count=view_sum,
-    )
+        # Sum up all view counts for each channel from all entries
+        video_count += len(chunk)
+        view_sum += sum(entry.get("view_count") or 0 for entry in chunk)
 
-    video(all_entries)
+        video(chunk, changes_only, ts)
 
-    # Get heatmap data
-    heatmap(all_entries)
+        # Get heatmap data
+        heatmap(chunk, changes_only, ts)
 
+    logging.debug(f"Num of entries: {video_count}")
+    logging.debug(f"Sum of views for channel: {view_sum}")
+
+    row = {
+        "timestamp": ts,
+        "channel_id": data["channel_id"],
+        "subscriber_count": subscriber_count,
+        "video_count": video_count,
+        "view_count": view_sum,
+    }
+    with metrics.timed("insert channelstats", rows=1):
+        ChannelStats.insert(row).execute()
+    rollup.channel(ts, row)
+
+    return video_count
+
+
+def create(
+    data: Dict,
+    changes_only: bool = False,
+    ts: Optional[datetime.datetime] = None,
+    then: Optional[Callable[[], None]] = None,
+) -> int:
+    """
+    Record a channel snapshot in one transaction, see `channel`.
 
-def create(data: Dict):
-    # Log keys in the data dictionary
-    channel(data)
+    Args:
+        data (Dict): The channel document.
+        changes_only (bool): See `channel`.
+        ts (Optional[datetime.datetime]): Time of the snapshot, default now.
+        then (Optional[Callable[[], None]]): Called inside the transaction, so
+            what it writes commits with the snapshot, e.g.
+            `manifest.record_snapshot`.
+
+    Returns:
+        int: Number of videos recorded.
+    """
+    # One ingest time for the whole snapshot, taken once
+    ts = ts or timestamps.now()
+    # Outside the transaction, so it never holds locks on the parent tables
+    ensure_partitions(ts)
+
+    # One snapshot per file: either all of it is recorded or none of it
+    # On SQLite take the write lock upfront: the snapshot reads LastKnown
+    # before writing, and a deferred transaction that has to upgrade its lock
+    # fails right away instead of waiting on a concurrent writer
+    try:
+        with db.atomic() if is_postgres() else db.atomic("IMMEDIATE"):
+            videos = channel(data, changes_only, ts)
+            if then is not None:
+                then()
+            return videos
+    except Exception:
+        # LastKnown values of the rolled back transaction are gone, as are
+        # grids on SQLite (see `dictionary.outside`)
+        dictionary.clear()
+        raise
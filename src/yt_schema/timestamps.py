@@ -0,0 +1,139 @@
+import datetime
+import functools
+import logging
+import os
+import peewee as p
+import pytz
+from typing import List, Optional, Set, Type, Union
+
+from yt_schema.database import db, is_postgres
+
+# Timestamps are stored in UTC. Calendar buckets, such as the days of
+# `rollup`, are cut in this zone instead; override with YT_SCHEMA_TZ.
+ZONE: str = os.environ.get("YT_SCHEMA_TZ", "UTC")
+
+# Distinct epochs and dates remembered. The entries of a file share a handful
+# of extraction epochs and a few thousand upload dates.
+CACHE_SIZE: int = 65536
+
+UTC = datetime.timezone.utc
+
+
+class TimestampField(p.DateTimeField):
+    """
+    A point in time: `timestamptz` on Postgres, UTC text on other backends.
+
+    Values are converted to UTC on the way in, naive ones being taken as UTC
+    already, and come back aware in UTC.
+    """
+
+    field_type = "TIMESTAMPTZ"
+
+    def ddl_datatype(self, ctx):
+        return p.SQL("TIMESTAMPTZ" if is_postgres() else "DATETIME")
+
+    def db_value(self, value):
+        if not isinstance(value, datetime.datetime):
+            return super().db_value(value)
+        value = utc(value)
+        # Without an offset SQLite keeps peewee's format, so text comparisons
+        # against other rows and parameters hold
+        return value if is_postgres() else value.replace(tzinfo=None)
+
+    def python_value(self, value):
+        if isinstance(value, str):
+            # Rows written with an offset, which peewee's formats do not parse
+            try:
+                value = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                value = super().python_value(value)
+        if isinstance(value, datetime.datetime):
+            value = utc(value)
+        return value
+
+
+@functools.lru_cache(maxsize=None)
+def zone(name: str) -> datetime.tzinfo:
+    return pytz.timezone(name)
+
+
+def now() -> datetime.datetime:
+    """
+    The current time, in UTC.
+    """
+    return datetime.datetime.now(UTC)
+
+
+def utc(value: datetime.datetime) -> datetime.datetime:
+    """
+    `value` in UTC; naive values are taken to be in UTC already.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=UTC)
+    return value.astimezone(UTC)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def epoch(value: Optional[Union[int, float]]) -> Optional[datetime.datetime]:
+    """
+    A yt-dlp Unix timestamp, such as `epoch` or `release_timestamp`.
+    """
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value, UTC)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def date(value: Optional[str]) -> Optional[datetime.datetime]:
+    """
+    A yt-dlp YYYYMMDD date, as midnight UTC.
+    """
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, "%Y%m%d").replace(tzinfo=UTC)
+
+
+def truncate(ts: datetime.datetime, **fields: int) -> datetime.datetime:
+    """
+    Replace `fields` of `ts` as seen in `ZONE`, e.g. `hour=0` for the start
+    of its day there, and return the result in UTC.
+    """
+    tz = zone(ZONE)
+    local = utc(ts).astimezone(tz).replace(tzinfo=None, **fields)
+    return tz.localize(local).astimezone(UTC)
+
+
+def naive_columns(model: Type[p.Model]) -> Set[str]:
+    """
+    Columns of the model's Postgres table still typed `timestamp`, i.e.
+    created before timestamps were stored in UTC.
+    """
+    cursor = db.execute_sql(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s "
+        "AND data_type = 'timestamp without time zone'",
+        (model._meta.table_name,),
+    )
+    return {name for (name,) in cursor.fetchall()}
+
+
+def upgrade(models: List[Type[p.Model]]):
+    """
+    Convert the `timestamp` columns of TimestampFields to `timestamptz` in
+    place. Postgres reads the old naive values in the session's TimeZone, the
+    zone they were written in. A no-op on other backends.
+
+    Partition keys cannot change type in place; see `timeseries.partition`.
+    """
+    if not is_postgres():
+        return
+    for model in models:
+        table = model._meta.table_name
+        naive = naive_columns(model)
+        for f in model._meta.sorted_fields:
+            if isinstance(f, TimestampField) and f.column_name in naive:
+                logging.info(f"{table}: converting {f.column_name} to timestamptz")
+                db.execute_sql(
+                    f'ALTER TABLE "{table}" ALTER COLUMN "{f.column_name}" '
+                    "TYPE timestamptz"
+                )
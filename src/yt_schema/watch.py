@@ -0,0 +1,376 @@
+import argparse
+import ctypes
+import ctypes.util
+import functools
+import json
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import select
+import signal
+import struct
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from yt_schema import archive, database, manifest, metrics, migrate, tables, timeseries
+from yt_schema.main import init_worker, payload, summary
+
+# Directory watched, as in `main`.
+RESOURCES: str = "resources"
+
+SUFFIX: str = "pretty.json"
+
+# Seconds without new files after which pending ones are ingested.
+WINDOW: float = 2.0
+
+# Ingest anyway once the oldest pending file has waited this long, so a steady
+# trickle of files cannot hold a batch back forever.
+MAX_DELAY: float = 30.0
+
+# Files ingested per micro-batch at most.
+MAX_BATCH: int = 64
+
+# Seconds between two scans when polling.
+POLL_INTERVAL: float = 5.0
+
+# inotify(7) events: a file written and closed, or moved into the directory.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Names of files written into a directory, through inotify via ctypes.
+
+    Only closed writes and renames are reported, so a file is never picked up
+    while the scraper is still writing it.
+    """
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed on {directory}")
+
+    def wait(self, timeout: float) -> Set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        names = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """
+    Fallback for systems without inotify: scan the directory every `interval`
+    seconds.
+
+    A new or modified file is reported once its size and mtime held still
+    for a whole interval, i.e. once it is no longer being written.
+    """
+
+    def __init__(self, directory: str, interval: float = POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.seen = self.scan()
+        # Changed files waiting for their size and mtime to settle
+        self.settling: Dict[str, Tuple[int, float]] = {}
+
+    def scan(self) -> Dict[str, Tuple[int, float]]:
+        stats = {}
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.is_file():
+                    st = e.stat()
+                    stats[e.name] = (st.st_size, st.st_mtime)
+        return stats
+
+    def wait(self, timeout: float) -> Set[str]:
+        time.sleep(min(timeout, self.interval))
+        current = self.scan()
+        names = set()
+        for name, stat in current.items():
+            if self.settling.get(name) == stat:
+                names.add(name)
+                del self.settling[name]
+            elif self.seen.get(name) != stat:
+                self.settling[name] = stat
+        self.seen = current
+        return names
+
+    def close(self):
+        pass
+
+
+def watcher(directory: str, poll: bool = False):
+    if not poll:
+        try:
+            return Inotify(directory)
+        except OSError as e:
+            logging.warning(f"inotify unavailable ({e}), polling instead")
+    return Poller(directory)
+
+
+def write_status(path: str, status: Dict[str, float]):
+    """
+    Write the daemon's gauges to `path`, as Prometheus text if it ends in
+    `.prom` and JSON otherwise. The file is replaced atomically, so it can be
+    served by node_exporter's textfile collector.
+    """
+    with open(path + ".tmp", "w") as f:
+        if path.endswith(".prom"):
+            for name, value in sorted(status.items()):
+                metric = f"{metrics.PREFIX}_watch_{name}"
+                f.write(f"# TYPE {metric} gauge\n{metric} {value}\n")
+        else:
+            json.dump(status, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class Daemon:
+    """
+    Ingest files as they arrive in the resources directory.
+
+    New and modified files are queued, and ingested as a micro-batch once no
+    file arrived for `window` seconds or the oldest one waited `max_delay`.
+    Batches run on a process pool that lives as long as the daemon, so its
+    workers keep their database connections and id caches warm between
+    batches.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        window: float = WINDOW,
+        max_delay: float = MAX_DELAY,
+        poll: bool = False,
+        status: Optional[str] = None,
+        **job,
+    ):
+        self.workers = workers
+        self.window = window
+        self.max_delay = max_delay
+        self.poll = poll
+        self.status_path = status
+        self.job = functools.partial(payload, **job)
+        # File name -> when it was first queued
+        self.pending: Dict[str, float] = {}
+        self.last_event = 0.0
+        self.stopping = False
+        # Totals since start
+        self.batches = 0
+        self.files = 0
+        self.failed = 0
+        self.videos = 0
+        # Seconds from a file's mtime to the end of its ingest, last batch
+        self.freshness = 0.0
+        self.batch_seconds = 0.0
+
+    def stop(self, signum, frame):
+        logging.info("stopping after the current batch")
+        self.stopping = True
+
+    def queue(self, names: Iterator[str]):
+        now = time.time()
+        for name in names:
+            if name.endswith(SUFFIX):
+                self.pending.setdefault(name, now)
+                self.last_event = now
+
+    def lag(self) -> float:
+        """
+        Seconds the oldest queued file has been waiting.
+        """
+        if not self.pending:
+            return 0.0
+        return time.time() - min(self.pending.values())
+
+    def due(self) -> bool:
+        if not self.pending:
+            return False
+        now = time.time()
+        return (
+            now - self.last_event >= self.window
+            or self.lag() >= self.max_delay
+            or len(self.pending) >= MAX_BATCH
+        )
+
+    def status(self) -> Dict[str, float]:
+        return {
+            "queue_depth": len(self.pending),
+            "lag_seconds": self.lag(),
+            "freshness_seconds": self.freshness,
+            "batch_seconds": self.batch_seconds,
+            "batches": self.batches,
+            "files": self.files,
+            "failed": self.failed,
+            "videos": self.videos,
+        }
+
+    def report(self):
+        if self.status_path:
+            write_status(self.status_path, self.status())
+
+    def ingest(self, pool: multiprocessing.pool.Pool):
+        def size(name: str) -> int:
+            try:
+                return os.path.getsize(os.path.join(RESOURCES, name))
+            except FileNotFoundError:
+                return -1
+
+        # Largest first, as in `main`; files deleted meanwhile are dropped
+        batch = sorted(self.pending, key=size, reverse=True)[:MAX_BATCH]
+        for name in batch:
+            del self.pending[name]
+        batch = [name for name in batch if size(name) >= 0]
+        if not batch:
+            return
+
+        logging.info(f"batch of {len(batch)} files, {len(self.pending)} queued")
+        start = time.perf_counter()
+        results = list(pool.imap_unordered(self.job, batch))
+        self.batch_seconds = time.perf_counter() - start
+        summary(results, self.batch_seconds)
+
+        done = time.time()
+        loaded = [r for r in results if not r.skipped]
+        self.batches += 1
+        self.files += len(loaded)
+        self.failed += sum(not r.ok for r in results)
+        self.videos += sum(r.videos for r in results)
+        mtimes = []
+        for r in loaded:
+            try:
+                mtimes.append(os.path.getmtime(os.path.join(RESOURCES, r.file)))
+            except FileNotFoundError:
+                pass
+        if mtimes:
+            self.freshness = done - min(mtimes)
+
+    def run(self):
+        tables.init()
+        migrate.init()
+        timeseries.init()
+        manifest.init()
+        archive.init()
+
+        # Catch up on files that arrived while the daemon was down
+        known = manifest.snapshot()
+        self.queue(
+            name
+            for name in sorted(os.listdir(RESOURCES))
+            if not manifest.unchanged(os.path.join(RESOURCES, name), known)
+        )
+        logging.info(f"watching {RESOURCES}, {len(self.pending)} files queued")
+        # Workers open their own connections; nothing is shared across the fork
+        database.close()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        w = watcher(RESOURCES, self.poll)
+        try:
+            with multiprocessing.Pool(self.workers, initializer=init_worker) as pool:
+                while not self.stopping:
+                    self.queue(w.wait(self.window / 2))
+                    if self.due():
+                        self.ingest(pool)
+                    self.report()
+        finally:
+            w.close()
+        logging.info(
+            f"stopped: {self.batches} batches, {self.files} files, "
+            f"{self.videos} videos, {len(self.pending)} still queued"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Watch the resources folder and ingest files as they arrive."
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="bulk load entries and their child tables with COPY FROM STDIN",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="only record video stats and heatmaps that changed since last seen",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="also keep every document in the compressed raw archive",
+    )
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=WINDOW,
+        help=f"seconds without new files before a batch starts (default: {WINDOW})",
+    )
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=MAX_DELAY,
+        help=f"seconds a file waits at most before its batch starts "
+        f"(default: {MAX_DELAY})",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help=f"scan the folder every {POLL_INTERVAL:g}s instead of using inotify",
+    )
+    parser.add_argument(
+        "--status",
+        metavar="PATH",
+        help="keep queue depth, lag and totals in PATH, as Prometheus text if it "
+        "ends in .prom and JSON otherwise",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    Daemon(
+        args.workers,
+        args.window,
+        args.max_delay,
+        args.poll,
+        args.status,
+        use_copy=args.copy,
+        changes_only=args.changes_only,
+        archive_raw=args.archive,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()